@@ -1,24 +1,56 @@
+import json
 import logging
-import pickle
+import os
+import threading
+import time
 from collections.abc import Generator
+from datetime import datetime, timezone
 from typing import Annotated
 
+import faiss
 import jwt
+import numpy as np
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
+from sentence_transformers import SentenceTransformer
 from sqlmodel import Session
 
 from app import constants
 from app.core import security
+from app.core.artifacts import build_version
 from app.core.config import settings
 from app.core.db import engine
+from app.core.embedding_cache import EmbeddingCache
+from app.core.encoders import BatchingEncoder, OnnxEncoder, TextEncoder
+from app.core.faiss_index import (
+    FIELD_INDEX_PATHS,
+    FusedVectors,
+    IdFilter,
+    MovieVectors,
+    configure_search,
+    index_manifest_mtime,
+    load_field_vectors,
+    read_index_manifest,
+    read_index_mmap,
+    search_index,
+)
+from app.core.genre_rankings import GenreRankings
+from app.core.index_updates import migrate_legacy_indices
+from app.core.lexical_index import TitleLexicalIndex, TitlePrefixIndex
+from app.core.matrix_factorization import (
+    ItemFactorIndex,
+    UserFactorCache,
+    UserFactors,
+    load_mf_factors,
+    mf_model_path,
+)
+from app.core.movie_filters import MovieFilterIndex
+from app.core.ratings import RatingStore
+from app.core.user_topn import UserTopNStore
 from app.models import TokenPayload, User
 
-from sentence_transformers import SentenceTransformer
-import faiss
-
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
 )
@@ -72,65 +104,570 @@ def get_embedding_model() -> SentenceTransformer:
 
 EmbeddingModelDep = Annotated[SentenceTransformer, Depends(get_embedding_model)]
 
+_query_encoder: TextEncoder | None = None
+_query_encoder_lock = threading.Lock()
+
+def query_encoder_name() -> str:
+    # ONNX embeddings differ slightly from PyTorch ones, so cached embeddings are keyed by backend
+    name = constants.EmbeddingModelConstants.MODEL_SENTENCE_TRANSFORMER
+    if settings.ENCODER_BACKEND == "onnx":
+        name += ":onnx-int8" if settings.ENCODER_ONNX_QUANTIZED else ":onnx"
+    return name
+
+def get_query_encoder() -> TextEncoder:
+    """
+    Encoder for request-time queries: the embedding model (or its ONNX export when ENCODER_BACKEND
+    is "onnx") behind a BatchingEncoder when ENCODER_BATCHING is on, so concurrent requests share
+    forward passes. Movie embeddings are always computed with the PyTorch model.
+    """
+    global _query_encoder
+    if _query_encoder is None:
+        with _query_encoder_lock:
+            if _query_encoder is None:
+                if settings.ENCODER_BACKEND == "onnx":
+                    model = OnnxEncoder(
+                        constants.EmbeddingModelConstants.PATH_ONNX_ENCODER_DIR,
+                        constants.EmbeddingModelConstants.ONNX_ENCODER_INT8_FILE
+                        if settings.ENCODER_ONNX_QUANTIZED
+                        else constants.EmbeddingModelConstants.ONNX_ENCODER_FP32_FILE,
+                        settings.ENCODER_INTRA_OP_THREADS,
+                    )
+                else:
+                    model = get_embedding_model()
+                if settings.ENCODER_BATCHING:
+                    model = BatchingEncoder(model, settings.ENCODER_MAX_BATCH_SIZE, settings.ENCODER_BATCH_WINDOW_MS)
+                _query_encoder = model
+    return _query_encoder
+
+QueryEncoderDep = Annotated[TextEncoder, Depends(get_query_encoder)]
+
+def close_query_encoder() -> None:
+    if isinstance(_query_encoder, BatchingEncoder):
+        _query_encoder.close()
+
+_embedding_cache: EmbeddingCache | None = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(
+            settings.EMBEDDING_CACHE_SIZE,
+            query_encoder_name(),
+            constants.EmbeddingModelConstants.VECTOR_EMBEDDING_DIM,
+        )
+    return _embedding_cache
+
+EmbeddingCacheDep = Annotated[EmbeddingCache, Depends(get_embedding_cache)]
+
+def save_embedding_cache() -> None:
+    if _embedding_cache is None or settings.EMBEDDING_CACHE_PERSIST_SIZE <= 0:
+        return
+    saved = _embedding_cache.save(
+        constants.EmbeddingModelConstants.PATH_QUERY_EMBEDDING_CACHE,
+        constants.EmbeddingModelConstants.PATH_QUERY_EMBEDDING_CACHE_KEYS,
+        settings.EMBEDDING_CACHE_PERSIST_SIZE,
+    )
+    logging.info(f"Saved {saved} query embeddings")
+
+_title_prefix_index: TitlePrefixIndex | None = None
+_title_prefix_index_version: tuple | None = None
+_title_prefix_index_lock = threading.Lock()
+
+def title_prefix_index_version() -> tuple:
+    """
+    Titles change with movie upserts/deletes (index manifest) and on an admin rebuild (its own
+    trigger, so that it does not reload the models).
+    """
+    return index_manifest_mtime(), trigger_mtime(constants.PATH_AUTOCOMPLETE_REBUILD_TRIGGER)
+
+def get_title_prefix_index() -> TitlePrefixIndex:
+    """
+    The autocomplete index, rebuilt when movies were upserted or deleted or its rebuild trigger moved.
+    """
+    if _title_prefix_index is None or _title_prefix_index_version != title_prefix_index_version():
+        rebuild_title_prefix_index(force=False)
+    return _title_prefix_index
+
+TitlePrefixIndexDep = Annotated[TitlePrefixIndex, Depends(get_title_prefix_index)]
+
+def rebuild_title_prefix_index(force: bool = True) -> TitlePrefixIndex:
+    """
+    (Re)build the autocomplete index from stg_movie_metadata; requests keep using the old one until it is swapped in.
+    Without `force`, an index already built for the current version is kept.
+    """
+    global _title_prefix_index, _title_prefix_index_version
+    with _title_prefix_index_lock:
+        # Taken before the build, so that a change landing mid-build triggers another one
+        version = title_prefix_index_version()
+        if not force and _title_prefix_index is not None and _title_prefix_index_version == version:
+            return _title_prefix_index
+        with Session(engine) as session:
+            index = TitlePrefixIndex.from_db(session)
+        _title_prefix_index, _title_prefix_index_version = index, version
+    return index
+
+_genre_rankings: GenreRankings | None = None
+_genre_rankings_version: int | None = None
+_genre_rankings_lock = threading.Lock()
+
+def get_genre_rankings() -> GenreRankings:
+    """
+    The per-genre rankings of mv_high_quality_movies, rebuilt when their own trigger moves
+    (POST /admin/genre-rankings/rebuild after refreshing the view).
+    """
+    if _genre_rankings is None or _genre_rankings_version != trigger_mtime(constants.PATH_GENRE_RANKINGS_REBUILD_TRIGGER):
+        rebuild_genre_rankings(force=False)
+    return _genre_rankings
+
+GenreRankingsDep = Annotated[GenreRankings, Depends(get_genre_rankings)]
+
+def rebuild_genre_rankings(force: bool = True) -> GenreRankings:
+    """
+    (Re)build the per-genre rankings; requests keep using the old ones until they are swapped in.
+    Without `force`, rankings already built for the current trigger are kept.
+    """
+    global _genre_rankings, _genre_rankings_version
+    with _genre_rankings_lock:
+        version = trigger_mtime(constants.PATH_GENRE_RANKINGS_REBUILD_TRIGGER)
+        if not force and _genre_rankings is not None and _genre_rankings_version == version:
+            return _genre_rankings
+        with Session(engine) as session:
+            rankings = GenreRankings.from_db(session)
+        _genre_rankings, _genre_rankings_version = rankings, version
+        logging.info(f"Built genre rankings: {len(rankings.rankings)} genres, {len(rankings)} entries")
+    return rankings
+
 class FaissIndexManager:
     def __init__(self):
-        with open(constants.EmbeddingModelConstants.PATH_FAISSID_TO_MOVIEID, "rb") as f:
-            self.id_mapping = pickle.load(f)
-
-        self.title_index = faiss.read_index(constants.EmbeddingModelConstants.PATH_FAISS_TITLE_INDEX)
-        self.content_index = faiss.read_index(constants.EmbeddingModelConstants.PATH_FAISS_CONTENT_INDEX)
-        self.type_index = faiss.read_index(constants.EmbeddingModelConstants.PATH_FAISS_TYPE_INDEX)
-        self.people_index = faiss.read_index(constants.EmbeddingModelConstants.PATH_FAISS_PEOPLE_INDEX)
-
-        with open(constants.EmbeddingModelConstants.PATH_MOVIE_EMBEDDING, "rb") as f:
-            self.movie_embedding = pickle.load(f)
+        # Taken before loading, so that an update landing mid-load triggers another reload
+        self.version = index_manifest_mtime()
+        # Everything below is memory-mapped: loading is near-instant and the uvicorn workers
+        # share one copy of the vectors in the page cache instead of holding private copies
+        _, self.field_vectors = load_field_vectors(mmap_mode="r")
+        self.movie_rows = np.load(constants.EmbeddingModelConstants.PATH_MOVIE_ROWS, mmap_mode="r")
+        # FAISS hits are movie ids; these views look their exact vectors up for re-scoring
+        self.movie_vectors = {field: MovieVectors(vectors, self.movie_rows) for field, vectors in self.field_vectors.items()}
+
+        # Flat, IVF, HNSW or SQ/PQ-compressed depending on how build_faiss_index.py was run
+        self.title_index = self._read_index("title")
+        self.content_index = self._read_index("content")
+        self.type_index = self._read_index("type")
+        self.people_index = self._read_index("people")
+
+        # Optional fused index (build_fused_index.py): one exact weighted search for content-base.
+        # The weights it was built with win over CONTENT_BASE_WEIGHTS; change them by rebuilding it.
+        self.fused_index = None
+        self.fused_vectors = None
+        if os.path.exists(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_INDEX):
+            with open(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_META) as f:
+                fused_weights = json.load(f)["weights"]
+            if fused_weights != constants.CONTENT_BASE_WEIGHTS:
+                logging.warning(f"Fused index was built with weights {fused_weights}, not CONTENT_BASE_WEIGHTS")
+            index = read_index_mmap(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_INDEX)
+            self.fused_index = configure_search(index, nprobe=settings.FAISS_NPROBE, ef_search=settings.FAISS_EF_SEARCH)
+            self.fused_vectors = MovieVectors(FusedVectors(self.field_vectors, fused_weights), self.movie_rows)
+
+        # Optional precomputed content-based neighbours (build_content_neighbors.py), memory-mapped
+        self.content_neighbors = None
+        self.content_neighbor_scores = None
+        self.content_neighbor_rows = None
+        if os.path.exists(constants.EmbeddingModelConstants.PATH_CONTENT_NEIGHBORS):
+            self.content_neighbors = np.load(constants.EmbeddingModelConstants.PATH_CONTENT_NEIGHBORS, mmap_mode="r")
+            self.content_neighbor_scores = np.load(constants.EmbeddingModelConstants.PATH_CONTENT_NEIGHBOR_SCORES, mmap_mode="r")
+            self.content_neighbor_rows = np.load(constants.EmbeddingModelConstants.PATH_CONTENT_NEIGHBOR_ROWS, mmap_mode="r")
+
+        # Genre/decade/language/adult bitmaps over FAISS ids, built from the DB on first use
+        self.filter_index: MovieFilterIndex | None = None
+        self._filter_index_lock = threading.Lock()
+        # BM25/exact-title index over the movies in the FAISS indices, built from the DB on first use
+        self.lexical_index: TitleLexicalIndex | None = None
+        self._lexical_index_lock = threading.Lock()
+
+    @staticmethod
+    def _read_index(field: str) -> faiss.Index:
+        index = read_index_mmap(FIELD_INDEX_PATHS[field])
+        return configure_search(index, nprobe=settings.FAISS_NPROBE, ef_search=settings.FAISS_EF_SEARCH)
 
     def get_indices(self):
         return {"title": self.title_index, "content": self.content_index, "type": self.type_index, "people": self.people_index}
 
-    def get_id_mapping(self):
-        return self.id_mapping
+    def get_field_vectors(self) -> dict[str, MovieVectors]:
+        return self.movie_vectors
 
-    def get_embedding_vector(self, movieId):
-        return self.movie_embedding[movieId]
+    def get_fused_index(self) -> tuple[faiss.Index, MovieVectors] | None:
+        if self.fused_index is None:
+            return None
+        return self.fused_index, self.fused_vectors
 
-_faiss_manager: FaissIndexManager | None = None
+    def has_embeddings(self, movie_ids: np.ndarray) -> np.ndarray:
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        inside = (movie_ids >= 0) & (movie_ids < len(self.movie_rows))
+        return inside & (self.movie_rows[np.where(inside, movie_ids, 0)] >= 0)
 
-def get_faiss_manager() -> FaissIndexManager:
-    global _faiss_manager
-    if _faiss_manager is None:
-        _faiss_manager = FaissIndexManager()
-    return _faiss_manager
+    def get_movie_row(self, movieId: int) -> int:
+        if not self.has_embeddings(movieId):
+            raise KeyError(movieId)
+        return int(self.movie_rows[movieId])
+
+    def get_embedding_vector(self, movieId):
+        """
+        Zero-copy row views into the memory-mapped field matrices; raises KeyError for unknown movies.
+        """
+        row = self.get_movie_row(movieId)
+        return {f"{field}_vector": vectors[row] for field, vectors in self.field_vectors.items()}
+
+    def get_filter_index(self) -> MovieFilterIndex:
+        if self.filter_index is None:
+            with self._filter_index_lock:
+                if self.filter_index is None:
+                    with Session(engine) as session:
+                        self.filter_index = MovieFilterIndex.from_db(session, len(self.movie_rows))
+        return self.filter_index
+
+    def get_lexical_index(self) -> TitleLexicalIndex:
+        if self.lexical_index is None:
+            with self._lexical_index_lock:
+                if self.lexical_index is None:
+                    with Session(engine) as session:
+                        self.lexical_index = TitleLexicalIndex.from_db(session, keep=self.has_embeddings)
+        return self.lexical_index
+
+    def get_content_neighbors(
+        self, movieId: int, k: int, id_filter: IdFilter | None = None
+    ) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Top-k precomputed (movie ids, fused scores) for a seed movie, or None when the table
+        is missing, too short for `k` or has no row for the movie. Neighbours deleted since the
+        table was built are dropped, and with `id_filter` the whole row is filtered; when that
+        leaves fewer than `k` neighbours None is returned so the caller searches live.
+        """
+        if self.content_neighbors is None or k > self.content_neighbors.shape[1]:
+            return None
+        if movieId < 0 or movieId >= len(self.content_neighbor_rows):
+            return None
+        row = self.content_neighbor_rows[movieId]
+        if row < 0 or not self.has_embeddings(movieId):
+            return None
+
+        ids = self.content_neighbors[row]
+        valid = self.has_embeddings(ids)
+        if id_filter is not None:
+            valid &= id_filter.contains(ids)
+        if valid.sum() < min(k, (ids >= 0).sum()):
+            return None
+        return ids[valid][:k], self.content_neighbor_scores[row][valid][:k]
 
 class MFModel:
     def __init__(self):
-        with open(constants.MFModelConstants.PATH_MF_MODEL, "rb") as f:
-            self.model = pickle.load(f)
-
-
-_mf_model: MFModel | None = None
+        # NumPy arrays of the factorization (train_mf.py factors, else the surprise SVD) for
+        # scoring many movies per call
+        self.version = mf_model_version()
+        self.path = mf_model_path()
+        self.factors = load_mf_factors(self.path)
+        logging.info(f"MF model: {self.path}")
+        # Inner-product index over item factors, for retrieving from the whole catalog
+        try:
+            self.item_index: ItemFactorIndex | None = ItemFactorIndex(self.factors)
+        except ValueError as e:
+            logging.warning(f"Collaborative retrieval disabled: {e}")
+            self.item_index = None
+
+        self.fold_in_cache = UserFactorCache(settings.MF_FOLD_IN_CACHE_SIZE)
+
+    def needs_fold_in(self, user_id: int, n_ratings: int) -> bool:
+        """
+        Whether the user is new or their rating count changed since training (with MF_FOLD_IN on).
+        """
+        if not settings.MF_FOLD_IN:
+            return False
+        return self.factors.user_row(user_id) < 0 or self.factors.trained_count(user_id) != n_ratings
+
+    def user_factors(self, user_id: int, movie_ids, ratings) -> UserFactors | None:
+        """
+        Trained factors while the user's ratings match training, otherwise factors folded in from
+        their current ratings and cached until those change. None when neither is available.
+        """
+        trained = self.factors.trained_user(user_id)
+        if not self.needs_fold_in(user_id, len(movie_ids)):
+            return trained
+
+        order = np.argsort(np.asarray(movie_ids), kind="stable")
+        movie_ids, ratings = np.asarray(movie_ids)[order], np.asarray(ratings, dtype=np.float64)[order]
+        fingerprint = UserFactorCache.fingerprint(movie_ids, ratings)
+        user = self.fold_in_cache.get(user_id, fingerprint)
+        if user is None:
+            user = self.factors.fold_in(movie_ids, ratings)
+            if user is None:
+                return trained
+            self.fold_in_cache.put(user_id, fingerprint, user)
+        return user
+
+    def predict_many(self, user: UserFactors | None, movie_ids) -> np.ndarray:
+        return self.factors.predict_for(user, movie_ids)
+
+    def top_items(self, user: UserFactors | None, k: int, exclude=None) -> tuple[np.ndarray, np.ndarray] | None:
+        if self.item_index is None:
+            return None
+        return self.item_index.top_items(user, k, exclude)
+
+
+def mf_model_version() -> tuple[str, int] | None:
+    """
+    The served MF model (resolved factors build or pickle) and its mtime.
+    """
+    path = mf_model_path()
+    try:
+        return os.path.realpath(path), os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
-def get_mf_model() -> MFModel:
-    global _mf_model
-    if _mf_model is None:
-        _mf_model = MFModel()
-    return _mf_model
+def trigger_mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def reload_trigger_mtime() -> int | None:
+    return trigger_mtime(constants.PATH_MODEL_RELOAD_TRIGGER)
+
+def artifact_versions() -> tuple:
+    """
+    What a generation is loaded from: the index manifest, the MF model and the admin reload trigger.
+    A few stats, cheap enough to compare on every request.
+    """
+    return index_manifest_mtime(), mf_model_version(), reload_trigger_mtime()
+
+class ModelGeneration:
+    """
+    One consistent set of serving artifacts: FAISS indices and vectors plus the MF model. A request
+    resolves the current generation once, so a swap mid-request never mixes old and new artifacts,
+    and an old generation stays alive until its last request finishes.
+    """
+
+    def __init__(self, number: int):
+        start = time.perf_counter()
+        self.number = number
+        # Indices from before movie-id keys are converted once, before their version is taken
+        if migrate_legacy_indices():
+            logging.warning("Converted FAISS indices built before movie-id keys")
+        # Taken before loading, so that an update landing mid-load triggers another reload
+        self.versions = artifact_versions()
+        self.index_manifest = read_index_manifest()
+        self.faiss_manager = FaissIndexManager()
+        self.mf_model = MFModel()
+        self.load_seconds = time.perf_counter() - start
+        self.warm_seconds = 0.0
+        self.loaded_at = datetime.now(timezone.utc)
+
+    def warm(self, n_queries: int) -> None:
+        """
+        Build the DB-derived indices and run a few searches and predictions, so that page faults and
+        lazy builds are paid here and not by the first requests after the swap.
+        """
+        start = time.perf_counter()
+        faissManager = self.faiss_manager
+        try:
+            faissManager.get_filter_index()
+        except Exception as e:
+            # Filtered searches retry the build on first use
+            logging.warning(f"Failed to build movie filter bitmaps: {e}")
+        if settings.SEARCH_HYBRID:
+            try:
+                faissManager.get_lexical_index()
+            except Exception as e:
+                # Searches retry the build on first use
+                logging.warning(f"Failed to build title lexical index: {e}")
+
+        movie_ids = np.flatnonzero(np.asarray(faissManager.movie_rows) >= 0)
+        if n_queries > 0 and len(movie_ids):
+            movie_ids = movie_ids[np.linspace(0, len(movie_ids) - 1, min(n_queries, len(movie_ids))).astype(np.int64)]
+            for field, index in faissManager.get_indices().items():
+                vectors = faissManager.movie_vectors[field]
+                search_index(
+                    index, np.asarray(vectors[movie_ids], dtype=np.float32), 10,
+                    vectors=vectors, rescore_factor=settings.FAISS_RESCORE_FACTOR,
+                )
+            fused = faissManager.get_fused_index()
+            if fused is not None:
+                search_index(fused[0], fused[1][movie_ids], 10)
+
+            user_ids = list(self.mf_model.factors.user_rows)[:n_queries]
+            for user_id in user_ids:
+                user = self.mf_model.factors.trained_user(user_id)
+                self.mf_model.top_items(user, 10)
+                self.mf_model.predict_many(user, movie_ids)
+        self.warm_seconds = time.perf_counter() - start
+
+    def info(self) -> dict:
+        return {
+            "generation": self.number,
+            "loaded_at": self.loaded_at.isoformat(),
+            "load_seconds": round(self.load_seconds, 3),
+            "warm_seconds": round(self.warm_seconds, 3),
+            "index_manifest": self.index_manifest,
+            "mf_model": self.mf_model.path,
+        }
+
+_generation: ModelGeneration | None = None
+# Serializes generation loads; requests only wait on it before the first generation exists
+_generation_lock = threading.Lock()
+_reload_thread: threading.Thread | None = None
+_reload_thread_lock = threading.Lock()
+# Versions whose load failed, not retried until an artifact changes again
+_failed_versions: tuple | None = None
+
+def load_generation(if_missing: bool = False) -> ModelGeneration:
+    """
+    Load and warm a new generation, then swap it in with one reference assignment.
+    """
+    global _generation, _failed_versions
+    with _generation_lock:
+        if if_missing and _generation is not None:
+            return _generation
+        number = _generation.number + 1 if _generation is not None else 1
+        try:
+            generation = ModelGeneration(number)
+            generation.warm(settings.MODEL_WARMUP_QUERIES)
+        except Exception:
+            _failed_versions = artifact_versions()
+            raise
+        _generation = generation
+    logging.info(
+        f"Serving model generation {generation.number} "
+        f"(loaded in {generation.load_seconds:.2f}s, warmed in {generation.warm_seconds:.2f}s)"
+    )
+    return generation
+
+def _reload_in_background() -> None:
+    try:
+        load_generation()
+    except Exception as e:
+        logging.error(f"Model reload failed, still serving the previous generation: {e}")
+
+def request_reload() -> bool:
+    """
+    Start loading a new generation in a background thread unless one is already loading.
+    Requests keep being served by the current generation meanwhile.
+    """
+    global _reload_thread
+    with _reload_thread_lock:
+        if _reload_thread is not None and _reload_thread.is_alive():
+            return False
+        _reload_thread = threading.Thread(target=_reload_in_background, name="model-reload", daemon=True)
+        _reload_thread.start()
+    return True
+
+def reload_in_progress() -> bool:
+    return _reload_thread is not None and _reload_thread.is_alive()
+
+def touch_trigger(path: str) -> None:
+    """
+    Bump a trigger file that every worker compares per request.
+    """
+    with open(path, "w") as f:
+        f.write(datetime.now(timezone.utc).isoformat())
+
+def trigger_reload() -> None:
+    """
+    Ask every worker to reload its models.
+    """
+    touch_trigger(constants.PATH_MODEL_RELOAD_TRIGGER)
+
+def get_generation() -> ModelGeneration:
+    """
+    The generation serving this request. The first call loads one synchronously; afterwards a moved
+    artifact version (new index manifest, MF build or reload trigger) starts a background reload
+    and the current generation keeps serving until the new one is warm.
+    """
+    if _generation is None:
+        return load_generation(if_missing=True)
+    if settings.MODEL_HOT_RELOAD:
+        versions = artifact_versions()
+        if versions != _generation.versions and versions != _failed_versions:
+            request_reload()
+    return _generation
+
+GenerationDep = Annotated[ModelGeneration, Depends(get_generation)]
+
+def get_faiss_manager(generation: GenerationDep) -> FaissIndexManager:
+    return generation.faiss_manager
+
+def get_mf_model(generation: GenerationDep) -> MFModel:
+    return generation.mf_model
+
+_user_topn_store: UserTopNStore | None = None
+_user_topn_lock = threading.Lock()
+
+def get_user_topn_store() -> UserTopNStore | None:
+    """
+    The latest precomputed per-user top-N store, or None when none was built. build_user_topn.py
+    swaps a symlink when it finishes; resolving it per request notices the new build.
+    """
+    global _user_topn_store
+    version = build_version(constants.MFModelConstants.PATH_USER_TOPN)
+    if version is None:
+        return None
+    if _user_topn_store is None or _user_topn_store.path != version:
+        with _user_topn_lock:
+            if _user_topn_store is None or _user_topn_store.path != version:
+                _user_topn_store = UserTopNStore(constants.MFModelConstants.PATH_USER_TOPN)
+                logging.info(f"Loaded user top-N store {_user_topn_store.path}")
+                model_path = mf_model_path()
+                if os.path.exists(model_path) and _user_topn_store.meta.get("model_mtime") != os.path.getmtime(model_path):
+                    logging.warning("User top-N store was built from another MF model; rerun build_user_topn")
+    return _user_topn_store
+
+UserTopNDep = Annotated[UserTopNStore | None, Depends(get_user_topn_store)]
+
+_rating_store: RatingStore | None = None
+_rating_store_lock = threading.Lock()
+
+def get_rating_store(session: SessionDep) -> RatingStore | None:
+    """
+    The latest memory-mapped rating snapshot with the ratings inserted since merged in, or None
+    when build_rating_snapshot.py was never run (routes then query stg_rating).
+    """
+    global _rating_store
+    version = build_version(constants.MFModelConstants.PATH_RATING_SNAPSHOT)
+    if version is None:
+        return None
+    if _rating_store is None or _rating_store.path != version:
+        with _rating_store_lock:
+            if _rating_store is None or _rating_store.path != version:
+                _rating_store = RatingStore(
+                    constants.MFModelConstants.PATH_RATING_SNAPSHOT,
+                    max_delta_rows=settings.RATING_DELTA_WARN_ROWS,
+                    lag_keys=settings.RATING_DELTA_LAG_KEYS,
+                )
+                logging.info(f"Loaded rating snapshot {_rating_store.path} up to key_id {_rating_store.watermark}")
+    store = _rating_store
+    store.refresh_delta(session, settings.RATING_DELTA_REFRESH_SECONDS)
+    return store
+
+RatingStoreDep = Annotated[RatingStore | None, Depends(get_rating_store)]
 
 def load_models():
-    global _faiss_manager, _mf_model, _embedding_model
+    global _embedding_model
     try:
-        logging.info("Loading FAISS indexes...")
-        _faiss_manager = FaissIndexManager()
+        logging.info("Loading FAISS indexes and MF model...")
+        load_generation()
     except Exception as e:
-        logging.error(f"Failed to load FAISS indexes: {e}")
+        logging.error(f"Failed to load model generation: {e}")
         raise
 
     try:
-        logging.info("Loading MF model...")
-        _mf_model = MFModel()
+        logging.info("Building title autocomplete index...")
+        rebuild_title_prefix_index()
     except Exception as e:
-        logging.error(f"Failed to load MF model: {e}")
-        raise
+        # Autocomplete retries the build on first use
+        logging.warning(f"Failed to build title autocomplete index: {e}")
+
+    try:
+        logging.info("Building genre rankings...")
+        rebuild_genre_rankings()
+    except Exception as e:
+        # /by-genres retries the build on first use
+        logging.warning(f"Failed to build genre rankings: {e}")
 
     try:
         logging.info("Loading embedding model...")
@@ -139,4 +676,22 @@ def load_models():
         logging.error(f"Failed to load embedding model: {e}")
         raise
 
+    try:
+        logging.info(f"Loading {settings.ENCODER_BACKEND} query encoder...")
+        get_query_encoder().encode(["warmup"], normalize_embeddings=True)
+    except Exception as e:
+        logging.error(f"Failed to load query encoder: {e}")
+        raise
+
+    if settings.EMBEDDING_CACHE_PERSIST_SIZE > 0:
+        try:
+            loaded = get_embedding_cache().load(
+                constants.EmbeddingModelConstants.PATH_QUERY_EMBEDDING_CACHE,
+                constants.EmbeddingModelConstants.PATH_QUERY_EMBEDDING_CACHE_KEYS,
+            )
+            logging.info(f"Preloaded {loaded} query embeddings")
+        except Exception as e:
+            # A cold cache is only slower
+            logging.warning(f"Failed to preload query embeddings: {e}")
+
     logging.info("All models loaded successfully.")
\ No newline at end of file
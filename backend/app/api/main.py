@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.routes import items, login, private, users, utils, recommender, genres, movies
+from app.api.routes import admin, items, login, private, users, utils, recommender, genres, movies
 from app.core.config import settings
 
 api_router = APIRouter()
@@ -11,6 +11,7 @@ api_router.include_router(items.router)
 api_router.include_router(recommender.router)
 api_router.include_router(genres.router)
 api_router.include_router(movies.router)
+api_router.include_router(admin.router)
 
 if settings.ENVIRONMENT == "local":
     api_router.include_router(private.router)
@@ -0,0 +1,147 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app import constants
+from app.api.deps import (
+    EmbeddingCacheDep,
+    EmbeddingModelDep,
+    GenerationDep,
+    QueryEncoderDep,
+    RatingStoreDep,
+    SessionDep,
+    get_current_active_superuser,
+    rebuild_genre_rankings,
+    rebuild_title_prefix_index,
+    reload_in_progress,
+    request_reload,
+    touch_trigger,
+    trigger_reload,
+)
+from app.core.encoders import BatchingEncoder
+from app.core.index_updates import delete_movies, encode_movies, upsert_movies
+from app.models import Message
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(get_current_active_superuser)],
+)
+
+
+@router.put("/movies/{movie_id}/embedding")
+def upsert_movie_embedding(
+    movie_id: int, session: SessionDep, embeddingModel: EmbeddingModelDep
+) -> Message:
+    """
+    Encode a movie from the database and add it to (or replace it in) the FAISS indices.
+    Serving workers pick the change up on their next request.
+    """
+    ids, vectors = encode_movies(session, embeddingModel, [movie_id])
+    if len(ids) == 0:
+        raise HTTPException(
+            status_code=404, detail=f"Movie with ID {movie_id} not found"
+        )
+
+    try:
+        added = upsert_movies(ids, vectors)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Message(
+        message=f"Movie {movie_id} {'added to' if added else 'updated in'} the index"
+    )
+
+
+@router.delete("/movies/{movie_id}/embedding")
+def delete_movie_embedding(movie_id: int) -> Message:
+    """
+    Remove a movie from the FAISS indices.
+    """
+    try:
+        removed = delete_movies([movie_id])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not removed:
+        raise HTTPException(
+            status_code=404, detail=f"Movie with ID {movie_id} is not in the index"
+        )
+    return Message(message=f"Movie {movie_id} removed from the index")
+
+
+@router.get("/embedding-cache")
+def embedding_cache_stats(embeddingCache: EmbeddingCacheDep) -> dict[str, float]:
+    """
+    Size and hit/miss counters of this worker's query embedding cache.
+    """
+    return embeddingCache.stats()
+
+
+@router.get("/query-encoder")
+def query_encoder_stats(queryEncoder: QueryEncoderDep) -> dict:
+    """
+    Batch-size distribution, queueing delay and encode time of this worker's batching query encoder.
+    """
+    if not isinstance(queryEncoder, BatchingEncoder):
+        raise HTTPException(
+            status_code=404, detail="Query encoder batching is disabled"
+        )
+    return queryEncoder.stats()
+
+
+@router.get("/rating-store")
+def rating_store_stats(ratingStore: RatingStoreDep) -> dict:
+    """
+    This worker's rating snapshot and the delta accumulated since; `rebuild_recommended` means
+    build_rating_snapshot.py is due.
+    """
+    if ratingStore is None:
+        raise HTTPException(
+            status_code=404,
+            detail="No rating snapshot; run `python -m app.build_rating_snapshot`",
+        )
+    return ratingStore.stats()
+
+
+@router.post("/autocomplete/rebuild")
+def rebuild_autocomplete() -> Message:
+    """
+    Rebuild the title autocomplete index from stg_movie_metadata in every worker: this one now,
+    the others on their next autocomplete request.
+    """
+    touch_trigger(constants.PATH_AUTOCOMPLETE_REBUILD_TRIGGER)
+    index = rebuild_title_prefix_index(force=False)
+    return Message(
+        message=f"Autocomplete index rebuilt with {len(index.movie_ids)} movies"
+    )
+
+
+@router.post("/genre-rankings/rebuild")
+def rebuild_genre_ranking_lists() -> Message:
+    """
+    Rebuild the per-genre rankings from mv_high_quality_movies in every worker: this one now, the
+    others on their next request.
+    """
+    touch_trigger(constants.PATH_GENRE_RANKINGS_REBUILD_TRIGGER)
+    rankings = rebuild_genre_rankings(force=False)
+    return Message(
+        message=f"Genre rankings rebuilt with {len(rankings.rankings)} genres"
+    )
+
+
+@router.get("/models")
+def model_generation(generation: GenerationDep) -> dict:
+    """
+    The FAISS/MF generation serving this worker, and whether a newer one is loading.
+    """
+    return {**generation.info(), "reloading": reload_in_progress()}
+
+
+@router.post("/models/reload", status_code=202)
+def reload_models() -> Message:
+    """
+    Reload the FAISS indices and MF model in every worker. Each loads and warms a new generation in
+    the background and swaps it in; requests are served by the old one until then.
+    """
+    trigger_reload()
+    request_reload()
+    return Message(
+        message="Reload started; workers swap in the new generation once it is loaded and warmed"
+    )
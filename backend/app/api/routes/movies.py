@@ -2,11 +2,11 @@ from datetime import date
 from http.client import HTTPException
 from typing import Optional, List
 from pydantic import BaseModel
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 from sqlmodel import select, func
-from app.api.deps import SessionDep
+from app.api.deps import SessionDep, TitlePrefixIndexDep
 from app.models import StgMovieMetadata, StgGenre, StgCast, MoviePublic, CastPublic, MoviesPublic, \
-    MoviePublicWithRating, StgRating
+    MoviePublicWithRating, StgRating, MovieSuggestion
 
 router = APIRouter(prefix="/movies", tags=["movies"])
 
@@ -79,6 +79,27 @@ def get_movies(
     return MoviesPublic(data=movie_data, count=count)
 
 
+@router.get("/autocomplete", response_model=List[MovieSuggestion])
+def autocomplete_movies(
+        titleIndex: TitlePrefixIndexDep,
+        q: str = Query(min_length=1, max_length=200),
+        limit: int = Query(default=10, ge=1, le=50),
+) -> List[MovieSuggestion]:
+    """
+    Movies whose title or original title starts with `q` (case, accents and punctuation ignored), most voted first.
+    """
+    return [
+        MovieSuggestion(
+            id=int(titleIndex.movie_ids[row]),
+            title=titleIndex.titles[row],
+            original_title=titleIndex.original_titles[row],
+            release_date=titleIndex.release_dates[row],
+            vote_count=int(titleIndex.vote_counts[row]),
+        )
+        for row in titleIndex.suggest(q, limit)
+    ]
+
+
 @router.get("/{id}", response_model=MoviePublic)
 def get_movie_by_id(session: SessionDep, id: int) -> MoviePublic:
     """
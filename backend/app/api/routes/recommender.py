@@ -1,14 +1,29 @@
-from typing import List, Optional, Annotated
+import math
+from typing import List, Optional, Annotated, Tuple
 
+import numpy as np
 from app import constants
 from app.api.routes.movies import get_movies_by_ids
-from app.models import MoviePublic, CastPublic, MoviePublicWr, StgMovieMetadata, StgRating
+from app.models import MoviePublic, MoviePublicWr, StgMovieMetadata, StgRating
 from sqlalchemy import text
 from sqlmodel import select
 from pydantic import BaseModel
 from fastapi import APIRouter, HTTPException, Depends
-from app.api.deps import SessionDep, EmbeddingModelDep, FaissIndexManager, get_faiss_manager, MFModel, get_mf_model
-from app.core.ml_compute import get_embedding, multi_search_faiss_index, search_by_faiss_index
+from app.api.deps import SessionDep, QueryEncoderDep, EmbeddingCacheDep, FaissIndexManager, get_faiss_manager, MFModel, get_mf_model, UserTopNDep, RatingStoreDep, GenreRankingsDep
+from app.core.config import settings
+from app.core.faiss_index import IdFilter
+from app.core.genre_rankings import GenreRankings
+from app.core.matrix_factorization import rank_predictions
+from app.core.ml_compute import (
+    batch_multi_search_faiss_index,
+    get_query_embeddings,
+    get_search_executor,
+    merge_candidates,
+    reserve_slots,
+    reciprocal_rank_fusion,
+    search_by_faiss_index,
+    search_fused_index,
+)
 
 
 router = APIRouter(prefix="/recommender", tags=["recommender"])
@@ -36,216 +51,207 @@ class MovieRecommendationResponse(BaseModel):
 def recommend_movies_by_genres(
     *,
     session: SessionDep,
+    genreRankings: GenreRankingsDep,
     request_body: GenreRecommendationRequest,
 ) -> MovieRecommendationResponse:
     """
-    Retrieve top `limit` movies per genre, sorted by wr_80th, with full MoviePublic details.
+    Retrieve the top `limit` movies over the given genres, sorted by wr_80th, with full MoviePublic details.
     """
     try:
-        # Step 1: Get top movies per genre
-        query = """
-        WITH RankedMovies AS (
-            SELECT 
-                h.genre,
-                h.movie_id,
-                h.title,
-                h.vote_count,
-                m.original_title,
-                m.belongs_to_collection,
-                m.release_date,
-                m.overview,
-                m.tagline,
-                m.homepage,
-                m.poster_path,
-                m.vote_average,
-                m.imdb_id,
-                m.tmdb_id,
-                m.keywords,
-                h.wr_80th,
-                ROW_NUMBER() OVER (
-                    PARTITION BY h.genre
-                    ORDER BY h.wr_80th DESC, h.movie_id
-                ) AS row_num
-            FROM mv_high_quality_movies h
-            JOIN stg_movie_metadata m ON h.movie_id = m.id
-            WHERE h.genre = ANY(:genres)
-            AND h.wr_80th IS NOT NULL
-        )
-        SELECT 
-            movie_id AS id,
-            title,
-            original_title,
-            belongs_to_collection,
-            release_date,
-            overview,
-            tagline,
-            homepage,
-            poster_path,
-            vote_average,
-            vote_count,
-            imdb_id,
-            tmdb_id,
-            keywords,
-            wr_80th
-        FROM RankedMovies
-        WHERE row_num <= :limit
-        ORDER BY wr_80th DESC, movie_id
-        LIMIT :limit;
-        """
-        result = session.execute(
-            text(query),
-            {"genres": request_body.genres, "limit": request_body.limit}
-        )
-        movie_data = [
-            {
-                "id": row.id,
-                "title": row.title,
-                "original_title": row.original_title,
-                "belongs_to_collection": row.belongs_to_collection,
-                "release_date": row.release_date,
-                "overview": row.overview,
-                "tagline": row.tagline,
-                "homepage": row.homepage,
-                "poster_path": row.poster_path,
-                "vote_average": row.vote_average,
-                "vote_count": row.vote_count,
-                "imdb_id": row.imdb_id,
-                "tmdb_id": row.tmdb_id,
-                "keywords": row.keywords,
-                "wr": row.wr_80th,
-            }
-            for row in result
-        ]
-
-        if not movie_data:
+        # Gộp danh sách xếp hạng của từng thể loại (tính sẵn trong bộ nhớ) bằng k-way merge, bỏ phim trùng
+        movie_ids, scores = genreRankings.top(request_body.genres, request_body.limit)
+        if len(movie_ids) == 0:
             raise HTTPException(status_code=404, detail="No movies found for the specified genres")
 
-        movie_ids = [movie["id"] for movie in movie_data]
-        genre_query = """
-        SELECT movie_id, genre
-        FROM stg_genre
-        WHERE movie_id = ANY(:movie_ids) AND genre IS NOT NULL AND genre != '';
-        """
-        genre_result = session.execute(
-            text(genre_query),
-            {"movie_ids": movie_ids}
-        )
-        genre_dict = {}
-        for row in genre_result:
-            if row.movie_id not in genre_dict:
-                genre_dict[row.movie_id] = []
-            genre_dict[row.movie_id].append(row.genre)
-
-        cast_query = """
-        SELECT movie_id, name, role
-        FROM stg_cast
-        WHERE movie_id = ANY(:movie_ids) AND name IS NOT NULL;
-        """
-        cast_result = session.execute(
-            text(cast_query),
-            {"movie_ids": movie_ids}  # Pass movie_ids as a Python list
-        )
-        cast_dict = {}
-        for row in cast_result:
-            if row.movie_id not in cast_dict:
-                cast_dict[row.movie_id] = []
-            cast_dict[row.movie_id].append({"name": row.name, "role": row.role})
-
-        recommendations = []
-        for movie in movie_data:
-            keyword_list = (
-                [kw.strip() for kw in movie["keywords"].split(",") if kw.strip()]
-                if movie["keywords"]
-                else []
-            )
-            genres_list = genre_dict.get(movie["id"], [])
-            cast_list = [
-                CastPublic(name=c["name"], role=c["role"])
-                for c in cast_dict.get(movie["id"], [])
-            ]
-            recommendations.append(
-                MoviePublicWr(
-                    id=movie["id"],
-                    title=movie["title"],
-                    original_title=movie["original_title"],
-                    belongs_to_collection=movie["belongs_to_collection"],
-                    release_date=movie["release_date"],
-                    overview=movie["overview"],
-                    tagline=movie["tagline"],
-                    homepage=movie["homepage"],
-                    poster_path=movie["poster_path"],
-                    vote_average=movie["vote_average"],
-                    vote_count=movie["vote_count"],
-                    imdb_id=movie["imdb_id"],
-                    tmdb_id=movie["tmdb_id"],
-                    genres=genres_list,
-                    cast=cast_list,
-                    keywords=keyword_list,
-                    wr=movie["wr"],
-                )
-            )
-
+        # Chỉ còn bước hydrate truy vấn DB
+        recommendations = hydrate_scored_movies(session, movie_ids, scores)
         return MovieRecommendationResponse(recommendations=recommendations)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+def hydrate_scored_movies(session: SessionDep, movie_ids: np.ndarray, scores: np.ndarray) -> List[MoviePublicWr]:
+    """
+    Load full movie details for ranked ids and attach each movie's score as `wr`.
+    """
+    return hydrate_scored_movies_batch(session, [(movie_ids, scores)])[0]
+
+
+def hydrate_scored_movies_batch(
+    session: SessionDep, results: List[Tuple[np.ndarray, np.ndarray]]
+) -> List[List[MoviePublicWr]]:
+    """
+    `hydrate_scored_movies` for several ranked lists: the union of their ids is loaded once.
+    """
+    movie_ids = list(dict.fromkeys(movie_id for ids, _ in results for movie_id in ids.tolist()))
+    if not movie_ids:
+        return [[] for _ in results]
+    movie_by_id = {movie.id: movie.model_dump() for movie in get_movies_by_ids(session, movie_ids)}
+    return [
+        [
+            MoviePublicWr(**movie_by_id[movie_id], wr=score)
+            for movie_id, score in zip(ids.tolist(), scores.tolist(), strict=True)
+            if movie_id in movie_by_id
+        ]
+        for ids, scores in results
+    ]
+
+
+class MovieFilter(BaseModel):
+    genres: Optional[List[str]] = None
+    decades: Optional[List[int]] = None
+    languages: Optional[List[str]] = None
+    adult: Optional[bool] = None
+
+
+def build_id_filter(faissManager: FaissIndexManager, filters: Optional[MovieFilter]) -> Optional[IdFilter]:
+    """
+    Turn the request filters into a FAISS id filter, or None when they do not restrict anything.
+    """
+    if filters is None:
+        return None
+    return faissManager.get_filter_index().build_filter(
+        genres=filters.genres, decades=filters.decades, languages=filters.languages, adult=filters.adult
+    )
+
+
+def validate_search_query(query: str) -> str:
+    query = query.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    if len(query) < 3:
+        raise HTTPException(status_code=400, detail="Query must be at least 3 characters")
+    if len(query) > 500:
+        raise HTTPException(status_code=400, detail="Query must not exceed 500 characters")
+    return query
+
+
+def rank_search_queries(
+    queries: List[str],
+    top_k: int,
+    queryEncoder: QueryEncoderDep,
+    embeddingCache: EmbeddingCacheDep,
+    faissManager: FaissIndexManager,
+    id_filter: Optional[IdFilter],
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Ranked (movie ids, scores) per query. With SEARCH_HYBRID a query that exactly matches a title is
+    answered from the lexical index without encoding; the others blend their lexical and vector hits
+    by reciprocal-rank fusion. Queries that need vectors are encoded in one call and searched together.
+    """
+    results: List[Optional[Tuple[np.ndarray, np.ndarray]]] = [None] * len(queries)
+    lexical_ids = {}
+    if settings.SEARCH_HYBRID:
+        lexical_index = faissManager.get_lexical_index()
+        for i, query in enumerate(queries):
+            hits = lexical_index.search(query, top_k, id_filter)
+            if len(lexical_index.exact_matches(query, id_filter)) > 0:
+                results[i] = hits
+            else:
+                lexical_ids[i] = hits[0]
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        # Tạo embedding cho các query còn lại (lấy từ cache nếu query đã được tìm trước đó)
+        query_embeddings = get_query_embeddings(
+            [queries[i] for i in pending], queryEncoder, embeddingCache,
+            constants.EmbeddingModelConstants.VECTOR_EMBEDDING_DIM,
+        )
+        searched = batch_multi_search_faiss_index(
+            query_embeddings, faissManager.get_indices(), top_k, faissManager.get_field_vectors(), id_filter
+        )
+        for i, (movie_ids, scores) in zip(pending, searched, strict=True):
+            if len(lexical_ids.get(i, ())) > 0:
+                results[i] = reciprocal_rank_fusion([movie_ids, lexical_ids[i]], top_k, settings.SEARCH_RRF_K)
+            else:
+                results[i] = movie_ids, scores
+    return results
+
+
 class SearchRequest(BaseModel):
     query: str
     limit: Optional[int] = 20
+    filters: Optional[MovieFilter] = None
 
 
 @router.post("/search", response_model=MovieRecommendationResponse)
 def search_movies(
     *,
     session: SessionDep,
-    embeddingModel: EmbeddingModelDep,
+    queryEncoder: QueryEncoderDep,
+    embeddingCache: EmbeddingCacheDep,
     faissManager: Annotated[FaissIndexManager, Depends(get_faiss_manager)],
     request: SearchRequest
 ):
     # Validate input
-    query = request.query.strip()
-    if not query:
-        raise HTTPException(status_code=400, detail="Query cannot be empty")
-    if len(query) < 3:
-        raise HTTPException(status_code=400, detail="Query must be at least 3 characters")
-    if len(query) > 500:
-        raise HTTPException(status_code=400, detail="Query must not exceed 500 characters")
+    query = validate_search_query(request.query)
 
     top_k = request.limit
     if top_k < 1 or top_k > 50:
         raise HTTPException(status_code=400, detail="top_k must be between 1 and 50")
 
-    # Tạo embedding cho query
-    query_embedding = get_embedding(query, embeddingModel, constants.EmbeddingModelConstants.VECTOR_EMBEDDING_DIM)
-
-    result_raw = multi_search_faiss_index(query_embedding, faissManager.get_indices(), faissManager.get_id_mapping(), top_k)
-    movie_scores = dict()
-    for r in result_raw:
-        similarity = r["distance"]  # cosine similarity
-        score = similarity
-        movie_id = r["movieId"]
-        movie_scores[movie_id] = max(movie_scores.get(movie_id, 0), score)
-
-    sorted_movies = sorted(
-        [{"movieId": movie_id, "score": score} for movie_id, score in movie_scores.items()],
-        key=lambda x: x["score"],
-        reverse=True
-    )
+    # Lọc theo thể loại/thập niên/ngôn ngữ ngay trong FAISS thay vì lọc sau khi search
+    id_filter = build_id_filter(faissManager, request.filters)
+    movie_ids, scores = rank_search_queries(
+        [query], top_k, queryEncoder, embeddingCache, faissManager, id_filter
+    )[0]
+
+    return MovieRecommendationResponse(recommendations=hydrate_scored_movies(session, movie_ids, scores))
+
+# 200 truy vấn x 50 phim vẫn nằm dưới giới hạn 65535 tham số của PostgreSQL khi hydrate
+MAX_BATCH_SEARCH_QUERIES = 200
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    limit: Optional[int] = 20
+    filters: Optional[MovieFilter] = None
 
-    sorted_movies = sorted_movies[:top_k]
 
-    movie_public = get_movies_by_ids(session, [m["movieId"] for m in sorted_movies])
+class BatchSearchResponse(BaseModel):
+    results: List[MovieRecommendationResponse]
 
-    return MovieRecommendationResponse(recommendations=[
-        MoviePublicWr(**movie.model_dump(), wr=sorted_movies[i]["score"])
-        for i, movie in enumerate(movie_public)
-    ])
+
+@router.post("/search/batch", response_model=BatchSearchResponse)
+def search_movies_batch(
+    *,
+    session: SessionDep,
+    queryEncoder: QueryEncoderDep,
+    embeddingCache: EmbeddingCacheDep,
+    faissManager: Annotated[FaissIndexManager, Depends(get_faiss_manager)],
+    request: BatchSearchRequest
+) -> BatchSearchResponse:
+    """
+    `/search` for many queries at once; results come back in the order of `queries`.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="Queries cannot be empty")
+    if len(request.queries) > MAX_BATCH_SEARCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SEARCH_QUERIES} queries per request")
+    queries = [validate_search_query(query) for query in request.queries]
+
+    top_k = request.limit
+    if top_k < 1 or top_k > 50:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 50")
+
+    # Encode tất cả query cần vector bằng một lần gọi encode, mỗi field chỉ search FAISS một lần
+    id_filter = build_id_filter(faissManager, request.filters)
+    results = rank_search_queries(queries, top_k, queryEncoder, embeddingCache, faissManager, id_filter)
+
+    return BatchSearchResponse(
+        results=[
+            MovieRecommendationResponse(recommendations=recommendations)
+            for recommendations in hydrate_scored_movies_batch(session, results)
+        ]
+    )
 
 class ContentBaseRequest(BaseModel):
     movieId: int
     limit: Optional[int] = 20
+    filters: Optional[MovieFilter] = None
 
 
 @router.post("/content-base", response_model=MovieRecommendationResponse)
@@ -269,117 +275,173 @@ def content_based_recommendation(
     if not movie:
         raise HTTPException(status_code=404, detail=f"Movie with ID {movie_id} not found")
 
-    # Lấy embedding
-    embedding_dict = faissManager.get_embedding_vector(movie_id)
-
-    result_raw = search_by_faiss_index(embedding_dict, faissManager.get_indices(), faissManager.get_id_mapping(), top_k)
-
-    movie_scores = dict()
-    weight = {
-        "title": 0.45,
-        "content": 0.2,
-        "type": 0.1,
-        "people": 0.25
-    }
-    for r in result_raw:
-        similarity = r["distance"]  # cosine similarity
-        score = similarity
-        movie_id = r["movieId"]
-        movie_scores[movie_id] = movie_scores.get(movie_id, 0) + score*weight.get(r["type"], 0)
-
-    sorted_movies = sorted(
-        [{"movieId": movie_id, "score": score} for movie_id, score in movie_scores.items()],
-        key=lambda x: x["score"],
-        reverse=True
-    )
+    id_filter = build_id_filter(faissManager, request.filters)
+    similar = similar_movies(faissManager, movie_id, top_k, id_filter)
+    if similar is None:
+        raise HTTPException(status_code=404, detail=f"Movie with ID {movie_id} has no embedding")
 
-    sorted_movies = sorted_movies[:top_k]
+    return MovieRecommendationResponse(recommendations=hydrate_scored_movies(session, *similar))
 
-    movie_public = get_movies_by_ids(session, [m["movieId"] for m in sorted_movies])
 
-    return MovieRecommendationResponse(recommendations=[
-        MoviePublicWr(**movie.model_dump(), wr=sorted_movies[i]["score"])
-        for i, movie in enumerate(movie_public)
-    ])
+def similar_movies(
+    faissManager: FaissIndexManager, movie_id: int, top_k: int, id_filter: Optional[IdFilter] = None
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Content-based neighbours of a movie as (movie ids, scores), or None when it has no embedding.
+    """
+    # Tra bảng láng giềng tính sẵn trước, chỉ search FAISS trực tiếp khi phim chưa có trong bảng
+    neighbors = faissManager.get_content_neighbors(movie_id, top_k, id_filter)
+    if neighbors is not None:
+        return neighbors
+    if not faissManager.has_embeddings(movie_id):
+        return None
+
+    fused = faissManager.get_fused_index()
+    if fused is not None:
+        # Một lần search trên index gộp cho ra đúng top-k theo tổng có trọng số
+        fused_index, fused_vectors = fused
+        return search_fused_index(fused_vectors[movie_id], fused_index, top_k, fused_vectors, id_filter)
+
+    # Lấy embedding; mỗi field lấy CONTENT_NEIGHBORS_K kết quả rồi mới gộp, giống bảng láng giềng tính sẵn,
+    # để phim có và không có trong bảng được trả về cùng một kết quả
+    embedding_dict = faissManager.get_embedding_vector(movie_id)
+    return search_by_faiss_index(
+        embedding_dict, faissManager.get_indices(), top_k, constants.CONTENT_BASE_WEIGHTS,
+        faissManager.get_field_vectors(), id_filter, field_k=constants.EmbeddingModelConstants.CONTENT_NEIGHBORS_K
+    )
 
 
 class CollaborativeRequest(BaseModel):
     userId: int
     top_n: Optional[int] = 15
 
+# User có ít hơn FEW_RATINGS đánh giá lấy ứng viên theo nội dung từ CONTENT_SEEDS phim được đánh giá cao nhất,
+# còn lại lấy GENRE_CANDIDATES phim chất lượng cao thuộc các thể loại user xem nhiều nhất
+FEW_RATINGS = 10
+CONTENT_SEEDS = 3
+CONTENT_CANDIDATES_PER_SEED = 5
+TOP_GENRES = 3
+GENRE_CANDIDATES = 15
+# Tỉ lệ chỗ trong top-n dành cho ứng viên nội dung/thể loại; phần còn lại lấy từ MF trên toàn danh mục
+PERSONAL_SLOTS = 0.5
+
+
+def genre_candidates(
+    session: SessionDep, genreRankings: GenreRankings, rated_ids: np.ndarray, limit: int, genres: Optional[List[str]] = None
+) -> np.ndarray:
+    """
+    Ids of the best-rated (wr_80th) high-quality movies in the user's TOP_GENRES most-rated genres,
+    excluding rated movies, merged from the in-memory genre rankings. `genres` (from the rating
+    store's histogram) replaces counting the user's genres over stg_genre.
+    """
+    if genres is None:
+        rows = session.execute(text("""
+            SELECT genre
+            FROM stg_genre
+            WHERE movie_id = ANY(:rated_ids) AND genre IS NOT NULL AND genre != ''
+            GROUP BY genre
+            ORDER BY COUNT(*) DESC, genre
+            LIMIT :top_genres
+        """), {"rated_ids": rated_ids.tolist(), "top_genres": TOP_GENRES}).fetchall()
+        genres = [row.genre for row in rows]
+    return genreRankings.top(genres, limit, exclude=rated_ids.tolist())[0]
+
+
 @router.post("/collaborative-filtering", response_model=MovieRecommendationResponse)
 def collaborative_filtering_recommendation(
     *,
     session: SessionDep,
+    faissManager: Annotated[FaissIndexManager, Depends(get_faiss_manager)],
     mfModel: Annotated[MFModel, Depends(get_mf_model)],
+    userTopN: UserTopNDep,
+    ratingStore: RatingStoreDep,
+    genreRankings: GenreRankingsDep,
     request: CollaborativeRequest
 ) -> MovieRecommendationResponse:
+    """
+    Content neighbours or genre picks (deduped, one vectorized MF scoring pass) and MF retrieval
+    over the catalogue (precomputed or live) -> one hydration query -> top-n with PERSONAL_SLOTS
+    of it reserved for the content/genre candidates, ranked by MF prediction.
+    """
     user_id = request.userId
 
-    query_ratings = text("""
-            SELECT movie_id, rating
-            FROM stg_rating
-            WHERE user_id = :user_id
-            ORDER BY rating DESC
-        """)
-
-    result_ratings = session.execute(query_ratings, {"user_id": user_id}).fetchall()
-
-    if not result_ratings:
-        raise HTTPException(status_code=404, detail=f"Không tìm thấy đánh giá nào cho user {user_id}")
-
-    list_suggest_movie = []
-    if len(result_ratings) < 10:
-        # Dưới 10 đánh giá: Lấy top 3 phim có điểm cao nhất
-        top_rated_movies = [row[0] for row in result_ratings[:min(3, len(result_ratings))]]  # Top 3 phim
-
-        for mid in top_rated_movies:
-            list_suggest_movie.extend(
-                content_based_recommendation(session=session, request=ContentBaseRequest(movieId=mid, limit=5)).recommendations
-            )
+    # Đánh giá của user (giảm dần theo điểm): đọc từ snapshot trong bộ nhớ + delta nếu có, không thì truy vấn DB
+    if ratingStore is not None:
+        rated_ids, rated_values = ratingStore.user_ratings(user_id)
+        order = np.argsort(-rated_values, kind="stable")
+        rated_ids, rated_values = rated_ids[order], rated_values[order]
     else:
-        # Từ 10 đánh giá trở lên: Lấy top 3 thể loại
-        rated_movie_ids = [row[0] for row in result_ratings]
-        query_genres = text("""
-                WITH user_rated_movies AS (
-                SELECT movie_id
+        query_ratings = text("""
+                SELECT movie_id, rating
                 FROM stg_rating
                 WHERE user_id = :user_id
-            )
-            SELECT g.genre, COUNT(*) AS count_num
-            FROM user_rated_movies u
-            JOIN stg_genre g ON u.movie_id = g.movie_id
-            GROUP BY g.genre;
-        """)
-        result_genres = session.execute(query_genres, {"user_id": user_id}).fetchall()
-
-        if not result_genres:
-            raise HTTPException(status_code=404, detail="Không tìm thấy thể loại nào từ các phim đã đánh giá")
-
-        # Lấy top 3 thể loại
-        top_genres = sorted(result_genres, key=lambda x: x[1], reverse=True)[:min(3, len(result_genres))]
+                ORDER BY rating DESC
+            """)
+        result_ratings = session.execute(query_ratings, {"user_id": user_id}).fetchall()
+        rated_ids = np.array([row[0] for row in result_ratings], dtype=np.int64)
+        rated_values = np.array([row[1] for row in result_ratings], dtype=np.float64)
 
-        # Tìm phim thuộc top 3 thể loại
-        list_suggest_movie.extend(
-            recommend_movies_by_genres(session=session, request_body=GenreRecommendationRequest(genres=[i[0] for i in top_genres], limit=15)).recommendations
-        )
+    if len(rated_ids) == 0:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy đánh giá nào cho user {user_id}")
 
-    exist = []
-    for movie in list_suggest_movie:
-        if movie.id in exist:
-            list_suggest_movie.remove(movie)
+    # Lấy dư vì phim có điểm đánh giá nhưng thiếu metadata sẽ bị bỏ khi hydrate
+    top_n = request.top_n
+    margin = 2 * top_n
+
+    # User mới hoặc có đánh giá mới: tính lại vector user từ các đánh giá hiện tại (fold-in)
+    user_factors = mfModel.user_factors(user_id, rated_ids, rated_values)
+
+    # 1. Ứng viên MF: đọc kết quả tính sẵn khi đánh giá của user không đổi kể từ lúc huấn luyện model,
+    #    không thì MIPS trên toàn danh mục chạy trên pool trong lúc luồng request lấy ứng viên
+    #    theo nội dung (FAISS) hoặc thể loại (DB); chỉ lấy id, chưa hydrate
+    mf_candidates = None
+    mf_future = None
+    if userTopN is not None and not mfModel.needs_fold_in(user_id, len(rated_ids)):
+        mf_candidates = userTopN.get(user_id, margin)
+    if mf_candidates is None:
+        if settings.FAISS_PARALLEL_SEARCH:
+            mf_future = get_search_executor().submit(mfModel.top_items, user_factors, margin, rated_ids)
         else:
-            exist.append(movie.id)
-
-
-    model = mfModel.model
-
-    for movie in list_suggest_movie:
-        movie.wr = model.predict(user_id, movie.id).est
-
-    list_suggest_movie = sorted(list_suggest_movie, key=lambda x: x.wr, reverse=True)[:min(len(list_suggest_movie), request.top_n)]
+            mf_candidates = mfModel.top_items(user_factors, margin, rated_ids)
+
+    sources = []
+    if len(rated_ids) < FEW_RATINGS:
+        for seed in rated_ids[:CONTENT_SEEDS].tolist():
+            similar = similar_movies(faissManager, seed, CONTENT_CANDIDATES_PER_SEED)
+            if similar is not None:
+                sources.append(similar[0])
+    else:
+        # Thể loại xem nhiều nhất lấy từ histogram trong bộ nhớ khi có rating store
+        genres = ratingStore.genres.top_genres(rated_ids, TOP_GENRES) if ratingStore is not None else None
+        sources.append(genre_candidates(session, genreRankings, rated_ids, GENRE_CANDIDATES, genres))
+
+    # 2. Gộp và bỏ trùng ứng viên nội dung/thể loại (kể cả phim user đã đánh giá) bằng một lần sắp xếp,
+    #    3. chấm điểm bằng một phép nhân ma trận, xếp hạng theo điểm, bằng điểm thì theo movie id
+    candidate_ids = merge_candidates(sources, exclude=rated_ids)
+    predicted = mfModel.predict_many(user_factors, candidate_ids)
+    top = rank_predictions(candidate_ids, predicted)[:margin]
+
+    if mf_future is not None:
+        mf_candidates = mf_future.result()
+    if mf_candidates is None:
+        mf_candidates = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+    # 4. Hydrate cả hai danh sách bằng một truy vấn
+    personal, catalog = hydrate_scored_movies_batch(
+        session, [(candidate_ids[top], predicted[top]), (mf_candidates[0][:margin], mf_candidates[1][:margin])]
+    )
 
-    return MovieRecommendationResponse(recommendations=list_suggest_movie)
+    # 5. MIPS trả về đúng các phim có điểm dự đoán cao nhất nên sẽ lấn hết ứng viên nội dung/thể loại
+    #    khi xếp chung theo điểm: giữ PERSONAL_SLOTS chỗ cho ứng viên nội dung/thể loại, phần còn lại lấy từ MF,
+    #    rồi xếp hạng lại theo điểm dự đoán (bằng điểm thì theo movie id)
+    personal_pos, catalog_pos = reserve_slots(
+        np.array([movie.id for movie in personal], dtype=np.int64),
+        np.array([movie.id for movie in catalog], dtype=np.int64),
+        top_n, math.ceil(top_n * PERSONAL_SLOTS),
+    )
+    picked = [personal[i] for i in personal_pos.tolist()] + [catalog[i] for i in catalog_pos.tolist()]
+    picked.sort(key=lambda movie: (-movie.wr, movie.id))
+    return MovieRecommendationResponse(recommendations=picked)
 
 class UserIdsResponse(BaseModel):
     userIds: List[int]
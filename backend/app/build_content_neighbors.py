@@ -0,0 +1,120 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from app import constants
+from app.core.config import settings
+from app.core.faiss_index import (
+    FIELD_INDEX_PATHS,
+    FusedVectors,
+    MovieVectors,
+    configure_search,
+    load_field_vectors,
+    movie_rows,
+    read_index_mmap,
+    save_npy_atomic,
+    search_index,
+    write_index_manifest,
+)
+from app.core.ml_compute import fuse_search_results
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Precompute fused top-K content-based neighbours for every movie"
+    )
+    parser.add_argument(
+        "--k", type=int, default=constants.EmbeddingModelConstants.CONTENT_NEIGHBORS_K
+    )
+    parser.add_argument("--batch-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    logger.info("Loading movie embeddings and FAISS indices")
+    ids, vectors = load_field_vectors()
+    rows = movie_rows(np.asarray(ids))
+
+    n = len(ids)
+    neighbors = np.full((n, args.k), -1, dtype=np.int32)
+    scores = np.zeros((n, args.k), dtype=np.float32)
+
+    start = time.perf_counter()
+    if os.path.exists(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_INDEX):
+        # The fused index gives the exact weighted top-K directly
+        with open(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_META) as f:
+            fused_vectors = FusedVectors(vectors, json.load(f)["weights"])
+        fused_movie_vectors = MovieVectors(fused_vectors, rows)
+        index = read_index_mmap(
+            constants.EmbeddingModelConstants.PATH_FAISS_FUSED_INDEX
+        )
+        index = configure_search(
+            index, nprobe=settings.FAISS_NPROBE, ef_search=settings.FAISS_EF_SEARCH
+        )
+        for lo in range(0, n, args.batch_size):
+            hi = min(lo + args.batch_size, n)
+            distances, labels = search_index(
+                index,
+                fused_vectors[np.arange(lo, hi)],
+                args.k,
+                fused_movie_vectors,
+                settings.FAISS_RESCORE_FACTOR,
+            )
+            neighbors[lo:hi] = labels
+            scores[lo:hi] = np.where(labels >= 0, distances, 0)
+            logger.info(f"Fused neighbours for {hi}/{n} movies")
+    else:
+        indices = {}
+        for field in constants.SEARCH_TYPE:
+            index = read_index_mmap(FIELD_INDEX_PATHS[field])
+            indices[field] = configure_search(
+                index, nprobe=settings.FAISS_NPROBE, ef_search=settings.FAISS_EF_SEARCH
+            )
+        weights = np.array(
+            [constants.CONTENT_BASE_WEIGHTS[field] for field in constants.SEARCH_TYPE]
+        )
+        movie_vectors = {
+            field: MovieVectors(vectors[field], rows) for field in constants.SEARCH_TYPE
+        }
+
+        for lo in range(0, n, args.batch_size):
+            hi = min(lo + args.batch_size, n)
+            # One multi-row search per field for the whole batch of seed movies
+            searched = [
+                search_index(
+                    indices[field],
+                    vectors[field][lo:hi],
+                    args.k,
+                    movie_vectors[field],
+                    settings.FAISS_RESCORE_FACTOR,
+                )
+                for field in constants.SEARCH_TYPE
+            ]
+            distances = np.stack([d for d, _ in searched])
+            labels = np.stack([i for _, i in searched])
+            for row in range(hi - lo):
+                movie_ids, fused = fuse_search_results(
+                    distances[:, row, :], labels[:, row, :], args.k, weights
+                )
+                neighbors[lo + row, : len(movie_ids)] = movie_ids
+                scores[lo + row, : len(fused)] = fused
+            logger.info(f"Fused neighbours for {hi}/{n} movies")
+
+    save_npy_atomic(constants.EmbeddingModelConstants.PATH_CONTENT_NEIGHBORS, neighbors)
+    save_npy_atomic(
+        constants.EmbeddingModelConstants.PATH_CONTENT_NEIGHBOR_SCORES, scores
+    )
+    save_npy_atomic(constants.EmbeddingModelConstants.PATH_CONTENT_NEIGHBOR_ROWS, rows)
+    write_index_manifest()
+    logger.info(
+        f"Neighbour table ({n} x {args.k}) written in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
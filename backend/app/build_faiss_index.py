@@ -0,0 +1,158 @@
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from app import constants
+from app.core.faiss_index import (
+    COMPRESSED_INDEX_TYPES,
+    FIELD_INDEX_PATHS,
+    INDEX_TYPES,
+    MovieVectors,
+    build_index,
+    configure_search,
+    describe_index,
+    evaluate_against_flat,
+    field_vectors_exist,
+    index_memory_bytes,
+    load_field_vectors,
+    movie_rows,
+    read_embedding_pickle,
+    write_field_vectors,
+    write_index_atomic,
+    write_index_manifest,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NPROBE_SWEEP = [1, 4, 8, 16, 32, 64]
+EF_SEARCH_SWEEP = [16, 32, 64, 128, 256]
+RESCORE_FACTOR_SWEEP = [1, 2, 4, 8]
+
+
+def sweep(index_type: str) -> list[dict[str, int]]:
+    if index_type == "ivf":
+        return [{"nprobe": n} for n in NPROBE_SWEEP]
+    if index_type == "hnsw":
+        return [{"ef_search": ef} for ef in EF_SEARCH_SWEEP]
+    if index_type in COMPRESSED_INDEX_TYPES:
+        return [{"rescore_factor": f} for f in RESCORE_FACTOR_SWEEP]
+    return [{}]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Build the per-field FAISS indices from the movie embeddings"
+    )
+    parser.add_argument(
+        "--from-pickle",
+        action="store_true",
+        help="Re-export movie_embedding.pkl to the .npy layout first (done automatically when it is missing)",
+    )
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument(
+        "--nlist", type=int, default=None, help="IVF lists (default: 4 * sqrt(N))"
+    )
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument(
+        "--pq-m", type=int, default=48, help="PQ sub-quantizers (bytes per vector)"
+    )
+    parser.add_argument(
+        "--k", type=int, default=50, help="Neighbours compared in the recall report"
+    )
+    parser.add_argument(
+        "--n-queries",
+        type=int,
+        default=1000,
+        help="Sampled movies used as report queries",
+    )
+    args = parser.parse_args()
+
+    if args.from_pickle or not field_vectors_exist():
+        logger.info("Exporting movie_embedding.pkl to the memory-mapped .npy layout")
+        write_field_vectors(*read_embedding_pickle())
+
+    logger.info("Loading movie embeddings")
+    ids, vectors = load_field_vectors()
+    rows = movie_rows(np.asarray(ids))
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(ids), size=min(args.n_queries, len(ids)), replace=False)
+
+    report = {
+        "index_type": args.index_type,
+        "n_vectors": len(ids),
+        "k": args.k,
+        "fields": {},
+    }
+    for field in constants.SEARCH_TYPE:
+        start = time.perf_counter()
+        index = build_index(
+            vectors[field],
+            args.index_type,
+            args.nlist,
+            args.hnsw_m,
+            args.ef_construction,
+            args.pq_m,
+            ids=ids,
+        )
+        build_seconds = time.perf_counter() - start
+
+        field_report = {
+            "build_seconds": build_seconds,
+            "memory_bytes": index_memory_bytes(index),
+            "runs": [],
+        }
+        if args.index_type != "flat":
+            flat_index = build_index(vectors[field], "flat", ids=ids)
+            field_report["flat_memory_bytes"] = index_memory_bytes(flat_index)
+            logger.info(
+                f"{field:8s} {describe_index(index)} uses {field_report['memory_bytes'] / 2**20:.1f} MiB "
+                f"(flat {field_report['flat_memory_bytes'] / 2**20:.1f} MiB)"
+            )
+
+            queries = vectors[field][sample]
+            for params in sweep(args.index_type):
+                rescore_factor = params.get("rescore_factor", 1)
+                configure_search(
+                    index,
+                    nprobe=params.get("nprobe"),
+                    ef_search=params.get("ef_search"),
+                )
+                run = evaluate_against_flat(
+                    index,
+                    flat_index,
+                    queries,
+                    args.k,
+                    MovieVectors(vectors[field], rows),
+                    rescore_factor,
+                )
+                field_report["runs"].append(
+                    {"index": describe_index(index), **params, **run}
+                )
+                logger.info(
+                    f"{field:8s} {describe_index(index):32s} rescore x{rescore_factor} "
+                    f"recall@{args.k}={run['recall_at_k']:.4f} "
+                    f"p50={run['p50_ms']:.3f}ms p99={run['p99_ms']:.3f}ms "
+                    f"(flat p50={run['flat_p50_ms']:.3f}ms p99={run['flat_p99_ms']:.3f}ms)"
+                )
+
+        write_index_atomic(index, FIELD_INDEX_PATHS[field])
+        report["fields"][field] = field_report
+        logger.info(f"Wrote {FIELD_INDEX_PATHS[field]} in {build_seconds:.1f}s")
+
+    with open(constants.EmbeddingModelConstants.PATH_FAISS_INDEX_REPORT, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(
+        f"Recall/latency report written to {constants.EmbeddingModelConstants.PATH_FAISS_INDEX_REPORT}"
+    )
+
+    manifest = write_index_manifest()
+    logger.info(f"Index version {manifest['version']}")
+
+
+if __name__ == "__main__":
+    main()
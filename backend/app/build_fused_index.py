@@ -0,0 +1,88 @@
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from app import constants
+from app.core.faiss_index import (
+    INDEX_TYPES,
+    FusedVectors,
+    build_index,
+    describe_index,
+    index_memory_bytes,
+    load_field_vectors,
+    write_index_atomic,
+    write_index_manifest,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_weights(value: str) -> dict[str, float]:
+    weights = {}
+    for item in value.split(","):
+        field, _, weight = item.partition("=")
+        if field.strip() not in constants.SEARCH_TYPE:
+            raise argparse.ArgumentTypeError(f"Invalid field: {field}")
+        weights[field.strip()] = float(weight)
+    return {field: weights.get(field, 0.0) for field in constants.SEARCH_TYPE}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Build the fused content-based index over weighted, concatenated field vectors"
+    )
+    parser.add_argument(
+        "--weights",
+        type=parse_weights,
+        default=dict(constants.CONTENT_BASE_WEIGHTS),
+        help="e.g. title=0.45,content=0.2,type=0.1,people=0.25 (default: CONTENT_BASE_WEIGHTS)",
+    )
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--pq-m", type=int, default=96)
+    args = parser.parse_args()
+
+    logger.info(f"Building fused index with weights {args.weights}")
+    ids, field_vectors = load_field_vectors()
+    fused = FusedVectors(field_vectors, args.weights)
+
+    start = time.perf_counter()
+    vectors = fused[np.arange(len(fused))]
+    index = build_index(
+        vectors,
+        args.index_type,
+        args.nlist,
+        args.hnsw_m,
+        args.ef_construction,
+        args.pq_m,
+        ids=ids,
+    )
+    build_seconds = time.perf_counter() - start
+
+    with open(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_META, "w") as f:
+        json.dump(
+            {
+                "weights": args.weights,
+                "fields": constants.SEARCH_TYPE,
+                "n_vectors": len(ids),
+            },
+            f,
+            indent=2,
+        )
+    write_index_atomic(index, constants.EmbeddingModelConstants.PATH_FAISS_FUSED_INDEX)
+    write_index_manifest()
+
+    logger.info(
+        f"Wrote {describe_index(index)} fused index ({vectors.shape[1]} dims, "
+        f"{index_memory_bytes(index) / 2**20:.1f} MiB) in {build_seconds:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
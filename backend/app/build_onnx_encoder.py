@@ -0,0 +1,276 @@
+import argparse
+import inspect
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app import constants
+from app.core.config import settings
+from app.core.encoders import OnnxEncoder, TextEncoder
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SAMPLE_QUERIES = [
+    "batman",
+    "pixar",
+    "space opera with a rebel princess",
+    "romantic comedy in new york",
+    "a heist that goes wrong",
+    "world war ii submarine",
+    "animated movie about toys that come alive",
+    "detective solves a murder on a train",
+    "time travel paradox",
+    "coming of age story in the 80s",
+    "Christopher Nolan",
+    "Studio Ghibli",
+]
+
+
+class MeanPooledEncoder(torch.nn.Module):
+    """
+    The transformer plus the model's mean pooling, so that the exported graph outputs sentence embeddings.
+    """
+
+    def __init__(self, transformer: torch.nn.Module):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        token_type_ids: torch.Tensor,
+    ) -> torch.Tensor:
+        tokens = self.transformer(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+        ).last_hidden_state
+        mask = attention_mask.unsqueeze(-1).to(tokens.dtype)
+        return (tokens * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+
+def export_onnx(model: SentenceTransformer, model_dir: str) -> None:
+    config = model[1].get_config_dict()
+    # sentence-transformers 2.x/3.x store one flag per mode, later versions a single "pooling_mode"
+    modes = [
+        key
+        for key, value in config.items()
+        if key.startswith("pooling_mode_") and value is True
+    ]
+    if config.get("pooling_mode", "mean") != "mean" or modes not in (
+        [],
+        ["pooling_mode_mean_tokens"],
+    ):
+        raise ValueError(f"Only mean pooling is exported, the model uses {config}")
+
+    os.makedirs(model_dir, exist_ok=True)
+    model.tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, "encoder.json"), "w") as f:
+        json.dump(
+            {
+                "model": constants.EmbeddingModelConstants.MODEL_SENTENCE_TRANSFORMER,
+                "max_seq_length": model.max_seq_length,
+                "dim": model.get_sentence_embedding_dimension(),
+            },
+            f,
+            indent=2,
+        )
+
+    dummy = model.tokenizer(["a sample query"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    # Newer torch versions default to the dynamo exporter; the TorchScript one handles dynamic axes here
+    export_kwargs = (
+        {"dynamo": False}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters
+        else {}
+    )
+    torch.onnx.export(
+        MeanPooledEncoder(model[0].auto_model).eval(),
+        tuple(dummy[name] for name in input_names),
+        os.path.join(
+            model_dir, constants.EmbeddingModelConstants.ONNX_ENCODER_FP32_FILE
+        ),
+        input_names=input_names,
+        output_names=["sentence_embedding"],
+        dynamic_axes={
+            **{name: {0: "batch", 1: "sequence"} for name in input_names},
+            "sentence_embedding": {0: "batch"},
+        },
+        opset_version=14,
+        **export_kwargs,
+    )
+
+
+def quantize_onnx(model_dir: str) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    # Weights stored as int8, activations quantized on the fly
+    quantize_dynamic(
+        os.path.join(
+            model_dir, constants.EmbeddingModelConstants.ONNX_ENCODER_FP32_FILE
+        ),
+        os.path.join(
+            model_dir, constants.EmbeddingModelConstants.ONNX_ENCODER_INT8_FILE
+        ),
+        weight_type=QuantType.QInt8,
+    )
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> dict[str, float]:
+    cosine = np.sum(reference * candidate, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean())}
+
+
+def benchmark(
+    encoder: TextEncoder, texts: list[str], batch_size: int
+) -> dict[str, float]:
+    """
+    Single-query latency percentiles (how /recommender/search encodes) and batched throughput.
+    """
+    encoder.encode(texts[:1], normalize_embeddings=True, show_progress_bar=False)
+    timings = np.empty(len(texts))
+    for i, query in enumerate(texts):
+        start = time.perf_counter()
+        encoder.encode([query], normalize_embeddings=True, show_progress_bar=False)
+        timings[i] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    encoder.encode(
+        texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False
+    )
+    batch_seconds = time.perf_counter() - start
+    return {
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "texts_per_second": len(texts) / batch_seconds,
+    }
+
+
+def load_texts(n_from_db: int) -> list[str]:
+    if n_from_db <= 0:
+        return SAMPLE_QUERIES
+
+    from app.core.db import engine
+
+    with Session(engine) as session:
+        rows = session.execute(
+            text("""
+                SELECT title, overview
+                FROM stg_movie_metadata
+                WHERE title IS NOT NULL
+                ORDER BY RANDOM()
+                LIMIT :limit
+            """),
+            {"limit": n_from_db},
+        ).fetchall()
+    # Short title-like queries and long overview-like ones
+    return (
+        SAMPLE_QUERIES
+        + [row.title for row in rows]
+        + [row.overview for row in rows if row.overview]
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export the sentence encoder to ONNX, quantize it to int8 and check it"
+    )
+    parser.add_argument(
+        "--skip-export",
+        action="store_true",
+        help="Only re-run the equivalence check and benchmark",
+    )
+    parser.add_argument(
+        "--texts-from-db",
+        type=int,
+        default=0,
+        help="Also check N random movie titles/overviews",
+    )
+    parser.add_argument(
+        "--min-cosine",
+        type=float,
+        default=0.99,
+        help="Fail when any embedding agrees less",
+    )
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    model_dir = constants.EmbeddingModelConstants.PATH_ONNX_ENCODER_DIR
+    model = SentenceTransformer(
+        constants.EmbeddingModelConstants.MODEL_SENTENCE_TRANSFORMER, device="cpu"
+    )
+    if not args.skip_export:
+        logger.info(
+            f"Exporting {constants.EmbeddingModelConstants.MODEL_SENTENCE_TRANSFORMER} to {model_dir}"
+        )
+        export_onnx(model, model_dir)
+        logger.info("Quantizing weights to int8")
+        quantize_onnx(model_dir)
+
+    texts = load_texts(args.texts_from_db)
+    reference = model.encode(
+        texts,
+        batch_size=args.batch_size,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+    report = {
+        "n_texts": len(texts),
+        "intra_op_threads": settings.ENCODER_INTRA_OP_THREADS,
+        "backends": {},
+    }
+    report["backends"]["torch"] = benchmark(model, texts, args.batch_size)
+
+    failed = False
+    for name, model_file in [
+        ("onnx_fp32", constants.EmbeddingModelConstants.ONNX_ENCODER_FP32_FILE),
+        ("onnx_int8", constants.EmbeddingModelConstants.ONNX_ENCODER_INT8_FILE),
+    ]:
+        encoder = OnnxEncoder(model_dir, model_file, settings.ENCODER_INTRA_OP_THREADS)
+        agreement = cosine_agreement(
+            reference,
+            encoder.encode(
+                texts,
+                batch_size=args.batch_size,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            ),
+        )
+        report["backends"][name] = {
+            **agreement,
+            **benchmark(encoder, texts, args.batch_size),
+        }
+        failed |= agreement["min_cosine"] < args.min_cosine
+
+    for name, result in report["backends"].items():
+        logger.info(
+            f"{name:9s} p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+            f"{result['texts_per_second']:.0f} texts/s"
+            + (
+                f" cosine min={result['min_cosine']:.4f} mean={result['mean_cosine']:.4f}"
+                if "min_cosine" in result
+                else ""
+            )
+        )
+    with open(constants.EmbeddingModelConstants.PATH_ONNX_ENCODER_REPORT, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if failed:
+        raise SystemExit(
+            f"ONNX embeddings disagree with PyTorch (cosine < {args.min_cosine}), see the report"
+        )
+
+
+if __name__ == "__main__":
+    main()
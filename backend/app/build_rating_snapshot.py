@@ -0,0 +1,68 @@
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app import constants
+from app.core.artifacts import new_build_dir, publish_build
+from app.core.db import engine
+from app.core.ratings import GenreMatrix, load_rating_matrix, save_rating_snapshot
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Snapshot stg_rating and stg_genre into memory-mapped CSR arrays"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1_000_000,
+        help="Ratings fetched from Postgres per chunk",
+    )
+    parser.add_argument(
+        "--keep", type=int, default=2, help="Builds kept on disk, including the new one"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with Session(engine) as session:
+        # Rows above the watermark are fetched by the API as the delta
+        max_key_id = session.execute(
+            text("SELECT COALESCE(MAX(key_id), 0) FROM stg_rating")
+        ).scalar_one()
+        ratings = load_rating_matrix(
+            session, chunk_size=args.chunk_size, max_key_id=max_key_id
+        )
+        genres = GenreMatrix.from_db(session)
+    load_seconds = time.perf_counter() - start
+    logger.info(
+        f"Loaded {len(ratings.ratings)} ratings of {ratings.n_users} users up to key_id {max_key_id} "
+        f"and {len(genres.genres)} genres ({load_seconds:.1f}s)"
+    )
+
+    link_path = constants.MFModelConstants.PATH_RATING_SNAPSHOT
+    build_dir = new_build_dir(link_path)
+    save_rating_snapshot(
+        build_dir,
+        ratings,
+        genres,
+        max_key_id,
+        extra_meta={
+            "load_seconds": round(load_seconds, 3),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        },
+    )
+    publish_build(build_dir, link_path, keep=args.keep)
+    size = sum(entry.stat().st_size for entry in os.scandir(build_dir))
+    logger.info(f"Published {build_dir} as {link_path} ({size / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
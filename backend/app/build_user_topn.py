@@ -0,0 +1,180 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlmodel import Session
+
+from app import constants
+from app.core.artifacts import new_build_dir, publish_build
+from app.core.db import engine
+from app.core.matrix_factorization import SVDFactors, load_mf_factors, mf_model_path
+from app.core.ratings import RatingMatrix, load_rating_matrix
+from app.core.user_topn import (
+    META_FILE,
+    MOVIE_IDS_FILE,
+    SCORES_FILE,
+    USER_ROWS_FILE,
+    score_users,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set once per worker process by _init_worker
+_factors: SVDFactors | None = None
+_ratings: RatingMatrix | None = None
+_item_ids: np.ndarray | None = None
+_build_dir: str = ""
+
+
+def _init_worker(factors_path: str, ratings_path: str, build_dir: str) -> None:
+    """
+    Memory-map the factors and ratings saved by the parent: every worker shares one copy through
+    the page cache instead of unpickling its own.
+    """
+    global _factors, _ratings, _item_ids, _build_dir
+    _factors, _ratings, _build_dir = (
+        SVDFactors.load(factors_path),
+        RatingMatrix.load(ratings_path),
+        build_dir,
+    )
+    _item_ids = _factors.item_ids()
+
+
+def _score_block(
+    store_lo: int, rating_rows: np.ndarray, model_rows: np.ndarray, top_n: int
+) -> int:
+    rated_item_rows = []
+    for r in rating_rows:
+        item_rows = _factors.item_rows_of(
+            _ratings.movie_ids[_ratings.indptr[r] : _ratings.indptr[r + 1]]
+        )
+        rated_item_rows.append(item_rows[item_rows >= 0])
+    movie_ids, scores = score_users(
+        _factors, model_rows, rated_item_rows, _item_ids, top_n
+    )
+
+    # Every worker writes its own rows of the preallocated files
+    out_ids = np.load(os.path.join(_build_dir, MOVIE_IDS_FILE), mmap_mode="r+")
+    out_scores = np.load(os.path.join(_build_dir, SCORES_FILE), mmap_mode="r+")
+    out_ids[store_lo : store_lo + len(model_rows)] = movie_ids
+    out_scores[store_lo : store_lo + len(model_rows)] = scores
+    out_ids.flush()
+    out_scores.flush()
+    return len(model_rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Precompute the collaborative top-N of every user in stg_rating"
+    )
+    parser.add_argument(
+        "--top-n",
+        type=int,
+        default=100,
+        help="Movies kept per user (requests with `top_n` up to half of this are served from the store)",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--block-size", type=int, default=256, help="Users scored per matrix product"
+    )
+    parser.add_argument(
+        "--keep", type=int, default=2, help="Builds kept on disk, including the new one"
+    )
+    args = parser.parse_args()
+
+    model_path = mf_model_path()
+    logger.info(f"Loading MF model {model_path}")
+    factors = load_mf_factors(model_path)
+    if factors.item_row_array is None:
+        raise SystemExit("The MF model was not trained on integer movie ids")
+
+    logger.info("Loading ratings")
+    with Session(engine) as session:
+        ratings = load_rating_matrix(session)
+
+    model_rows = np.array(
+        [factors.user_row(int(user_id)) for user_id in ratings.user_ids], dtype=np.int64
+    )
+    known = np.flatnonzero(model_rows >= 0)
+    logger.info(
+        f"{len(known)} of {ratings.n_users} rating users are known to the model"
+    )
+
+    link_path = constants.MFModelConstants.PATH_USER_TOPN
+    build_dir = new_build_dir(link_path)
+
+    max_user_id = int(ratings.user_ids.max()) if ratings.n_users else -1
+    user_rows = np.full(max_user_id + 1, -1, dtype=np.int32)
+    user_rows[ratings.user_ids[known]] = np.arange(len(known), dtype=np.int32)
+    np.save(os.path.join(build_dir, USER_ROWS_FILE), user_rows)
+    np.lib.format.open_memmap(
+        os.path.join(build_dir, MOVIE_IDS_FILE),
+        mode="w+",
+        dtype=np.int32,
+        shape=(len(known), args.top_n),
+    ).flush()
+    np.lib.format.open_memmap(
+        os.path.join(build_dir, SCORES_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(known), args.top_n),
+    ).flush()
+
+    start = time.perf_counter()
+    done = 0
+    # Resolved once, so that a factors build published mid-run does not change the model under the workers
+    factors_path = os.path.realpath(model_path)
+    with tempfile.TemporaryDirectory(dir=build_dir) as scratch:
+        if not os.path.isdir(factors_path):
+            # A pickled model is saved once in the factor layout for the workers to map
+            factors_path = os.path.join(scratch, "factors")
+            factors.save(factors_path)
+        ratings_path = os.path.join(scratch, "ratings")
+        os.makedirs(ratings_path)
+        ratings.save(ratings_path)
+
+        with ProcessPoolExecutor(
+            args.workers,
+            initializer=_init_worker,
+            initargs=(factors_path, ratings_path, build_dir),
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _score_block,
+                    lo,
+                    known[lo : lo + args.block_size],
+                    model_rows[known[lo : lo + args.block_size]],
+                    args.top_n,
+                )
+                for lo in range(0, len(known), args.block_size)
+            ]
+            for future in futures:
+                done += future.result()
+                logger.info(f"Scored {done}/{len(known)} users")
+
+    with open(os.path.join(build_dir, META_FILE), "w") as f:
+        json.dump(
+            {
+                "top_n": args.top_n,
+                "n_users": int(len(known)),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "model_mtime": os.path.getmtime(model_path),
+            },
+            f,
+            indent=2,
+        )
+
+    # Workers notice the new symlink target on their next request
+    publish_build(build_dir, link_path, keep=args.keep)
+    logger.info(f"Published {build_dir} ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
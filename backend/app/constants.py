@@ -6,28 +6,72 @@ from typing import Final
 
 PYTHON_PATH: Final[str] = "app"
 
+# Touched by POST /admin/models/reload; every worker reloads its FAISS/MF generation when it moves
+PATH_MODEL_RELOAD_TRIGGER: Final[str] = f"{PYTHON_PATH}/model-reload.trigger"
+# Touched by POST /admin/autocomplete/rebuild; every worker rebuilds only its title autocomplete index
+PATH_AUTOCOMPLETE_REBUILD_TRIGGER: Final[str] = f"{PYTHON_PATH}/autocomplete-rebuild.trigger"
+# Touched by POST /admin/genre-rankings/rebuild; every worker rebuilds only its per-genre rankings
+PATH_GENRE_RANKINGS_REBUILD_TRIGGER: Final[str] = f"{PYTHON_PATH}/genre-rankings-rebuild.trigger"
+
 @dataclass(frozen=True)
 class EmbeddingModelConstants:
     MODEL_SENTENCE_TRANSFORMER: Final[str] = "all-MiniLM-L6-v2"
     VECTOR_EMBEDDING_DIM : Final[int] = 384
-    PATH_FAISSID_TO_MOVIEID : Final[str] = f"{PYTHON_PATH}/vector-embedding/faissid_to_movieid.pkl"
     PATH_FAISS_CONTENT_INDEX : Final[str] = f"{PYTHON_PATH}/vector-embedding/faiss_content.index"
     PATH_FAISS_TYPE_INDEX : Final[str] = f"{PYTHON_PATH}/vector-embedding/faiss_type.index"
     PATH_FAISS_TITLE_INDEX : Final[str] = f"{PYTHON_PATH}/vector-embedding/faiss_title.index"
     PATH_FAISS_PEOPLE_INDEX : Final[str] = f"{PYTHON_PATH}/vector-embedding/faiss_people.index"
     PATH_MOVIE_EMBEDDING: Final[str] = f"{PYTHON_PATH}/vector-embedding/movie_embedding.pkl"
+    # Memory-mapped layout: row i of every field matrix is movie PATH_MOVIE_IDS[i];
+    # the FAISS indices are keyed by movie id and PATH_MOVIE_ROWS maps movie id -> row
+    PATH_MOVIE_IDS: Final[str] = f"{PYTHON_PATH}/vector-embedding/movie_ids.npy"
+    PATH_MOVIE_ROWS: Final[str] = f"{PYTHON_PATH}/vector-embedding/movie_rows.npy"
+    PATH_TITLE_VECTORS: Final[str] = f"{PYTHON_PATH}/vector-embedding/title_vectors.npy"
+    PATH_CONTENT_VECTORS: Final[str] = f"{PYTHON_PATH}/vector-embedding/content_vectors.npy"
+    PATH_TYPE_VECTORS: Final[str] = f"{PYTHON_PATH}/vector-embedding/type_vectors.npy"
+    PATH_PEOPLE_VECTORS: Final[str] = f"{PYTHON_PATH}/vector-embedding/people_vectors.npy"
+    # Version of the vector artifacts; bumped by every build or upsert/delete so workers reload
+    PATH_INDEX_MANIFEST: Final[str] = f"{PYTHON_PATH}/vector-embedding/index_manifest.json"
+    PATH_INDEX_LOCK: Final[str] = f"{PYTHON_PATH}/vector-embedding/index.lock"
+    PATH_FAISS_INDEX_REPORT: Final[str] = f"{PYTHON_PATH}/vector-embedding/faiss_index_report.json"
+    # Single index over the sqrt(weight)-scaled concatenation of the four field vectors
+    PATH_FAISS_FUSED_INDEX: Final[str] = f"{PYTHON_PATH}/vector-embedding/faiss_fused.index"
+    PATH_FAISS_FUSED_META: Final[str] = f"{PYTHON_PATH}/vector-embedding/faiss_fused.json"
+    PATH_CONTENT_NEIGHBORS: Final[str] = f"{PYTHON_PATH}/vector-embedding/content_neighbors.npy"
+    PATH_CONTENT_NEIGHBOR_SCORES: Final[str] = f"{PYTHON_PATH}/vector-embedding/content_neighbor_scores.npy"
+    PATH_CONTENT_NEIGHBOR_ROWS: Final[str] = f"{PYTHON_PATH}/vector-embedding/content_neighbor_rows.npy"
+    # ONNX export of the sentence encoder (tokenizer files, encoder.json, fp32 and int8 graphs)
+    PATH_ONNX_ENCODER_DIR: Final[str] = f"{PYTHON_PATH}/vector-embedding/onnx-encoder"
+    ONNX_ENCODER_FP32_FILE: Final[str] = "model.onnx"
+    ONNX_ENCODER_INT8_FILE: Final[str] = "model_int8.onnx"
+    PATH_ONNX_ENCODER_REPORT: Final[str] = f"{PYTHON_PATH}/vector-embedding/onnx-encoder/report.json"
+    # Hot entries of the query embedding cache, kept across restarts
+    PATH_QUERY_EMBEDDING_CACHE: Final[str] = f"{PYTHON_PATH}/vector-embedding/query_embedding_cache.npy"
+    PATH_QUERY_EMBEDDING_CACHE_KEYS: Final[str] = f"{PYTHON_PATH}/vector-embedding/query_embedding_cache.json"
+    # Neighbours kept per movie in the precomputed table (= max `limit` of /recommender/content-base)
+    CONTENT_NEIGHBORS_K: Final[int] = 50
 
 @dataclass(frozen=True)
 class MFModelConstants:
-    PATH_INDEX_TO_MOVIEID : Final[str] = f"{PYTHON_PATH}/matrix-factorial/index_to_movieid.pkl"
-    PATH_INDEX_TO_USERID : Final[str] = f"{PYTHON_PATH}/matrix-factorial/index_to_userid.pkl"
-    PATH_MOVIEID_TO_INDEX : Final[str] = f"{PYTHON_PATH}/matrix-factorial/movieid_to_index.pkl"
-    PATH_USERID_TO_INDEX : Final[str] = f"{PYTHON_PATH}/matrix-factorial/userid_to_index.pkl"
     PATH_MF_MODEL : Final[str] = f"{PYTHON_PATH}/matrix-factorial/model_SVD.pkl"
+    # Symlink to the latest factors build of train_mf.py or export_mf_model.py; served instead of PATH_MF_MODEL when present
+    PATH_MF_FACTORS : Final[str] = f"{PYTHON_PATH}/matrix-factorial/factors"
+    # Symlink to the latest precomputed per-user top-N directory (build_user_topn.py swaps it atomically)
+    PATH_USER_TOPN : Final[str] = f"{PYTHON_PATH}/matrix-factorial/user-topn"
+    # Symlink to the latest memory-mapped stg_rating snapshot (build_rating_snapshot.py swaps it atomically)
+    PATH_RATING_SNAPSHOT : Final[str] = f"{PYTHON_PATH}/matrix-factorial/rating-snapshot"
 
 
 SEARCH_TYPE: Final[list[str]] = ["title", "content", "type", "people"]
 
+# Weight of each field's cosine similarity in the content-based score
+CONTENT_BASE_WEIGHTS: Final[dict[str, float]] = {
+    "title": 0.45,
+    "content": 0.2,
+    "type": 0.1,
+    "people": 0.25,
+}
+
 @dataclass(frozen=True)
 class Genres:
     pass
\ No newline at end of file
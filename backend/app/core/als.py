@@ -0,0 +1,344 @@
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.matrix_factorization import SVDFactors, id_row_lookup, ridge_factors
+from app.core.ratings import RatingMatrix
+
+logger = logging.getLogger(__name__)
+
+_ARRAYS = (
+    "user_indptr",
+    "user_cols",
+    "user_values",
+    "item_indptr",
+    "item_cols",
+    "item_values",
+)
+
+
+@dataclass
+class ALSData:
+    """
+    The training ratings twice in CSR form: per user (columns are item rows) for the user half-step
+    and per item (columns are user rows) for the item half-step. Row i of the user side is
+    `user_ids[i]`, of the item side `item_ids[i]`.
+    """
+
+    user_ids: np.ndarray
+    item_ids: np.ndarray
+    user_indptr: np.ndarray
+    user_cols: np.ndarray
+    user_values: np.ndarray
+    item_indptr: np.ndarray
+    item_cols: np.ndarray
+    item_values: np.ndarray
+
+    @classmethod
+    def from_rating_matrix(cls, ratings: RatingMatrix) -> "ALSData":
+        item_ids = np.unique(ratings.movie_ids).astype(np.int64)
+        user_cols = np.searchsorted(item_ids, ratings.movie_ids).astype(np.int32)
+        rating_users = np.repeat(
+            np.arange(ratings.n_users, dtype=np.int32), np.diff(ratings.indptr)
+        )
+
+        order = np.argsort(user_cols, kind="stable")
+        item_indptr = np.zeros(len(item_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(user_cols, minlength=len(item_ids)), out=item_indptr[1:])
+        return cls(
+            user_ids=np.asarray(ratings.user_ids, dtype=np.int64),
+            item_ids=item_ids,
+            user_indptr=np.asarray(ratings.indptr, dtype=np.int64),
+            user_cols=user_cols,
+            user_values=np.asarray(ratings.ratings, dtype=np.float32),
+            item_indptr=item_indptr,
+            item_cols=rating_users[order],
+            item_values=np.asarray(ratings.ratings, dtype=np.float32)[order],
+        )
+
+    @property
+    def n_ratings(self) -> int:
+        return len(self.user_values)
+
+    def save(self, path: str) -> None:
+        for name in _ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @staticmethod
+    def load_side(path: str, side: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return tuple(
+            np.load(os.path.join(path, f"{side}_{name}.npy"), mmap_mode="r")
+            for name in ("indptr", "cols", "values")
+        )
+
+
+def solve_rows(
+    indptr: np.ndarray,
+    cols: np.ndarray,
+    values: np.ndarray,
+    fixed: np.ndarray,
+    global_mean: float,
+    reg: float,
+    reg_bias: float,
+    lo: int,
+    hi: int,
+) -> np.ndarray:
+    """
+    [factors | bias] of rows lo..hi of one side given the other side's `fixed` [factors | bias].
+    Rows without ratings get zeros.
+    """
+    f = fixed.shape[1] - 1
+    out = np.zeros((hi - lo, f + 1))
+    for row in range(lo, hi):
+        start, end = indptr[row], indptr[row + 1]
+        if start == end:
+            continue
+        other = fixed[cols[start:end]]
+        out[row - lo] = ridge_factors(
+            other[:, :f], other[:, f], values[start:end], global_mean, reg, reg_bias
+        )
+    return out
+
+
+# Set once per worker process by init_worker
+_work_dir: str = ""
+_sides: dict = {}
+
+
+def init_worker(work_dir: str) -> None:
+    global _work_dir, _sides
+    _work_dir = work_dir
+    _sides = (
+        {side: ALSData.load_side(work_dir, side) for side in ("user", "item")}
+        if work_dir
+        else {}
+    )
+
+
+def _solve_block(
+    side: str,
+    fixed_file: str,
+    global_mean: float,
+    reg: float,
+    reg_bias: float,
+    lo: int,
+    hi: int,
+) -> np.ndarray:
+    fixed = np.load(os.path.join(_work_dir, fixed_file), mmap_mode="r")
+    return solve_rows(*_sides[side], fixed, global_mean, reg, reg_bias, lo, hi)
+
+
+def predict_pairs(
+    user_factors: np.ndarray,
+    item_factors: np.ndarray,
+    user_rows: np.ndarray,
+    item_rows: np.ndarray,
+    global_mean: float,
+    rating_scale: Tuple[float, float],
+    chunk_size: int = 1_000_000,
+) -> np.ndarray:
+    """
+    Clipped predictions for (user row, item row) pairs; -1 rows are unknown and fall back to the
+    biases that are known, like surprise.
+    """
+    f = user_factors.shape[1] - 1
+    est = np.empty(len(user_rows))
+    for lo in range(0, len(user_rows), chunk_size):
+        u, i = user_rows[lo : lo + chunk_size], item_rows[lo : lo + chunk_size]
+        known_u, known_i = u >= 0, i >= 0
+        pu, qi = (
+            user_factors[np.where(known_u, u, 0)],
+            item_factors[np.where(known_i, i, 0)],
+        )
+        chunk = (
+            global_mean
+            + np.where(known_u, pu[:, f], 0.0)
+            + np.where(known_i, qi[:, f], 0.0)
+        )
+        chunk += np.where(
+            known_u & known_i, np.einsum("ij,ij->i", pu[:, :f], qi[:, :f]), 0.0
+        )
+        est[lo : lo + chunk_size] = chunk
+    return np.clip(est, *rating_scale)
+
+
+def rmse(predicted: np.ndarray, actual: np.ndarray) -> float:
+    return (
+        float(np.sqrt(np.mean((predicted - actual) ** 2)))
+        if len(actual)
+        else float("nan")
+    )
+
+
+@dataclass
+class ALSReport:
+    train_seconds: float
+    epochs: List[dict]
+
+
+def train_als(
+    data: ALSData,
+    n_factors: int = 100,
+    n_epochs: int = 15,
+    reg: float = 0.05,
+    reg_bias: float = 0.05,
+    init_std: float = 0.1,
+    rating_scale: Optional[Tuple[float, float]] = None,
+    workers: int = 1,
+    block_size: int = 1024,
+    seed: int = 0,
+    on_epoch: Optional[Callable[[dict], None]] = None,
+) -> Tuple[SVDFactors, ALSReport]:
+    """
+    Biased matrix factorization by alternating least squares: every half-step solves one small ridge
+    regression per user (items fixed) or per item (users fixed), all independent, so blocks of rows
+    are solved on `workers` processes. Minimizes the same objective as surprise's SVD, so the result
+    predicts, folds in and retrieves like a trained SVD.
+    """
+    rng = np.random.default_rng(seed)
+    global_mean = float(data.user_values.mean()) if data.n_ratings else 0.0
+    if rating_scale is None:
+        rating_scale = (
+            (float(data.user_values.min()), float(data.user_values.max()))
+            if data.n_ratings
+            else (0.0, 1.0)
+        )
+
+    # Train RMSE pairs: rating i belongs to user row rating_users[i] and item row user_cols[i]
+    rating_users = np.repeat(np.arange(len(data.user_ids)), np.diff(data.user_indptr))
+    user_side = np.zeros((len(data.user_ids), n_factors + 1))
+    item_side = np.hstack(
+        [
+            rng.normal(0, init_std, (len(data.item_ids), n_factors)),
+            np.zeros((len(data.item_ids), 1)),
+        ]
+    )
+
+    epochs = []
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="als-") as work_dir:
+        data.save(work_dir)
+        if workers > 1:
+            executor: Optional[Executor] = ProcessPoolExecutor(
+                workers, initializer=init_worker, initargs=(work_dir,)
+            )
+        else:
+            executor = None
+            init_worker(work_dir)
+
+        def half_step(side: str, fixed: np.ndarray, n_rows: int) -> np.ndarray:
+            # Written to a new file each time so that workers never see a half-written array
+            fixed_file = f"{side}_fixed.npy"
+            np.save(os.path.join(work_dir, f"{fixed_file}.tmp.npy"), fixed)
+            os.replace(
+                os.path.join(work_dir, f"{fixed_file}.tmp.npy"),
+                os.path.join(work_dir, fixed_file),
+            )
+            blocks = [
+                (lo, min(lo + block_size, n_rows))
+                for lo in range(0, n_rows, block_size)
+            ]
+            args = [
+                (side, fixed_file, global_mean, reg, reg_bias, lo, hi)
+                for lo, hi in blocks
+            ]
+            if executor is None:
+                parts = [_solve_block(*a) for a in args]
+            else:
+                parts = [
+                    future.result()
+                    for future in [executor.submit(_solve_block, *a) for a in args]
+                ]
+            return np.vstack(parts) if parts else np.zeros((0, n_factors + 1))
+
+        try:
+            for epoch in range(n_epochs):
+                epoch_start = time.perf_counter()
+                user_side = half_step("user", item_side, len(data.user_ids))
+                item_side = half_step("item", user_side, len(data.item_ids))
+                predicted = predict_pairs(
+                    user_side,
+                    item_side,
+                    rating_users,
+                    data.user_cols,
+                    global_mean,
+                    rating_scale,
+                )
+                stats = {
+                    "epoch": epoch + 1,
+                    "seconds": round(time.perf_counter() - epoch_start, 3),
+                    "train_rmse": rmse(predicted, data.user_values),
+                }
+                epochs.append(stats)
+                if on_epoch is not None:
+                    on_epoch(stats)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            else:
+                init_worker("")
+
+    item_row_array, item_rows = id_row_lookup(
+        dict(zip(data.item_ids.tolist(), range(len(data.item_ids)), strict=True))
+    )
+    factors = SVDFactors(
+        pu=user_side[:, :n_factors],
+        qi=item_side[:, :n_factors],
+        bu=user_side[:, n_factors],
+        bi=item_side[:, n_factors],
+        global_mean=global_mean,
+        rating_scale=tuple(rating_scale),
+        biased=True,
+        user_rows=dict(
+            zip(data.user_ids.tolist(), range(len(data.user_ids)), strict=True)
+        ),
+        item_rows=item_rows,
+        item_row_array=item_row_array,
+        reg_pu=reg,
+        reg_bu=reg_bias,
+        trained_counts=np.diff(data.user_indptr),
+    )
+    return factors, ALSReport(time.perf_counter() - start, epochs)
+
+
+def rating_counts(factors: SVDFactors, ratings: RatingMatrix) -> np.ndarray:
+    """
+    Number of ratings of every model user in `ratings`, aligned with `pu`. Recorded as the trained
+    counts from all of stg_rating rather than the train split, since `MFModel.needs_fold_in`
+    compares them with the user's current count in the database.
+    """
+    counts = np.zeros(len(factors.pu), dtype=np.int64)
+    rows = np.array(
+        [factors.user_row(int(user_id)) for user_id in ratings.user_ids], dtype=np.int64
+    )
+    known = rows >= 0
+    counts[rows[known]] = np.diff(ratings.indptr)[known]
+    return counts
+
+
+def evaluate(factors: SVDFactors, ratings: RatingMatrix) -> float:
+    """
+    RMSE of `factors` on held-out ratings, unknown users/items predicted like surprise.
+    """
+    user_rows = np.array(
+        [factors.user_row(int(user_id)) for user_id in ratings.user_ids], dtype=np.int64
+    )
+    user_rows = np.repeat(user_rows, np.diff(ratings.indptr))
+    item_rows = factors.item_rows_of(ratings.movie_ids)
+    user_side = np.hstack([factors.pu, np.asarray(factors.bu)[:, None]])
+    item_side = np.hstack([factors.qi, np.asarray(factors.bi)[:, None]])
+    predicted = predict_pairs(
+        user_side,
+        item_side,
+        user_rows,
+        item_rows,
+        factors.global_mean,
+        factors.rating_scale,
+    )
+    return rmse(predicted, ratings.ratings)
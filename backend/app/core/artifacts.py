@@ -0,0 +1,53 @@
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def new_build_dir(link_path: str) -> str:
+    """
+    A fresh `<link_path>.<UTC timestamp>` directory for the next build published at `link_path`.
+    Timestamps sort lexically, so the newest builds sort last.
+    """
+    build_dir = f"{link_path}.{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}"
+    os.makedirs(build_dir)
+    return build_dir
+
+
+def publish_build(build_dir: str, link_path: str, keep: int = 2) -> None:
+    """
+    Point `link_path` at `build_dir` with an atomic symlink replace, then delete all but the `keep`
+    newest builds. Readers that still have an older build memory-mapped keep their pages.
+    A plain directory at `link_path` (an unversioned artifact) is kept as the oldest build.
+    """
+    parent = os.path.dirname(os.path.abspath(link_path))
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        os.replace(link_path, f"{link_path}.00000000T000000000000")
+
+    tmp_link = f"{link_path}.tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(build_dir), tmp_link)
+    os.replace(tmp_link, link_path)
+
+    prefix = f"{os.path.basename(link_path)}."
+    builds = sorted(
+        name
+        for name in os.listdir(parent)
+        if name.startswith(prefix) and name != os.path.basename(tmp_link)
+    )
+    for name in builds[:-keep] if keep > 0 else builds:
+        if name != os.path.basename(build_dir):
+            shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+
+def build_version(link_path: str) -> Optional[str]:
+    """
+    The build `link_path` currently points to, or None when nothing was published.
+    """
+    if not os.path.exists(link_path):
+        return None
+    return os.path.realpath(link_path)
@@ -95,6 +95,48 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER: EmailStr
     FIRST_SUPERUSER_PASSWORD: str
 
+    # Query-time parameters for approximate FAISS indices (ignored by flat indices)
+    FAISS_NPROBE: int = 16
+    FAISS_EF_SEARCH: int = 64
+    # Re-rank FAISS_RESCORE_FACTOR * k candidates by exact inner product (useful with sq8/fp16/pq indices; 1 = off)
+    FAISS_RESCORE_FACTOR: int = 1
+    # Search the title/content/type/people indices concurrently on a shared pool (False = one after another)
+    FAISS_PARALLEL_SEARCH: bool = True
+    FAISS_SEARCH_THREADS: int = 4
+    # LRU cache of normalized search query -> embedding per worker (0 = off)
+    EMBEDDING_CACHE_SIZE: int = 10000
+    # Most recently used entries saved on shutdown and preloaded on startup (0 = no persistence)
+    EMBEDDING_CACHE_PERSIST_SIZE: int = 2000
+    # Micro-batch concurrent query encodes: wait up to ENCODER_BATCH_WINDOW_MS for up to ENCODER_MAX_BATCH_SIZE texts
+    ENCODER_BATCHING: bool = True
+    ENCODER_BATCH_WINDOW_MS: float = 2.0
+    ENCODER_MAX_BATCH_SIZE: int = 32
+    # Query encoder backend: "torch" (SentenceTransformer) or "onnx" (needs `python -m app.build_onnx_encoder`)
+    ENCODER_BACKEND: Literal["torch", "onnx"] = "torch"
+    ENCODER_ONNX_QUANTIZED: bool = True
+    # onnxruntime intra-op threads per worker; keep workers * threads <= CPU cores
+    ENCODER_INTRA_OP_THREADS: int = 2
+    # Hybrid search: exact title matches skip the encoder, other queries blend BM25 title hits
+    # with vector hits by reciprocal-rank fusion (False = vector search only)
+    SEARCH_HYBRID: bool = True
+    SEARCH_RRF_K: int = 60
+    # Fold in factors for users who are new or rated movies since the MF model was trained
+    MF_FOLD_IN: bool = True
+    MF_FOLD_IN_CACHE_SIZE: int = 10000
+    # Reload FAISS/MF artifacts in the background when they change (or /admin/models/reload is called)
+    # and swap the warmed generation in; False = keep the startup generation
+    MODEL_HOT_RELOAD: bool = True
+    # Searches and predictions run against a new generation before it serves traffic
+    MODEL_WARMUP_QUERIES: int = 8
+    # Seconds between fetches of the ratings inserted since the rating snapshot (how stale the
+    # in-memory user ratings may be); only used when build_rating_snapshot.py was run
+    RATING_DELTA_REFRESH_SECONDS: float = 1.0
+    # key_ids below the watermark that every delta refresh reads again, for ratings whose transaction
+    # committed after rows with higher key_ids had been read; later commits wait for the next snapshot
+    RATING_DELTA_LAG_KEYS: int = 1_000
+    # Ratings added since the snapshot above which workers warn that build_rating_snapshot.py is due
+    RATING_DELTA_WARN_ROWS: int = 100_000
+
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
             message = (
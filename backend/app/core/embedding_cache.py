@@ -0,0 +1,153 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Generator
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    # all-MiniLM-L6-v2 lower-cases its input, so case and repeated whitespace never change the embedding
+    return " ".join(query.lower().split())
+
+
+@contextmanager
+def _file_lock(path: str, operation: int) -> Generator[None, None, None]:
+    # Workers save on shutdown and load on startup, possibly at the same time during a rolling restart
+    with open(f"{path}.lock", "w") as f:
+        fcntl.flock(f, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of normalized query -> query embedding, shared by the request threads of a worker.
+    The most recently used entries can be saved to a memory-mapped `.npy` file (plus a JSON sidecar
+    holding the keys) and preloaded by the next worker, so a restart does not start cold.
+    """
+
+    def __init__(self, capacity: int, model_name: str, dim: int):
+        self.capacity = capacity
+        self.model_name = model_name
+        self.dim = dim
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query: str, embedding: np.ndarray) -> None:
+        if self.capacity <= 0:
+            return
+        embedding = np.array(embedding, dtype=np.float32)
+        # Callers share the cached array, so it must never be modified in place
+        embedding.setflags(write=False)
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self, query: str, compute: Callable[[str], np.ndarray]
+    ) -> np.ndarray:
+        embedding = self.get(query)
+        if embedding is None:
+            # Encoded outside the lock, so a slow encode never blocks cache hits
+            embedding = compute(query)
+            self.put(query, embedding)
+        return embedding
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def save(self, path: str, keys_path: str, limit: int) -> int:
+        """
+        Write the `limit` most recently used entries; returns how many were written.
+        """
+        with self._lock:
+            items = list(self._entries.items())[-limit:] if limit > 0 else []
+        if not items:
+            return 0
+
+        with _file_lock(keys_path, fcntl.LOCK_EX):
+            tmp_path = f"{path}.tmp"
+            vectors = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.float32, shape=(len(items), self.dim)
+            )
+            for row, (_, embedding) in enumerate(items):
+                vectors[row] = embedding
+            vectors.flush()
+            del vectors
+
+            tmp_keys_path = f"{keys_path}.tmp"
+            with open(tmp_keys_path, "w") as f:
+                json.dump(
+                    {
+                        "model": self.model_name,
+                        "dim": self.dim,
+                        "keys": [key for key, _ in items],
+                    },
+                    f,
+                )
+            os.replace(tmp_path, path)
+            os.replace(tmp_keys_path, keys_path)
+        return len(items)
+
+    def load(self, path: str, keys_path: str) -> int:
+        """
+        Preload entries saved by `save`; files written for another model or dimension are ignored.
+        """
+        if not (os.path.exists(path) and os.path.exists(keys_path)):
+            return 0
+        with _file_lock(keys_path, fcntl.LOCK_SH):
+            with open(keys_path) as f:
+                meta = json.load(f)
+            if meta.get("model") != self.model_name or meta.get("dim") != self.dim:
+                logger.warning(f"Ignoring {path}: it was written for another encoder")
+                return 0
+            vectors = np.load(path, mmap_mode="r")
+        keys = meta["keys"]
+        if len(keys) != len(vectors):
+            logger.warning(
+                f"Ignoring {path}: {len(keys)} keys for {len(vectors)} vectors"
+            )
+            return 0
+
+        # Oldest first, so the saved recency order is kept
+        start = len(keys) - min(len(keys), max(self.capacity, 0))
+        for key, embedding in zip(keys[start:], vectors[start:], strict=True):
+            self.put(key, embedding)
+        return len(keys) - start
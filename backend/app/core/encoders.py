@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Protocol, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class TextEncoder(Protocol):
+    """
+    The part of the SentenceTransformer API the recommender uses; every encoder front-end implements it.
+    """
+
+    def encode(self, sentences: Union[str, List[str]], **kwargs) -> np.ndarray: ...
+
+
+@dataclass
+class _EncodeRequest:
+    texts: List[str]
+    future: Future
+    enqueued_at: float
+
+
+class BatchingEncoder:
+    """
+    Coalesces concurrent `encode` calls into one batched forward pass. Request threads enqueue their
+    texts and block; a background thread takes the first waiting request, gathers whatever else arrives
+    within `window_ms` (or until `max_batch_size` texts), encodes them together and hands every caller
+    its own rows. Only normalized embeddings are batched; other calls go straight to the model, and
+    so do all calls once the encoder is closed.
+    """
+
+    def __init__(
+        self, model: TextEncoder, max_batch_size: int = 32, window_ms: float = 2.0
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self._queue: queue.Queue[Optional[_EncodeRequest]] = queue.Queue()
+        # Guards enqueueing against close(), so that no request lands behind the stop marker
+        self._closed = False
+        self._closed_lock = threading.Lock()
+
+        self._metrics_lock = threading.Lock()
+        self.batch_sizes: Counter[int] = Counter()
+        self.queue_delays_ms: deque[float] = deque(maxlen=10000)
+        self.encode_ms: deque[float] = deque(maxlen=10000)
+
+        self._thread = threading.Thread(
+            target=self._run, name="batching-encoder", daemon=True
+        )
+        self._thread.start()
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        normalize_embeddings: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        if not normalize_embeddings:
+            return self.model.encode(
+                sentences, normalize_embeddings=normalize_embeddings, **kwargs
+            )
+
+        single = isinstance(sentences, str)
+        future: Future = Future()
+        with self._closed_lock:
+            if self._closed:
+                return self.model.encode(sentences, normalize_embeddings=True, **kwargs)
+            self._queue.put(
+                _EncodeRequest(
+                    [sentences] if single else list(sentences),
+                    future,
+                    time.perf_counter(),
+                )
+            )
+        embeddings = future.result()
+        return embeddings[0] if single else embeddings
+
+    def _next_batch(self) -> List[_EncodeRequest]:
+        first = self._queue.get()
+        if first is None:
+            return []
+
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.perf_counter() + self.window
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish this batch, stop on the next call
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self) -> None:
+        try:
+            self._serve()
+        finally:
+            # Nothing should be left after the stop marker, but never leave a caller blocked
+            while True:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None and not request.future.done():
+                    request.future.set_exception(
+                        RuntimeError("BatchingEncoder is closed")
+                    )
+
+    def _serve(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                embeddings = self.model.encode(
+                    texts,
+                    batch_size=self.max_batch_size,
+                    normalize_embeddings=True,
+                    show_progress_bar=False,
+                )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in batch:
+                request.future.set_result(
+                    embeddings[offset : offset + len(request.texts)]
+                )
+                offset += len(request.texts)
+
+            with self._metrics_lock:
+                self.batch_sizes[len(texts)] += 1
+                self.queue_delays_ms.extend(
+                    (started - request.enqueued_at) * 1000 for request in batch
+                )
+                self.encode_ms.append((time.perf_counter() - started) * 1000)
+
+    def stats(self) -> Dict[str, object]:
+        with self._metrics_lock:
+            batches = sum(self.batch_sizes.values())
+            texts = sum(size * count for size, count in self.batch_sizes.items())
+            delays = (
+                np.array(self.queue_delays_ms) if self.queue_delays_ms else np.zeros(1)
+            )
+            encode_ms = np.array(self.encode_ms) if self.encode_ms else np.zeros(1)
+            return {
+                "batches": batches,
+                "texts": texts,
+                "mean_batch_size": texts / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_delay_p50_ms": float(np.percentile(delays, 50)),
+                "queue_delay_p99_ms": float(np.percentile(delays, 99)),
+                "encode_p50_ms": float(np.percentile(encode_ms, 50)),
+                "encode_p99_ms": float(np.percentile(encode_ms, 99)),
+            }
+
+    def close(self) -> None:
+        with self._closed_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class OnnxEncoder:
+    """
+    The sentence encoder exported to ONNX by `app.build_onnx_encoder` (mean pooling is part of the graph)
+    and run with onnxruntime on CPU, by default with dynamically int8-quantized weights.
+    onnxruntime is an optional dependency, imported only when this backend is selected.
+    """
+
+    def __init__(self, model_dir: str, model_file: str, intra_op_threads: int):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, "encoder.json")) as f:
+            self.config = json.load(f)
+        self.max_seq_length = self.config["max_seq_length"]
+        self.dim = self.config["dim"]
+
+        options = ort.SessionOptions()
+        # One forward pass at a time per worker, parallelised inside the matmuls
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        batches = []
+        for lo in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                texts[lo : lo + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            batches.append(self.session.run(["sentence_embedding"], feeds)[0])
+        embeddings = (
+            np.concatenate(batches)
+            if batches
+            else np.empty((0, self.dim), dtype=np.float32)
+        )
+
+        if normalize_embeddings:
+            embeddings /= np.maximum(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12
+            )
+        return embeddings[0] if single else embeddings
@@ -0,0 +1,529 @@
+import json
+import logging
+import math
+import os
+import pickle
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from app import constants
+
+INDEX_TYPES: List[str] = ["flat", "ivf", "hnsw", "sq8", "fp16", "pq"]
+
+# Families whose stored codes are lossy; their hits can be re-scored against the float32 vectors
+COMPRESSED_INDEX_TYPES: List[str] = ["sq8", "fp16", "pq"]
+
+FIELD_INDEX_PATHS: Dict[str, str] = {
+    "title": constants.EmbeddingModelConstants.PATH_FAISS_TITLE_INDEX,
+    "content": constants.EmbeddingModelConstants.PATH_FAISS_CONTENT_INDEX,
+    "type": constants.EmbeddingModelConstants.PATH_FAISS_TYPE_INDEX,
+    "people": constants.EmbeddingModelConstants.PATH_FAISS_PEOPLE_INDEX,
+}
+
+
+FIELD_VECTOR_PATHS: Dict[str, str] = {
+    "title": constants.EmbeddingModelConstants.PATH_TITLE_VECTORS,
+    "content": constants.EmbeddingModelConstants.PATH_CONTENT_VECTORS,
+    "type": constants.EmbeddingModelConstants.PATH_TYPE_VECTORS,
+    "people": constants.EmbeddingModelConstants.PATH_PEOPLE_VECTORS,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def read_embedding_pickle() -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Read movie_embedding.pkl (the notebook's encoder output) into one float32 matrix per field;
+    row i of every matrix is movie `ids[i]`.
+    """
+    with open(constants.EmbeddingModelConstants.PATH_MOVIE_EMBEDDING, "rb") as f:
+        embedding_dict = pickle.load(f)
+
+    ids = np.fromiter(embedding_dict.keys(), dtype=np.int64, count=len(embedding_dict))
+    vectors = {
+        field: np.array(
+            [embedding_dict[mid][f"{field}_vector"] for mid in embedding_dict],
+            dtype=np.float32,
+        )
+        for field in constants.SEARCH_TYPE
+    }
+    return ids, vectors
+
+
+def movie_rows(ids: np.ndarray) -> np.ndarray:
+    """
+    Dense movie id -> row lookup (-1 for ids without a row), so row lookups are a single array read.
+    """
+    rows = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype=np.int32)
+    rows[ids] = np.arange(len(ids), dtype=np.int32)
+    return rows
+
+
+def save_npy_atomic(path: str, array: np.ndarray) -> None:
+    """
+    Write to a temporary file and rename it over `path`, so readers (and existing memory maps)
+    never see a half-written file.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def write_index_atomic(index: faiss.Index, path: str) -> None:
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_field_vectors(ids: np.ndarray, vectors: dict[str, np.ndarray]) -> None:
+    ids = np.asarray(ids, dtype=np.int64)
+    for field in constants.SEARCH_TYPE:
+        save_npy_atomic(
+            FIELD_VECTOR_PATHS[field],
+            np.ascontiguousarray(vectors[field], dtype=np.float32),
+        )
+    save_npy_atomic(constants.EmbeddingModelConstants.PATH_MOVIE_ROWS, movie_rows(ids))
+    save_npy_atomic(constants.EmbeddingModelConstants.PATH_MOVIE_IDS, ids)
+
+
+def load_field_vectors(
+    mmap_mode: Optional[str] = "r",
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Open the `.npy` layout written by `write_field_vectors`. With mmap_mode="r" nothing is read up front
+    and every worker process shares the same page-cache pages.
+    """
+    ids = np.load(constants.EmbeddingModelConstants.PATH_MOVIE_IDS, mmap_mode=mmap_mode)
+    vectors = {
+        field: np.load(FIELD_VECTOR_PATHS[field], mmap_mode=mmap_mode)
+        for field in constants.SEARCH_TYPE
+    }
+    return ids, vectors
+
+
+def field_vectors_exist() -> bool:
+    return all(
+        os.path.exists(path)
+        for path in [
+            constants.EmbeddingModelConstants.PATH_MOVIE_IDS,
+            *FIELD_VECTOR_PATHS.values(),
+        ]
+    )
+
+
+def read_index_mmap(path: str) -> faiss.Index:
+    """
+    Open an index with FAISS's mmap flags so that workers share its storage through the page cache.
+    IO_FLAG_MMAP_IFC (FAISS >= 1.8) also maps flat codes but makes IVF lists fail to load, so it is
+    dropped on the first failure; index types FAISS cannot map at all are read into memory instead.
+    """
+    io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    ifc_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if ifc_flag:
+        try:
+            return faiss.read_index(path, io_flags | ifc_flag)
+        except RuntimeError as e:
+            logger.info(
+                f"Could not mmap {path} with IO_FLAG_MMAP_IFC, retrying without it: {e}"
+            )
+    try:
+        return faiss.read_index(path, io_flags)
+    except RuntimeError as e:
+        logger.warning(f"Could not mmap {path}, reading it into memory: {e}")
+        return faiss.read_index(path)
+
+
+def read_index_manifest() -> Optional[dict]:
+    path = constants.EmbeddingModelConstants.PATH_INDEX_MANIFEST
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_index_manifest() -> dict:
+    """
+    Bump the artifact version after the indices or vectors changed. Serving workers compare the
+    manifest's mtime on every request and reload when it moves.
+    """
+    previous = read_index_manifest() or {}
+    manifest = {
+        "version": previous.get("version", 0) + 1,
+        "keyed_by": "movie_id",
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    tmp_path = f"{constants.EmbeddingModelConstants.PATH_INDEX_MANIFEST}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, constants.EmbeddingModelConstants.PATH_INDEX_MANIFEST)
+    return manifest
+
+
+def index_manifest_mtime() -> Optional[int]:
+    try:
+        return os.stat(
+            constants.EmbeddingModelConstants.PATH_INDEX_MANIFEST
+        ).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class FusedVectors:
+    """
+    Read-only view of [sqrt(w_title) * title, sqrt(w_content) * content, ...] for every movie row.
+    The inner product of two such rows is the weighted sum of their per-field inner products, so a
+    single index over this view returns the exact content-based fused top-k. Rows are assembled
+    on access from the per-field matrices; nothing is materialized at serving time.
+    """
+
+    def __init__(self, field_vectors: Dict[str, np.ndarray], weights: Dict[str, float]):
+        self.field_vectors = field_vectors
+        self.scales = {
+            field: math.sqrt(weights.get(field, 0.0)) for field in constants.SEARCH_TYPE
+        }
+        n, dim = field_vectors[constants.SEARCH_TYPE[0]].shape
+        self.shape = (n, dim * len(constants.SEARCH_TYPE))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return np.concatenate(
+            [
+                self.scales[field] * self.field_vectors[field][rows]
+                for field in constants.SEARCH_TYPE
+            ],
+            axis=-1,
+        ).astype(np.float32)
+
+
+class MovieVectors:
+    """
+    Read-only view of row-ordered vectors (a field matrix or FusedVectors) indexed by movie id,
+    the id the FAISS indices are keyed by. Used to re-score FAISS hits exactly.
+    """
+
+    def __init__(self, vectors, rows: np.ndarray):
+        self.vectors = vectors
+        self.rows = rows
+        self.shape = vectors.shape
+
+    def __getitem__(self, movie_ids) -> np.ndarray:
+        return self.vectors[self.rows[movie_ids]]
+
+
+def default_nlist(n_vectors: int) -> int:
+    # Rule of thumb from the FAISS wiki: ~4 * sqrt(N) lists, at least 39 training points per list
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def index_factory_string(
+    index_type: str,
+    n_vectors: int,
+    nlist: Optional[int] = None,
+    hnsw_m: int = 32,
+    pq_m: int = 48,
+) -> str:
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{nlist or default_nlist(n_vectors)},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    if index_type == "sq8":
+        # 1 byte per dimension (4x smaller than float32)
+        return "SQ8"
+    if index_type == "fp16":
+        # 2 bytes per dimension (2x smaller than float32)
+        return "SQfp16"
+    if index_type == "pq":
+        # `pq_m` sub-quantizers of 8 bits each: pq_m bytes per vector
+        return f"PQ{pq_m}x8"
+    raise ValueError(f"Invalid index type: {index_type}")
+
+
+def build_index(
+    vectors: np.ndarray,
+    index_type: str = "flat",
+    nlist: Optional[int] = None,
+    hnsw_m: int = 32,
+    ef_construction: int = 200,
+    pq_m: int = 48,
+    ids: Optional[np.ndarray] = None,
+) -> faiss.Index:
+    """
+    Build an inner-product index over L2-normalized vectors (inner product == cosine similarity).
+    With `ids` the index is keyed by them (movie ids) and supports add_with_ids/remove_ids:
+    IVF stores ids natively, the other families are wrapped in an IndexIDMap2.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    factory = index_factory_string(index_type, n, nlist, hnsw_m, pq_m)
+    index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        index.train(vectors)
+    if ids is None:
+        index.add(vectors)
+        return index
+
+    if faiss.try_extract_index_ivf(index) is None:
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def key_index_by_movie_id(
+    index: faiss.Index, vectors: np.ndarray, ids: np.ndarray
+) -> faiss.Index:
+    """
+    Re-add the vectors of an index whose FAISS ids are positions under movie ids, keeping what it
+    was trained on (IVF centroids, SQ/PQ codebooks, HNSW parameters): the same layout as `build_index(ids=...)`.
+    """
+    index.reset()
+    if faiss.try_extract_index_ivf(index) is None:
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(
+        np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64)
+    )
+    return index
+
+
+def unwrap_index(index: faiss.Index) -> tuple[faiss.Index, Optional[np.ndarray]]:
+    """
+    The index doing the search and, for an IndexIDMap(2), a zero-copy view of its
+    internal id -> movie id map.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        id_map = faiss.rev_swig_ptr(index.id_map.data(), index.id_map.size())
+        return faiss.downcast_index(index.index), id_map
+    return index, None
+
+
+def is_keyed_index(index: faiss.Index) -> bool:
+    return (
+        unwrap_index(index)[1] is not None
+        or faiss.try_extract_index_ivf(index) is not None
+    )
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    # HNSW graphs cannot drop nodes; such indices have to be rebuilt
+    return not isinstance(unwrap_index(index)[0], faiss.IndexHNSW)
+
+
+def configure_search(
+    index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+) -> faiss.Index:
+    """
+    Apply query-time parameters to an index; parameters that do not apply to the index family are ignored.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+
+    hnsw, _ = unwrap_index(index)
+    if isinstance(hnsw, faiss.IndexHNSW) and ef_search is not None:
+        hnsw.hnsw.efSearch = ef_search
+
+    return index
+
+
+def describe_index(index: faiss.Index) -> str:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return f"ivf(nlist={ivf.nlist}, nprobe={ivf.nprobe})"
+    inner, _ = unwrap_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return f"hnsw(M={inner.hnsw.nb_neighbors(1)}, efSearch={inner.hnsw.efSearch})"
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(inner, faiss.IndexPQ):
+        return f"pq(M={inner.pq.M})"
+    return "flat"
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """
+    Size of the serialized index, a close proxy for what a worker holds in RAM after read_index.
+    """
+    return int(faiss.serialize_index(index).size)
+
+
+class IdFilter:
+    """
+    Set of allowed movie ids stored as a packed, little-endian bitmap (bit i = id i), the layout
+    FAISS's IDSelectorBitmap reads. The search skips excluded ids, so a filtered query costs about
+    the same as an unfiltered one.
+    """
+
+    def __init__(self, bitmap: np.ndarray, n: int):
+        self.bitmap = np.ascontiguousarray(bitmap, dtype=np.uint8)
+        self.n = n
+        # The selector only points into self.bitmap, which must outlive it; its size is in bytes
+        self.selector = faiss.IDSelectorBitmap(
+            len(self.bitmap), faiss.swig_ptr(self.bitmap)
+        )
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids < self.n)
+        safe = np.where(inside, ids, 0)
+        return inside & ((self.bitmap[safe >> 3] >> (safe & 7)) & 1).astype(bool)
+
+    def count(self) -> int:
+        return int(np.unpackbits(self.bitmap, count=self.n, bitorder="little").sum())
+
+
+def search_parameters(
+    index: faiss.Index, selector: faiss.IDSelector
+) -> faiss.SearchParameters:
+    """
+    Search parameters carrying `selector`. IVF/HNSW parameter objects replace the index's own
+    nprobe/efSearch, so the current values are copied over.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+# Over-fetch factor for index families that reject selectors (e.g. PQ) and are filtered after the search
+FILTER_OVERFETCH = 8
+
+
+def filtered_search(
+    index: faiss.Index,
+    queries: np.ndarray,
+    k: int,
+    id_filter: Optional[IdFilter] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `index.search` that only returns ids allowed by `id_filter`; missing hits are labelled -1.
+    """
+    if id_filter is None:
+        return index.search(queries, k)
+
+    try:
+        # An IndexIDMap2 would hand its inner index plain SearchParameters (dropping nprobe/efSearch),
+        # so search the inner index with a selector translated to its internal ids
+        inner, id_map = unwrap_index(index)
+        if id_map is None:
+            return inner.search(
+                queries, k, params=search_parameters(inner, id_filter.selector)
+            )
+        selector = faiss.IDSelectorTranslated(index.id_map, id_filter.selector)
+        distances, labels = inner.search(
+            queries, k, params=search_parameters(inner, selector)
+        )
+        return distances, np.where(labels >= 0, id_map[np.maximum(labels, 0)], -1)
+    except RuntimeError:
+        distances, labels = index.search(queries, k * FILTER_OVERFETCH)
+        allowed = id_filter.contains(labels)
+        distances = np.where(allowed, distances, -np.inf)
+        order = np.argsort(-distances, axis=1, kind="stable")[:, :k]
+        labels = np.where(allowed, labels, -1)
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(
+            labels, order, axis=1
+        )
+
+
+def search_index(
+    index: faiss.Index,
+    queries: np.ndarray,
+    k: int,
+    vectors: Optional[np.ndarray] = None,
+    rescore_factor: int = 1,
+    id_filter: Optional[IdFilter] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `index.search` restricted to `id_filter`, optionally over-fetching `rescore_factor * k`
+    candidates and re-ranking them by their exact inner product with the float32 `vectors`
+    (indexed like the FAISS ids, see MovieVectors). Re-scoring recovers most of the recall lost to
+    SQ/PQ compression at the cost of one small gather per query.
+    """
+    if vectors is None or rescore_factor <= 1:
+        return filtered_search(index, queries, k, id_filter)
+
+    _, candidates = filtered_search(index, queries, k * rescore_factor, id_filter)
+    valid = candidates >= 0
+    exact = np.einsum("qkd,qd->qk", vectors[np.where(valid, candidates, 0)], queries)
+    exact[~valid] = -np.inf
+
+    order = np.argsort(-exact, axis=1, kind="stable")[:, :k]
+    distances = np.take_along_axis(exact, order, axis=1).astype(np.float32)
+    labels = np.take_along_axis(candidates, order, axis=1)
+    labels[np.isinf(distances)] = -1
+    return distances, labels
+
+
+def recall_at_k(ground_truth: np.ndarray, labels: np.ndarray) -> float:
+    """
+    Fraction of the exact top-k neighbours (rows of `ground_truth`) found in the approximate top-k.
+    """
+    k = ground_truth.shape[1]
+    hits = sum(
+        len(np.intersect1d(gt[gt >= 0], found[found >= 0], assume_unique=True))
+        for gt, found in zip(ground_truth, labels, strict=True)
+    )
+    return hits / float(ground_truth.shape[0] * k)
+
+
+def measure_latency(
+    index: faiss.Index,
+    queries: np.ndarray,
+    k: int,
+    vectors: Optional[np.ndarray] = None,
+    rescore_factor: int = 1,
+) -> Dict[str, float]:
+    """
+    Time single-query searches, the way the API issues them, and return latency percentiles in ms.
+    """
+    timings = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        search_index(index, queries[i : i + 1], k, vectors, rescore_factor)
+        timings[i] = (time.perf_counter() - start) * 1000
+
+    return {
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "mean_ms": float(timings.mean()),
+    }
+
+
+def evaluate_against_flat(
+    index: faiss.Index,
+    flat_index: faiss.Index,
+    queries: np.ndarray,
+    k: int = 50,
+    vectors: Optional[np.ndarray] = None,
+    rescore_factor: int = 1,
+) -> Dict[str, float]:
+    """
+    Compare recall@k and single-query latency of `index` against the exact flat baseline.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    _, ground_truth = flat_index.search(queries, k)
+    _, labels = search_index(index, queries, k, vectors, rescore_factor)
+
+    baseline = measure_latency(flat_index, queries, k)
+    candidate = measure_latency(index, queries, k, vectors, rescore_factor)
+
+    return {
+        "recall_at_k": recall_at_k(ground_truth, labels),
+        "flat_p50_ms": baseline["p50_ms"],
+        "flat_p99_ms": baseline["p99_ms"],
+        "p50_ms": candidate["p50_ms"],
+        "p99_ms": candidate["p99_ms"],
+    }
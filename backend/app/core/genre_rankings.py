@@ -0,0 +1,84 @@
+import heapq
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlmodel import Session
+
+logger = logging.getLogger(__name__)
+
+
+class GenreRankings:
+    """
+    Per-genre (movie ids, wr_80th) arrays of mv_high_quality_movies sorted by wr descending, then
+    movie id. A multi-genre top-k is a heap-based k-way merge of the genres' heads with duplicates
+    (movies in several requested genres) dropped.
+    """
+
+    def __init__(self, rankings: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        self.rankings = rankings
+
+    @classmethod
+    def from_rows(
+        cls, genres: List[str], movie_ids: np.ndarray, wr: np.ndarray
+    ) -> "GenreRankings":
+        genres = np.asarray(genres, dtype=object)
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        wr = np.asarray(wr, dtype=np.float64)
+        rankings = {}
+        for genre in np.unique(genres).tolist():
+            rows = np.flatnonzero(genres == genre)
+            order = rows[np.lexsort((movie_ids[rows], -wr[rows]))]
+            rankings[genre] = (movie_ids[order], wr[order])
+        return cls(rankings)
+
+    @classmethod
+    def from_db(cls, session: Session) -> "GenreRankings":
+        # Only movies with metadata, which the route can hydrate
+        rows = session.execute(
+            text("""
+            SELECT h.genre, h.movie_id, h.wr_80th
+            FROM mv_high_quality_movies h
+            JOIN stg_movie_metadata m ON h.movie_id = m.id
+            WHERE h.wr_80th IS NOT NULL AND h.genre IS NOT NULL
+        """)
+        ).fetchall()
+        return cls.from_rows(
+            [r.genre for r in rows],
+            np.array([r.movie_id for r in rows], dtype=np.int64),
+            np.array([r.wr_80th for r in rows], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids, _ in self.rankings.values())
+
+    def top(
+        self, genres: List[str], k: Optional[int], exclude: Iterable[int] = ()
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The k best (movie ids, wr) over the union of `genres`, each movie once and none of `exclude`;
+        all of them when k is None (a /by-genres request without a limit).
+        Only the first k + len(exclude) of each genre can make it, so the merge touches no more.
+        """
+        seen = set(exclude)
+        head = None if k is None else k + len(seen)
+        streams = [
+            zip(
+                (-self.rankings[genre][1][:head]).tolist(),
+                self.rankings[genre][0][:head].tolist(),
+                strict=True,
+            )
+            for genre in dict.fromkeys(genres)
+            if genre in self.rankings
+        ]
+        movie_ids, scores = [], []
+        for neg_wr, movie_id in heapq.merge(*streams):
+            if movie_id in seen:
+                continue
+            seen.add(movie_id)
+            movie_ids.append(movie_id)
+            scores.append(-neg_wr)
+            if len(movie_ids) == k:
+                break
+        return np.array(movie_ids, dtype=np.int64), np.array(scores, dtype=np.float64)
@@ -0,0 +1,230 @@
+import fcntl
+import json
+import logging
+import os
+from collections.abc import Generator
+from contextlib import contextmanager
+from typing import Dict, List
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app import constants
+from app.core.faiss_index import (
+    FIELD_INDEX_PATHS,
+    FusedVectors,
+    field_vectors_exist,
+    is_keyed_index,
+    key_index_by_movie_id,
+    load_field_vectors,
+    movie_rows,
+    read_embedding_pickle,
+    read_index_manifest,
+    supports_remove,
+    unwrap_index,
+    write_field_vectors,
+    write_index_atomic,
+    write_index_manifest,
+)
+
+logger = logging.getLogger(__name__)
+
+# Same per-field text as the notebook that produced movie_embedding.pkl
+MOVIE_TEXT_QUERY = """
+SELECT
+    smm.id,
+    NULLIF(CONCAT_WS('.', smm.title, smm.belongs_to_collection), '') AS title_vector,
+    NULLIF(CONCAT_WS('.', smm.overview, smm.tagline), '') AS content_vector,
+    NULLIF(CONCAT_WS(',', smm.keywords, sg.genres), '') AS type_vector,
+    NULLIF(CONCAT_WS(',', sc.cast), '') AS people_vector
+FROM stg_movie_metadata smm
+LEFT JOIN (
+    SELECT movie_id, STRING_AGG(genre, ',') AS genres
+    FROM stg_genre
+    GROUP BY movie_id
+) sg ON smm.id = sg.movie_id
+LEFT JOIN (
+    SELECT movie_id, STRING_AGG(concat(role, ' ', name), '.') AS cast
+    FROM stg_cast
+    GROUP BY movie_id
+) sc ON smm.id = sc.movie_id
+WHERE smm.id = ANY(:movie_ids)
+"""
+
+
+@contextmanager
+def index_write_lock() -> Generator[None, None, None]:
+    """
+    Serialize writers across processes (API workers and the CLI); readers never take it.
+    """
+    with open(constants.EmbeddingModelConstants.PATH_INDEX_LOCK, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def encode_movies(
+    session: Session, model: SentenceTransformer, movie_ids: List[int]
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Encode the four field texts of the given movies; movies missing from stg_movie_metadata are skipped.
+    """
+    rows = session.execute(
+        text(MOVIE_TEXT_QUERY), {"movie_ids": list(movie_ids)}
+    ).fetchall()
+    ids = np.array([row.id for row in rows], dtype=np.int64)
+    vectors = {}
+    for field in constants.SEARCH_TYPE:
+        if not rows:
+            vectors[field] = np.empty(
+                (0, constants.EmbeddingModelConstants.VECTOR_EMBEDDING_DIM),
+                dtype=np.float32,
+            )
+            continue
+        texts = [getattr(row, f"{field}_vector") or "" for row in rows]
+        vectors[field] = model.encode(
+            texts, normalize_embeddings=True, show_progress_bar=False
+        ).astype(np.float32)
+    return ids, vectors
+
+
+def _index_paths() -> Dict[str, str]:
+    paths = dict(FIELD_INDEX_PATHS)
+    if os.path.exists(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_INDEX):
+        paths["fused"] = constants.EmbeddingModelConstants.PATH_FAISS_FUSED_INDEX
+    return paths
+
+
+def _read_writable_indices(replacing: bool) -> Dict[str, faiss.Index]:
+    indices = {name: faiss.read_index(path) for name, path in _index_paths().items()}
+    for name, index in indices.items():
+        if not is_keyed_index(index):
+            raise ValueError(
+                f"The {name} index is not keyed by movie id; rebuild it with app.build_faiss_index"
+            )
+        if replacing and not supports_remove(index):
+            raise ValueError(
+                f"The {name} index is HNSW and cannot remove movies; rebuild it instead"
+            )
+    return indices
+
+
+def indices_keyed_by_movie_id() -> bool:
+    manifest = read_index_manifest()
+    return manifest is not None and manifest.get("keyed_by") == "movie_id"
+
+
+def migrate_legacy_indices() -> bool:
+    """
+    Convert indices built before they were keyed by movie id (FAISS id i = row i of movie_ids.npy,
+    i.e. the old faissid_to_movieid.pkl) in place and write the manifest. Returns False when there
+    was nothing to convert.
+    """
+    if indices_keyed_by_movie_id():
+        return False
+    with index_write_lock():
+        # Another worker may have converted them while this one waited for the lock
+        if indices_keyed_by_movie_id():
+            return False
+        if not field_vectors_exist():
+            write_field_vectors(*read_embedding_pickle())
+        ids, vectors = load_field_vectors(mmap_mode=None)
+        for name, path in _index_paths().items():
+            index = faiss.read_index(path)
+            if unwrap_index(index)[1] is not None:
+                continue
+            if index.ntotal != len(ids):
+                raise RuntimeError(
+                    f"The {name} index holds {index.ntotal} vectors for {len(ids)} movies; rebuild it with app.build_faiss_index"
+                )
+            if name == "fused":
+                with open(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_META) as f:
+                    source = FusedVectors(vectors, json.load(f)["weights"])[
+                        np.arange(len(ids))
+                    ]
+            else:
+                source = vectors[name]
+            write_index_atomic(key_index_by_movie_id(index, source, ids), path)
+            logger.info(f"Keyed the {name} index by movie id")
+        write_index_manifest()
+    return True
+
+
+def upsert_movies(ids: np.ndarray, vectors: dict[str, np.ndarray]) -> int:
+    """
+    Insert or replace movies in the vector store and in every index (the fused one too, if built),
+    then bump the manifest so the serving workers reload. Returns the number of new movies.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return 0
+
+    with index_write_lock():
+        all_ids, all_vectors = load_field_vectors(mmap_mode=None)
+        existing = np.isin(ids, all_ids)
+        indices = _read_writable_indices(replacing=bool(existing.any()))
+
+        # Replaced movies keep their row, new movies are appended
+        rows = movie_rows(all_ids)
+        for field in constants.SEARCH_TYPE:
+            updated = np.concatenate([all_vectors[field], vectors[field][~existing]])
+            updated[rows[ids[existing]]] = vectors[field][existing]
+            all_vectors[field] = updated
+        all_ids = np.concatenate([all_ids, ids[~existing]])
+
+        added = dict(vectors)
+        if "fused" in indices:
+            with open(constants.EmbeddingModelConstants.PATH_FAISS_FUSED_META) as f:
+                added["fused"] = FusedVectors(vectors, json.load(f)["weights"])[
+                    np.arange(len(ids))
+                ]
+
+        paths = _index_paths()
+        for name, index in indices.items():
+            if existing.any():
+                index.remove_ids(ids[existing])
+            index.add_with_ids(np.ascontiguousarray(added[name], dtype=np.float32), ids)
+            write_index_atomic(index, paths[name])
+
+        write_field_vectors(all_ids, all_vectors)
+        manifest = write_index_manifest()
+
+    logger.info(
+        f"Upserted {len(ids)} movies ({int((~existing).sum())} new), index version {manifest['version']}"
+    )
+    return int((~existing).sum())
+
+
+def delete_movies(ids: np.ndarray) -> int:
+    """
+    Remove movies from the vector store and every index, then bump the manifest.
+    Returns the number of movies that were present.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+
+    with index_write_lock():
+        all_ids, all_vectors = load_field_vectors(mmap_mode=None)
+        present = np.isin(all_ids, ids)
+        if not present.any():
+            return 0
+        indices = _read_writable_indices(replacing=True)
+
+        paths = _index_paths()
+        for name, index in indices.items():
+            index.remove_ids(ids)
+            write_index_atomic(index, paths[name])
+
+        write_field_vectors(
+            all_ids[~present], {field: v[~present] for field, v in all_vectors.items()}
+        )
+        manifest = write_index_manifest()
+
+    logger.info(
+        f"Deleted {int(present.sum())} movies, index version {manifest['version']}"
+    )
+    return int(present.sum())
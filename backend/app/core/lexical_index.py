@@ -0,0 +1,280 @@
+import logging
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.faiss_index import IdFilter
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize_title(title: Optional[str]) -> str:
+    """
+    Case-, accent- and punctuation-insensitive form of a title or query: "Amélie!" -> "amelie".
+    """
+    if not title:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", title.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(_WORD.findall(stripped))
+
+
+class TitleLexicalIndex:
+    """
+    In-memory lexical index over movie titles and original titles: a normalized title -> movie ids
+    map for exact matches, and a BM25 term-weight matrix (movies x tokens, CSC) for ranked keyword
+    matches. Scoring a query sums a few sparse columns, which takes microseconds where a vector
+    search needs an encode plus one scan per field.
+    """
+
+    def __init__(
+        self,
+        movie_ids: np.ndarray,
+        titles: List[Optional[str]],
+        original_titles: List[Optional[str]],
+        popularity: Optional[np.ndarray] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        n = len(self.movie_ids)
+        # Ties (remakes, shared titles) go to the more-voted movie
+        self.popularity = (
+            np.zeros(n)
+            if popularity is None
+            else np.nan_to_num(np.asarray(popularity, dtype=np.float64))
+        )
+
+        exact: Dict[str, List[int]] = defaultdict(list)
+        vocabulary: Dict[str, int] = {}
+        docs, terms, counts = [], [], []
+        lengths = np.zeros(n)
+        for doc, (title, original_title) in enumerate(
+            zip(titles, original_titles, strict=True)
+        ):
+            names = dict.fromkeys(
+                name
+                for name in (normalize_title(title), normalize_title(original_title))
+                if name
+            )
+            tokens = []
+            for name in names:
+                exact[name].append(doc)
+                tokens.extend(name.split())
+            lengths[doc] = len(tokens)
+            for token, count in Counter(tokens).items():
+                docs.append(doc)
+                terms.append(vocabulary.setdefault(token, len(vocabulary)))
+                counts.append(count)
+
+        self.vocabulary = vocabulary
+        self.exact = {
+            name: np.array(
+                sorted(rows, key=lambda row: -self.popularity[row]), dtype=np.int64
+            )
+            for name, rows in exact.items()
+        }
+
+        docs = np.asarray(docs, dtype=np.int64)
+        terms = np.asarray(terms, dtype=np.int64)
+        tf = np.asarray(counts, dtype=np.float64)
+        df = np.bincount(terms, minlength=len(vocabulary))
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        avg_length = lengths.mean() if n and lengths.mean() > 0 else 1.0
+        weights = (
+            idf[terms]
+            * tf
+            * (k1 + 1)
+            / (tf + k1 * (1 - b + b * lengths[docs] / avg_length))
+        )
+        self.weights = sp.csc_matrix(
+            (weights.astype(np.float32), (docs, terms)), shape=(n, len(vocabulary))
+        )
+
+    @classmethod
+    def from_db(
+        cls, session: Session, keep: Optional[Callable[[np.ndarray], np.ndarray]] = None
+    ) -> "TitleLexicalIndex":
+        """
+        Build the index from stg_movie_metadata; `keep` (movie ids -> mask) drops movies that are not searchable.
+        """
+        rows = session.execute(
+            text("""
+            SELECT id, title, original_title, vote_count
+            FROM stg_movie_metadata
+            WHERE title IS NOT NULL OR original_title IS NOT NULL
+        """)
+        ).fetchall()
+        movie_ids = np.array([r.id for r in rows], dtype=np.int64)
+        mask = keep(movie_ids) if keep is not None else np.ones(len(rows), dtype=bool)
+        rows = [r for r, kept in zip(rows, mask, strict=True) if kept]
+
+        index = cls(
+            movie_ids[mask],
+            [r.title for r in rows],
+            [r.original_title for r in rows],
+            np.array([r.vote_count or 0 for r in rows], dtype=np.float64),
+        )
+        logger.info(
+            f"Title lexical index: {len(index.movie_ids)} movies, {len(index.vocabulary)} tokens"
+        )
+        return index
+
+    def exact_matches(
+        self, query: str, id_filter: Optional[IdFilter] = None
+    ) -> np.ndarray:
+        """
+        Movie ids whose title or original title equals the normalized query, most voted first.
+        """
+        rows = self.exact.get(normalize_title(query))
+        if rows is None:
+            return np.empty(0, dtype=np.int64)
+        movie_ids = self.movie_ids[rows]
+        if id_filter is not None:
+            movie_ids = movie_ids[id_filter.contains(movie_ids)]
+        return movie_ids
+
+    def search(
+        self, query: str, k: int, id_filter: Optional[IdFilter] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (movie ids, scores) by BM25 over title tokens, with exact title matches ranked first.
+        Scores are relative to the best keyword hit and fall in (0, 1]; exact matches score 1.0.
+        """
+        tokens = dict.fromkeys(normalize_title(query).split())
+        columns = [
+            self.vocabulary[token] for token in tokens if token in self.vocabulary
+        ]
+        if not columns:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        starts, ends = (
+            self.weights.indptr[columns],
+            self.weights.indptr[np.array(columns) + 1],
+        )
+        rows = np.concatenate(
+            [self.weights.indices[s:e] for s, e in zip(starts, ends, strict=True)]
+        )
+        data = np.concatenate(
+            [self.weights.data[s:e] for s, e in zip(starts, ends, strict=True)]
+        )
+        scores = np.bincount(rows, weights=data, minlength=len(self.movie_ids))
+
+        exact_rows = self.exact.get(normalize_title(query))
+        if exact_rows is not None:
+            scores[exact_rows] = np.inf
+        candidates = np.flatnonzero(scores)
+        if id_filter is not None:
+            candidates = candidates[id_filter.contains(self.movie_ids[candidates])]
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        order = np.lexsort((-self.popularity[candidates], -scores[candidates]))[:k]
+        top = candidates[order]
+        top_scores = scores[top]
+        finite = np.isfinite(top_scores)
+        best = top_scores[finite].max() if finite.any() else 1.0
+        return self.movie_ids[top], np.where(finite, top_scores / best, 1.0).astype(
+            np.float32
+        )
+
+
+# "the matrix" is also found by "matrix"
+LEADING_ARTICLES = {"the", "a", "an"}
+
+
+class TitlePrefixIndex:
+    """
+    Sorted list of normalized titles, original titles and titles without a leading article, for
+    autocomplete. The entries starting with a prefix form one contiguous range, found with two
+    binary searches; the most-voted movies in the range are picked with an argpartition.
+    """
+
+    def __init__(
+        self,
+        movie_ids: np.ndarray,
+        titles: List[Optional[str]],
+        original_titles: List[Optional[str]],
+        release_dates: List[Optional[date]],
+        vote_counts: np.ndarray,
+    ):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.titles = titles
+        self.original_titles = original_titles
+        self.release_dates = release_dates
+        self.vote_counts = np.nan_to_num(np.asarray(vote_counts, dtype=np.float64))
+
+        entries = []
+        for row, (title, original_title) in enumerate(
+            zip(titles, original_titles, strict=True)
+        ):
+            for name in dict.fromkeys(
+                (normalize_title(title), normalize_title(original_title))
+            ):
+                if not name:
+                    continue
+                entries.append((name, row))
+                first, _, rest = name.partition(" ")
+                if first in LEADING_ARTICLES and rest:
+                    entries.append((rest, row))
+        entries.sort()
+
+        self.keys = [key for key, _ in entries]
+        self.rows = np.array([row for _, row in entries], dtype=np.int64)
+        self.entry_votes = self.vote_counts[self.rows]
+
+    @classmethod
+    def from_db(cls, session: Session) -> "TitlePrefixIndex":
+        rows = session.execute(
+            text("""
+            SELECT id, title, original_title, release_date, vote_count
+            FROM stg_movie_metadata
+            WHERE title IS NOT NULL OR original_title IS NOT NULL
+        """)
+        ).fetchall()
+        index = cls(
+            np.array([r.id for r in rows], dtype=np.int64),
+            [r.title for r in rows],
+            [r.original_title for r in rows],
+            [r.release_date for r in rows],
+            np.array([r.vote_count or 0 for r in rows], dtype=np.float64),
+        )
+        logger.info(
+            f"Title prefix index: {len(index.movie_ids)} movies, {len(index.keys)} entries"
+        )
+        return index
+
+    def suggest(self, prefix: str, limit: int) -> List[int]:
+        """
+        Rows (positions in `movie_ids`) of up to `limit` distinct movies with a title starting with
+        `prefix`, most voted first.
+        """
+        prefix = normalize_title(prefix)
+        if not prefix or limit <= 0:
+            return []
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\U0010ffff", lo)
+        if lo == hi:
+            return []
+
+        # A movie has at most four entries, so this many candidates always hold `limit` distinct movies
+        n_candidates = min(hi - lo, 4 * limit)
+        votes = self.entry_votes[lo:hi]
+        if n_candidates < hi - lo:
+            candidates = np.argpartition(-votes, n_candidates - 1)[:n_candidates]
+        else:
+            candidates = np.arange(hi - lo)
+        candidates = candidates[np.lexsort((candidates, -votes[candidates]))]
+
+        rows = dict.fromkeys(self.rows[lo + candidates].tolist())
+        return list(rows)[:limit]
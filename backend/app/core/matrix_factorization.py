@@ -0,0 +1,460 @@
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from numbers import Integral
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app import constants
+from app.core.artifacts import new_build_dir, publish_build
+from app.core.faiss_index import build_index, search_index
+
+# Factor directory layout written by train_mf.py and export_mf_model.py (row i of pu/bu is
+# user_ids[i], of qi/bi item_ids[i]); bump FACTORS_FORMAT_VERSION when it changes
+FACTORS_FORMAT_VERSION = 1
+FACTORS_META_FILE = "meta.json"
+FACTORS_ARRAYS = ("user_ids", "item_ids", "pu", "qi", "bu", "bi", "user_counts")
+FACTORS_FLOAT_ARRAYS = ("pu", "qi", "bu", "bi")
+
+
+def id_row_lookup(
+    raw_to_row: Dict[Hashable, int],
+) -> Tuple[Optional[np.ndarray], Dict[Hashable, int]]:
+    """
+    Dense id -> row array (-1 = unknown) when all raw ids are non-negative ints, so a batch of ids is
+    translated with one gather; otherwise only the dict is usable.
+    """
+    if raw_to_row and all(isinstance(raw, Integral) and raw >= 0 for raw in raw_to_row):
+        rows = np.full(max(raw_to_row) + 1, -1, dtype=np.int64)
+        rows[np.fromiter(raw_to_row.keys(), dtype=np.int64)] = np.fromiter(
+            raw_to_row.values(), dtype=np.int64
+        )
+        return rows, raw_to_row
+    return None, raw_to_row
+
+
+def ridge_factors(
+    fixed: np.ndarray,
+    fixed_bias: np.ndarray,
+    ratings: np.ndarray,
+    global_mean: float,
+    reg: float,
+    reg_bias: float,
+) -> np.ndarray:
+    """
+    [factors | bias] of one user (or item) given the rated items' (or raters') factors and biases:
+    the ridge regression of (rating - global_mean - fixed_bias) on [fixed | 1], regularized per
+    rating like the SGD objective (reg * n). One (f+1) x (f+1) solve.
+    """
+    n, f = fixed.shape
+    design = np.empty((n, f + 1))
+    design[:, :f] = fixed
+    design[:, f] = 1.0
+    target = ratings - global_mean - fixed_bias
+    penalty = np.append(np.full(f, reg), reg_bias) * n
+    return np.linalg.solve(design.T @ design + np.diag(penalty), design.T @ target)
+
+
+@dataclass
+class UserFactors:
+    """
+    A user's factor vector and bias, from training or folded in from their current ratings.
+    """
+
+    pu: np.ndarray
+    bu: float
+
+
+@dataclass
+class SVDFactors:
+    """
+    The arrays of a trained surprise SVD: user/item factors (pu, qi), biases (bu, bi), the global
+    mean and the raw id -> row mappings. Scoring candidates is one gather plus one matrix-vector
+    product instead of a `predict` call (id translation and a Prediction object) per movie.
+    """
+
+    pu: np.ndarray
+    qi: np.ndarray
+    bu: np.ndarray
+    bi: np.ndarray
+    global_mean: float
+    rating_scale: Tuple[float, float]
+    biased: bool
+    user_rows: Dict[Hashable, int]
+    item_rows: Dict[Hashable, int]
+    item_row_array: Optional[np.ndarray] = None
+    # SGD regularization of the training run, reused by `fold_in`
+    reg_pu: float = 0.02
+    reg_bu: float = 0.02
+    # Ratings each trained user had in the training set
+    trained_counts: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_surprise(cls, algo) -> "SVDFactors":
+        trainset = algo.trainset
+        item_row_array, item_rows = id_row_lookup(trainset._raw2inner_id_items)
+        return cls(
+            pu=np.asarray(algo.pu),
+            qi=np.asarray(algo.qi),
+            bu=np.asarray(algo.bu),
+            bi=np.asarray(algo.bi),
+            global_mean=float(trainset.global_mean),
+            rating_scale=tuple(trainset.rating_scale),
+            biased=bool(algo.biased),
+            user_rows=trainset._raw2inner_id_users,
+            item_rows=item_rows,
+            item_row_array=item_row_array,
+            reg_pu=float(algo.reg_pu),
+            reg_bu=float(algo.reg_bu),
+            trained_counts=np.array(
+                [len(trainset.ur[u]) for u in range(trainset.n_users)], dtype=np.int64
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "SVDFactors":
+        """
+        Factors saved by `save` (e.g. by train_mf.py), memory-mapped unless `mmap` is False.
+        """
+        with open(os.path.join(path, FACTORS_META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FACTORS_FORMAT_VERSION:
+            raise ValueError(
+                f"{path} has factor format {meta.get('format_version')}, expected {FACTORS_FORMAT_VERSION}"
+            )
+        arrays = {
+            name: np.load(
+                os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None
+            )
+            for name in FACTORS_ARRAYS
+        }
+        item_row_array, item_rows = id_row_lookup(
+            dict(
+                zip(
+                    arrays["item_ids"].tolist(),
+                    range(len(arrays["item_ids"])),
+                    strict=True,
+                )
+            )
+        )
+        return cls(
+            pu=arrays["pu"],
+            qi=arrays["qi"],
+            bu=arrays["bu"],
+            bi=arrays["bi"],
+            global_mean=float(meta["global_mean"]),
+            rating_scale=tuple(meta["rating_scale"]),
+            biased=bool(meta["biased"]),
+            user_rows=dict(
+                zip(
+                    arrays["user_ids"].tolist(),
+                    range(len(arrays["user_ids"])),
+                    strict=True,
+                )
+            ),
+            item_rows=item_rows,
+            item_row_array=item_row_array,
+            reg_pu=float(meta["reg_pu"]),
+            reg_bu=float(meta["reg_bu"]),
+            trained_counts=arrays["user_counts"],
+        )
+
+    def save(self, path: str, dtype=None, extra_meta: Optional[dict] = None) -> None:
+        """
+        Write the factors as one .npy per array plus meta.json (integer ids only), with pu/qi/bu/bi
+        stored as `dtype` (e.g. float16 to halve the size again) when given.
+        """
+        os.makedirs(path, exist_ok=True)
+        user_ids = np.empty(len(self.pu), dtype=np.int64)
+        user_ids[np.fromiter(self.user_rows.values(), dtype=np.int64)] = np.fromiter(
+            self.user_rows.keys(), dtype=np.int64
+        )
+        counts = (
+            self.trained_counts
+            if self.trained_counts is not None
+            else np.zeros(len(self.pu), dtype=np.int64)
+        )
+        arrays = {
+            "user_ids": user_ids,
+            "item_ids": self.item_ids(),
+            "pu": self.pu,
+            "qi": self.qi,
+            "bu": self.bu,
+            "bi": self.bi,
+            "user_counts": counts,
+        }
+        for name in FACTORS_ARRAYS:
+            array = np.asarray(arrays[name])
+            if dtype is not None and name in FACTORS_FLOAT_ARRAYS:
+                array = array.astype(dtype)
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        meta = {
+            "format_version": FACTORS_FORMAT_VERSION,
+            "dtype": str(
+                np.asarray(arrays["qi"]).dtype if dtype is None else np.dtype(dtype)
+            ),
+            "global_mean": self.global_mean,
+            "rating_scale": list(self.rating_scale),
+            "biased": self.biased,
+            "reg_pu": self.reg_pu,
+            "reg_bu": self.reg_bu,
+            **(extra_meta or {}),
+        }
+        with open(os.path.join(path, FACTORS_META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def item_ids(self) -> np.ndarray:
+        """
+        Raw movie id of every row of `qi`/`bi` (integer ids only).
+        """
+        movie_ids = np.empty(len(self.qi), dtype=np.int64)
+        movie_ids[np.fromiter(self.item_rows.values(), dtype=np.int64)] = np.fromiter(
+            self.item_rows.keys(), dtype=np.int64
+        )
+        return movie_ids
+
+    def user_row(self, user_id: Hashable) -> int:
+        return self.user_rows.get(user_id, -1)
+
+    def item_rows_of(self, movie_ids) -> np.ndarray:
+        """
+        Row of each movie id in `qi`/`bi`, -1 for movies the model was not trained on.
+        """
+        if self.item_row_array is None:
+            return np.array(
+                [self.item_rows.get(movie_id, -1) for movie_id in movie_ids],
+                dtype=np.int64,
+            )
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        inside = (movie_ids >= 0) & (movie_ids < len(self.item_row_array))
+        return np.where(inside, self.item_row_array[np.where(inside, movie_ids, 0)], -1)
+
+    def trained_user(self, user_id: Hashable) -> Optional[UserFactors]:
+        u = self.user_row(user_id)
+        if u < 0:
+            return None
+        # float64 so that products with (possibly float16) item factors are computed in float64
+        return UserFactors(np.asarray(self.pu[u], dtype=np.float64), float(self.bu[u]))
+
+    def trained_count(self, user_id: Hashable) -> int:
+        u = self.user_row(user_id)
+        return (
+            int(self.trained_counts[u])
+            if u >= 0 and self.trained_counts is not None
+            else 0
+        )
+
+    def fold_in(self, movie_ids, ratings) -> Optional[UserFactors]:
+        """
+        Factors for a user from their current ratings, holding the item factors fixed: the ridge
+        regression of (rating - global_mean - bi) on [qi | 1], with the training objective's
+        per-rating regularization. One (f+1) x (f+1) solve, tens of microseconds.
+        Returns None when none of the rated movies is known to the model.
+        """
+        rows = self.item_rows_of(movie_ids)
+        known = rows >= 0
+        if not known.any():
+            return None
+        rows = rows[known]
+        ratings = np.asarray(ratings, dtype=np.float64)[known]
+        f = self.qi.shape[1]
+
+        if self.biased:
+            solution = ridge_factors(
+                self.qi[rows],
+                self.bi[rows],
+                ratings,
+                self.global_mean,
+                self.reg_pu,
+                self.reg_bu,
+            )
+            return UserFactors(solution[:f], float(solution[f]))
+        design = self.qi[rows]
+        penalty = np.full(f, self.reg_pu) * len(rows)
+        return UserFactors(
+            np.linalg.solve(design.T @ design + np.diag(penalty), design.T @ ratings),
+            0.0,
+        )
+
+    def predict_for(
+        self, user: Optional[UserFactors], movie_ids, clip: bool = True
+    ) -> np.ndarray:
+        """
+        Predicted ratings of `movie_ids` for `user` (None = a user unknown to the model), with
+        surprise's handling of unknown users/items (biases only, or the global mean) and clipping
+        to the rating scale.
+        """
+        rows = self.item_rows_of(movie_ids)
+        known_item = rows >= 0
+        safe_rows = np.where(known_item, rows, 0)
+
+        if self.biased:
+            est = np.full(len(rows), self.global_mean)
+            if user is not None:
+                est += user.bu
+            est += np.where(known_item, self.bi[safe_rows], 0.0)
+            if user is not None:
+                est += np.where(known_item, self.qi[safe_rows] @ user.pu, 0.0)
+        elif user is not None:
+            # Unbiased SVD cannot predict unknown items and falls back to the global mean
+            est = np.where(known_item, self.qi[safe_rows] @ user.pu, self.global_mean)
+        else:
+            est = np.full(len(rows), self.global_mean)
+
+        if clip:
+            est = np.clip(est, *self.rating_scale)
+        return est
+
+    def predict_many(
+        self, user_id: Hashable, movie_ids, clip: bool = True
+    ) -> np.ndarray:
+        """
+        `algo.predict(user_id, movie_id).est` for every movie id at once.
+        """
+        return self.predict_for(self.trained_user(user_id), movie_ids, clip)
+
+
+def publish_factors(
+    factors: SVDFactors,
+    path: str,
+    dtype=None,
+    extra_meta: Optional[dict] = None,
+    keep: int = 2,
+) -> str:
+    """
+    Save `factors` to a new `<path>.<timestamp>` build and point the `path` symlink at it, so a
+    loading worker never sees a partial model. Returns the build directory.
+    """
+    build_dir = new_build_dir(path)
+    factors.save(build_dir, dtype=dtype, extra_meta=extra_meta)
+    publish_build(build_dir, path, keep=keep)
+    return build_dir
+
+
+def mf_model_path() -> str:
+    """
+    The MF model to serve: the factor directory written by train_mf.py when present, otherwise the
+    surprise SVD pickle.
+    """
+    factors_dir = constants.MFModelConstants.PATH_MF_FACTORS
+    if os.path.exists(os.path.join(factors_dir, FACTORS_META_FILE)):
+        return factors_dir
+    return constants.MFModelConstants.PATH_MF_MODEL
+
+
+def load_mf_factors(path: str) -> SVDFactors:
+    if os.path.isdir(path):
+        return SVDFactors.load(path)
+    with open(path, "rb") as f:
+        return SVDFactors.from_surprise(pickle.load(f))
+
+
+def rank_predictions(
+    movie_ids: np.ndarray, scores: np.ndarray, axis: int = -1
+) -> np.ndarray:
+    """
+    Order of (movie ids, clipped predicted ratings) by score descending, then movie id: every
+    collaborative path ranks this way, so movies tied at the top of the rating scale come out the same.
+    """
+    return np.lexsort((movie_ids, -scores), axis=axis)
+
+
+class ItemFactorIndex:
+    """
+    Maximum inner product index over the item vectors [qi | bi], keyed by movie id. For the query
+    [pu | 1] the inner product is bi + qi.pu, i.e. the prediction minus the user's constant
+    global_mean + bu, so one search returns the user's top predicted movies over the whole catalog.
+    """
+
+    def __init__(self, factors: SVDFactors, index_type: str = "flat"):
+        if factors.item_row_array is None:
+            raise ValueError("The item index needs integer movie ids")
+        self.factors = factors
+        f = factors.qi.shape[1]
+        vectors = np.empty((len(factors.qi), f + 1), dtype=np.float32)
+        vectors[:, :f] = factors.qi
+        vectors[:, f] = factors.bi
+        self.index: faiss.Index = build_index(
+            vectors, index_type, ids=factors.item_ids()
+        )
+
+    def top_items(
+        self,
+        user: Optional[UserFactors],
+        k: int,
+        exclude: Optional[Iterable[int]] = None,
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        The user's top-k (movie ids, predicted ratings) leaving out `exclude` (e.g. rated movies),
+        or None without user factors.
+        """
+        if user is None:
+            return None
+        exclude = np.unique(
+            np.asarray([] if exclude is None else list(exclude), dtype=np.int64)
+        )
+        query = np.append(user.pu, 1.0).astype(np.float32).reshape(1, -1)
+
+        # Over-fetch by the number of excluded movies so that k remain after dropping them
+        fetch = min(k + len(exclude), self.index.ntotal)
+        while True:
+            _, labels = search_index(self.index, query, fetch)
+            movie_ids = labels[0][labels[0] >= 0]
+            movie_ids = movie_ids[~np.isin(movie_ids, exclude)]
+            # Exact float64 predictions, clipped to the rating scale
+            est = self.factors.predict_for(user, movie_ids)
+            # Everything above the scale clips to its maximum; while the last hit does, more may tie
+            # with it, and the tie is broken by movie id, so fetch all of them
+            if (
+                fetch >= self.index.ntotal
+                or len(est) == 0
+                or est[-1] < self.factors.rating_scale[1]
+            ):
+                break
+            fetch = min(2 * fetch, self.index.ntotal)
+
+        order = rank_predictions(movie_ids, est)[:k]
+        return movie_ids[order], est[order]
+
+
+class UserFactorCache:
+    """
+    Bounded LRU of folded-in user factors per worker. Entries carry a fingerprint of the ratings they
+    were folded from, so a new or changed rating misses and is folded in again.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries: OrderedDict[Hashable, Tuple[int, UserFactors]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(movie_ids: np.ndarray, ratings: np.ndarray) -> int:
+        return hash(
+            (
+                np.asarray(movie_ids, dtype=np.int64).tobytes(),
+                np.asarray(ratings, dtype=np.float64).tobytes(),
+            )
+        )
+
+    def get(self, user_id: Hashable, fingerprint: int) -> Optional[UserFactors]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != fingerprint:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id: Hashable, fingerprint: int, user: UserFactors) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (fingerprint, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
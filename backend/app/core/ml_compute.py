@@ -1,13 +1,69 @@
-from sentence_transformers import SentenceTransformer
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from typing import Optional, List, Dict
+from typing import Optional, Dict, List, Tuple
 import faiss
 from surprise.prediction_algorithms.matrix_factorization import SVD
 
 from app import constants
+from app.core.config import settings
+from app.core.embedding_cache import EmbeddingCache, normalize_query
+from app.core.encoders import TextEncoder
+from app.core.faiss_index import IdFilter, search_index
+
+_search_executor: ThreadPoolExecutor | None = None
+_search_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool for per-field FAISS searches, shared by all requests so concurrency stays bounded.
+    """
+    global _search_executor
+    if _search_executor is None:
+        with _search_executor_lock:
+            if _search_executor is None:
+                _search_executor = ThreadPoolExecutor(
+                    max_workers=settings.FAISS_SEARCH_THREADS, thread_name_prefix="faiss-search"
+                )
+    return _search_executor
+
+
+def search_fields(
+    queries: Dict[str, np.ndarray],
+    index_dict: Dict[str, faiss.Index],
+    k: int,
+    field_vectors: Optional[Dict[str, np.ndarray]] = None,
+    id_filter: Optional[IdFilter] = None,
+) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Run `index.search` for every field, concurrently when FAISS_PARALLEL_SEARCH is on.
+    FAISS releases the GIL while searching, so the request waits for the slowest field instead of the sum.
+    With `field_vectors` and FAISS_RESCORE_FACTOR > 1 the hits are re-scored exactly (see `search_index`);
+    with `id_filter` only the allowed movies are returned.
+    Results are keyed and ordered like `index_dict` in both modes.
+    """
+    field_vectors = field_vectors or {}
+    rescore_factor = settings.FAISS_RESCORE_FACTOR
+
+    if settings.FAISS_PARALLEL_SEARCH and len(index_dict) > 1:
+        executor = get_search_executor()
+        futures = {
+            name: executor.submit(
+                search_index, index, queries[name], k, field_vectors.get(name), rescore_factor, id_filter
+            )
+            for name, index in index_dict.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    return {
+        name: search_index(index, queries[name], k, field_vectors.get(name), rescore_factor, id_filter)
+        for name, index in index_dict.items()
+    }
 
 
-def get_embedding(text: Optional[str], model: SentenceTransformer, dim: int = 384) -> np.ndarray:
+def get_embedding(text: Optional[str], model: TextEncoder, dim: int = 384) -> np.ndarray:
     if text is None or not isinstance(text, str) or not text.strip():
         return np.zeros(dim)
 
@@ -19,58 +75,202 @@ def get_embedding(text: Optional[str], model: SentenceTransformer, dim: int = 38
     return embedding
 
 
+def get_query_embedding(
+    query: str, model: TextEncoder, cache: Optional[EmbeddingCache] = None, dim: int = 384
+) -> np.ndarray:
+    """
+    `get_embedding` for search queries, served from `cache` when the normalized query was seen before.
+    The returned array may be shared with the cache and must not be modified.
+    """
+    if cache is None:
+        return get_embedding(query, model, dim)
+    return cache.get_or_compute(query, lambda text: get_embedding(text, model, dim))
+
+
+def get_query_embeddings(
+    queries: List[str], model: TextEncoder, cache: Optional[EmbeddingCache] = None, dim: int = 384
+) -> np.ndarray:
+    """
+    Embeddings of several search queries, one row per query. Queries not in `cache` are encoded
+    together in a single `encode` call; repeats of the same normalized query are encoded once.
+    """
+    embeddings = np.empty((len(queries), dim), dtype=np.float32)
+    missing: Dict[str, List[int]] = {}
+    for row, query in enumerate(queries):
+        cached = cache.get(query) if cache is not None else None
+        if cached is None:
+            missing.setdefault(normalize_query(query), []).append(row)
+        else:
+            embeddings[row] = cached
+
+    if missing:
+        texts = [queries[rows[0]] for rows in missing.values()]
+        encoded = model.encode(texts, batch_size=len(texts), normalize_embeddings=True, show_progress_bar=False)
+        if encoded.shape[1] != dim:
+            raise ValueError(f"Embedding dimension ({encoded.shape[1]}) does not match expected ({dim})")
+        for text, rows, embedding in zip(texts, missing.values(), encoded, strict=True):
+            embeddings[rows] = embedding
+            if cache is not None:
+                cache.put(text, embedding)
+    return embeddings
+
+
+def fuse_search_results(
+    distances: np.ndarray,
+    labels: np.ndarray,
+    k: int,
+    weights: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse per-field hits (arrays of shape (n_fields, k_field), labels are movie ids) into the
+    top-k (movie ids, scores). With `weights` a movie scores the weighted sum of its field
+    similarities, otherwise its best one.
+    """
+    valid = labels >= 0
+    if weights is not None:
+        scores = (distances * weights[:, None])[valid]
+    else:
+        scores = distances[valid]
+
+    movie_ids, inverse = np.unique(labels[valid], return_inverse=True)
+    if weights is not None:
+        fused = np.bincount(inverse, weights=scores, minlength=len(movie_ids))
+    else:
+        # Movies start at 0, like the `movie_scores.get(movie_id, 0)` default of the dict version
+        fused = np.zeros(len(movie_ids))
+        np.maximum.at(fused, inverse, scores)
+
+    if len(fused) > k:
+        top = np.argpartition(-fused, k - 1)[:k]
+    else:
+        top = np.arange(len(fused))
+    top = top[np.argsort(-fused[top], kind="stable")]
+
+    return movie_ids[top], fused[top]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[np.ndarray], k: int, rrf_k: int = 60
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Blend ranked movie id lists: a movie scores sum(1 / (rrf_k + rank)) over the lists it appears in.
+    Only ranks matter, so lists scored on different scales (BM25, cosine) fuse without calibration.
+    """
+    labels = np.concatenate(rankings)
+    scores = np.concatenate([1.0 / (rrf_k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    return fuse_search_results(scores[None, :], labels[None, :], k, weights=np.ones(1))
+
+
+def merge_candidates(sources: List[np.ndarray], exclude: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Union of candidate movie id lists in first-seen order, without `exclude` (e.g. the user's rated
+    movies) and without -1 padding: one sort instead of a membership scan per candidate.
+    """
+    if not sources:
+        return np.empty(0, dtype=np.int64)
+    ids = np.concatenate([np.asarray(source, dtype=np.int64).ravel() for source in sources])
+    ids = ids[ids >= 0]
+    _, first = np.unique(ids, return_index=True)
+    ids = ids[np.sort(first)]
+    if exclude is not None and len(exclude):
+        ids = ids[~np.isin(ids, exclude)]
+    return ids
+
+
+def reserve_slots(
+    first: np.ndarray, second: np.ndarray, n: int, reserved: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Positions of the n ids picked from two ranked lists: the head of `first` keeps up to `reserved`
+    slots, `second` fills the rest (skipping ids already picked) and `first` backfills whatever
+    `second` cannot, so neither list can crowd the other out.
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    head = min(reserved, n, len(first))
+    second_pos = np.flatnonzero(~np.isin(second, first[:head]))[:n - head]
+    first_pos = np.arange(head)
+    missing = n - head - len(second_pos)
+    if missing > 0:
+        rest = np.arange(head, len(first))
+        rest = rest[~np.isin(first[rest], second[second_pos])][:missing]
+        first_pos = np.concatenate([first_pos, rest])
+    return first_pos, second_pos
+
+
 def multi_search_faiss_index(
     query_emb: np.ndarray,
     index_dict: Dict[str, faiss.Index],
-    faiss_to_movie: Dict[int, int],
     k: int = 10,
+    field_vectors: Optional[Dict[str, np.ndarray]] = None,
+    id_filter: Optional[IdFilter] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search every field index with the same query; a movie scores its best field similarity.
+    """
+    return batch_multi_search_faiss_index(query_emb.reshape(1, -1), index_dict, k, field_vectors, id_filter)[0]
 
-) -> List[Dict[str, float | int | str]]:
 
-    results = []
-    query_emb = query_emb.reshape(1, -1)
-    for index_name, index in index_dict.items():
-        distances, indices = index.search(query_emb, k)
-        for dist, idx in zip(distances[0], indices[0]):
-            results.append({
-                "type": index_name,
-                "distance": float(dist),
-                "index": idx,
-                "movieId": faiss_to_movie[idx]
-            })
+def batch_multi_search_faiss_index(
+    query_embs: np.ndarray,
+    index_dict: Dict[str, faiss.Index],
+    k: int = 10,
+    field_vectors: Optional[Dict[str, np.ndarray]] = None,
+    id_filter: Optional[IdFilter] = None,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    `multi_search_faiss_index` for many queries (rows of `query_embs`) at once: one multi-row
+    `index.search` per field, then the per-field hits are fused query by query.
+    """
+    query_embs = np.ascontiguousarray(query_embs, dtype=np.float32)
+    searched = search_fields(dict.fromkeys(index_dict, query_embs), index_dict, k, field_vectors, id_filter)
 
-    return results
+    distances = np.stack([d for d, _ in searched.values()], axis=1)
+    labels = np.stack([i for _, i in searched.values()], axis=1)
+    return [fuse_search_results(distances[q], labels[q], k) for q in range(len(query_embs))]
 
 
 def search_by_faiss_index(
     vectors: Dict[str, np.ndarray],
     index_dict: Dict[str, faiss.Index],
-    faiss_to_movie: Dict[int, int],
     k: int = 10,
-) -> List[Dict[str, float | int | str]]:
-
-    results = []
-    for index_name, index in index_dict.items():
-
-        embedding_vector = np.zeros(constants.EmbeddingModelConstants.VECTOR_EMBEDDING_DIM)
-        if (index_name == "content"):
-            embedding_vector = vectors["content_vector"].reshape(1, -1)
-        elif (index_name == "title"):
-            embedding_vector = vectors["title_vector"].reshape(1, -1)
-        elif (index_name == "type"):
-            embedding_vector = vectors["type_vector"].reshape(1, -1)
-        elif (index_name == "people"):
-            embedding_vector = vectors["people_vector"].reshape(1, -1)
-        else:
+    weights: Optional[Dict[str, float]] = None,
+    field_vectors: Optional[Dict[str, np.ndarray]] = None,
+    id_filter: Optional[IdFilter] = None,
+    field_k: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search each field index with the seed movie's vector for that field and fuse the hits
+    with the per-field `weights` (CONTENT_BASE_WEIGHTS by default). `field_k` (at least `k`)
+    widens the per-field searches, which brings the fused top-k closer to the exact one.
+    """
+    weights = weights or constants.CONTENT_BASE_WEIGHTS
+    queries = {}
+    for index_name in index_dict:
+        if index_name not in constants.SEARCH_TYPE:
             raise ValueError(f"Invalid index name: {index_name}")
+        queries[index_name] = vectors[f"{index_name}_vector"].reshape(1, -1).astype(np.float32)
 
-        distances, indices = index.search(embedding_vector, k)
-        for dist, idx in zip(distances[0], indices[0]):
-            results.append({
-                "type": index_name,
-                "distance": float(dist),
-                "index": idx,
-                "movieId": faiss_to_movie[idx]
-            })
+    searched = search_fields(queries, index_dict, max(k, field_k or k), field_vectors, id_filter)
 
-    return results
\ No newline at end of file
+    distances = np.stack([d[0] for d, _ in searched.values()])
+    labels = np.stack([i[0] for _, i in searched.values()])
+    field_weights = np.array([weights.get(name, 0) for name in searched])
+    return fuse_search_results(distances, labels, k, field_weights)
+
+
+def search_fused_index(
+    query_emb: np.ndarray,
+    index: faiss.Index,
+    k: int = 10,
+    vectors: Optional[np.ndarray] = None,
+    id_filter: Optional[IdFilter] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One search over the fused (weighted, concatenated) index. Its inner products already are the
+    weighted sums, so the hits are the exact fused top-k and need no further fusion.
+    """
+    query_emb = query_emb.reshape(1, -1).astype(np.float32)
+    distances, labels = search_index(index, query_emb, k, vectors, settings.FAISS_RESCORE_FACTOR, id_filter)
+    valid = labels[0] >= 0
+    return labels[0][valid], distances[0][valid]
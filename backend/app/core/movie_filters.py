@@ -0,0 +1,136 @@
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.faiss_index import IdFilter
+
+logger = logging.getLogger(__name__)
+
+
+def _pack(mask: np.ndarray) -> np.ndarray:
+    return np.packbits(mask, bitorder="little")
+
+
+class MovieFilterIndex:
+    """
+    Precomputed per-genre, per-decade, per-language and adult bitmaps over movie ids (the FAISS ids).
+    A request's filter is a few bitwise ORs/ANDs over ~n/8-byte arrays, handed to FAISS as an
+    IDSelector instead of filtering hydrated movies after the search.
+    """
+
+    def __init__(
+        self,
+        n: int,
+        genres: Dict[str, np.ndarray],
+        decades: Dict[int, np.ndarray],
+        languages: Dict[str, np.ndarray],
+        adult: Dict[bool, np.ndarray],
+    ):
+        self.n = n
+        self.genres = genres
+        self.decades = decades
+        self.languages = languages
+        self.adult = adult
+        self.empty = np.zeros((n + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def from_db(cls, session: Session, n: int) -> "MovieFilterIndex":
+        """
+        Build the bitmaps from stg_genre / stg_movie_metadata for movie ids below `n`.
+        """
+
+        def known(movie_ids: List[int]) -> np.ndarray:
+            movie_ids = np.asarray(movie_ids, dtype=np.int64)
+            return np.where((movie_ids >= 0) & (movie_ids < n), movie_ids, -1)
+
+        def bitmaps(ids_by_key: Dict) -> Dict:
+            result = {}
+            for key, ids in ids_by_key.items():
+                mask = np.zeros(n, dtype=bool)
+                ids = np.asarray(ids)
+                mask[ids[ids >= 0]] = True
+                result[key] = _pack(mask)
+            return result
+
+        genre_ids = defaultdict(list)
+        genre_result = session.execute(
+            text("""
+            SELECT movie_id, genre
+            FROM stg_genre
+            WHERE genre IS NOT NULL AND genre != ''
+        """)
+        ).fetchall()
+        if genre_result:
+            ids = known([r.movie_id for r in genre_result])
+            for r, movie_id in zip(genre_result, ids, strict=True):
+                genre_ids[r.genre].append(movie_id)
+
+        decade_ids = defaultdict(list)
+        language_ids = defaultdict(list)
+        adult_ids = defaultdict(list)
+        movie_result = session.execute(
+            text("""
+            SELECT id, release_date, original_language, adult
+            FROM stg_movie_metadata
+        """)
+        ).fetchall()
+        if movie_result:
+            ids = known([r.id for r in movie_result])
+            for r, movie_id in zip(movie_result, ids, strict=True):
+                if movie_id < 0:
+                    continue
+                if r.release_date is not None:
+                    decade_ids[r.release_date.year // 10 * 10].append(movie_id)
+                if r.original_language:
+                    language_ids[r.original_language].append(movie_id)
+                adult_ids[str(r.adult).lower() == "true"].append(movie_id)
+
+        index = cls(
+            n,
+            bitmaps(genre_ids),
+            bitmaps(decade_ids),
+            bitmaps(language_ids),
+            bitmaps(adult_ids),
+        )
+        logger.info(
+            f"Movie filter bitmaps: {len(index.genres)} genres, {len(index.decades)} decades, "
+            f"{len(index.languages)} languages"
+        )
+        return index
+
+    def _any_of(self, bitmaps: Dict, keys: List) -> np.ndarray:
+        selected = [bitmaps[key] for key in keys if key in bitmaps]
+        if not selected:
+            return self.empty
+        return np.bitwise_or.reduce(selected)
+
+    def build_filter(
+        self,
+        genres: Optional[List[str]] = None,
+        decades: Optional[List[int]] = None,
+        languages: Optional[List[str]] = None,
+        adult: Optional[bool] = None,
+    ) -> Optional[IdFilter]:
+        """
+        Movies matching any of `genres` AND any of `decades` AND any of `languages` AND the adult flag.
+        Criteria left as None do not restrict; returns None when nothing restricts.
+        """
+        parts = []
+        if genres:
+            parts.append(self._any_of(self.genres, genres))
+        if decades:
+            parts.append(
+                self._any_of(self.decades, [decade // 10 * 10 for decade in decades])
+            )
+        if languages:
+            parts.append(self._any_of(self.languages, languages))
+        if adult is not None:
+            parts.append(self.adult.get(adult, self.empty))
+
+        if not parts:
+            return None
+        return IdFilter(np.bitwise_and.reduce(parts), self.n)
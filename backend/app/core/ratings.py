@@ -0,0 +1,346 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import text
+from sqlmodel import Session
+
+logger = logging.getLogger(__name__)
+
+# Rating snapshot layout (build_rating_snapshot.py): the RatingMatrix arrays, the movie x genre
+# CSR arrays and meta.json with the genre names and the key_id watermark
+SNAPSHOT_META_FILE = "meta.json"
+RATING_ARRAYS = ("user_ids", "indptr", "movie_ids", "ratings")
+GENRE_ARRAYS = ("genre_indptr", "genre_indices")
+
+
+@dataclass
+class RatingMatrix:
+    """
+    stg_rating in CSR form: the ratings of user `user_ids[r]` are `movie_ids/ratings[indptr[r]:indptr[r + 1]]`,
+    sorted by movie id. 8 bytes per rating instead of a row object each.
+    """
+
+    user_ids: np.ndarray
+    indptr: np.ndarray
+    movie_ids: np.ndarray
+    ratings: np.ndarray
+
+    @property
+    def n_users(self) -> int:
+        return len(self.user_ids)
+
+    def user_row(self, user_id: int) -> int:
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row < len(self.user_ids) and self.user_ids[row] == user_id:
+            return row
+        return -1
+
+    def user_ratings(self, user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        row = self.user_row(user_id)
+        if row < 0:
+            return np.empty(0, dtype=self.movie_ids.dtype), np.empty(
+                0, dtype=self.ratings.dtype
+            )
+        lo, hi = self.indptr[row], self.indptr[row + 1]
+        return self.movie_ids[lo:hi], self.ratings[lo:hi]
+
+    def save(self, path: str) -> None:
+        for name in RATING_ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "RatingMatrix":
+        return cls(
+            *(
+                np.load(
+                    os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None
+                )
+                for name in RATING_ARRAYS
+            )
+        )
+
+
+def rating_matrix_from_arrays(
+    user_ids: np.ndarray, movie_ids: np.ndarray, ratings: np.ndarray
+) -> RatingMatrix:
+    order = np.lexsort((movie_ids, user_ids))
+    user_ids, movie_ids, ratings = user_ids[order], movie_ids[order], ratings[order]
+    unique_users, starts = np.unique(user_ids, return_index=True)
+    indptr = np.append(starts, len(user_ids)).astype(np.int64)
+    return RatingMatrix(unique_users, indptr, movie_ids, ratings)
+
+
+def load_rating_matrix(
+    session: Session, chunk_size: int = 1_000_000, max_key_id: Optional[int] = None
+) -> RatingMatrix:
+    """
+    Stream stg_rating with a server-side cursor into NumPy chunks and sort it into a RatingMatrix,
+    optionally only the rows up to `max_key_id`.
+    """
+    if max_key_id is None:
+        query, params = text("SELECT user_id, movie_id, rating FROM stg_rating"), {}
+    else:
+        query = text(
+            "SELECT user_id, movie_id, rating FROM stg_rating WHERE key_id <= :max_key_id"
+        )
+        params = {"max_key_id": max_key_id}
+    result = (
+        session.connection()
+        .execution_options(stream_results=True)
+        .execute(query, params)
+    )
+    users, movies, ratings = [], [], []
+    for rows in result.partitions(chunk_size):
+        chunk = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        users.append(chunk[:, 0].astype(np.int32))
+        movies.append(chunk[:, 1].astype(np.int32))
+        ratings.append(chunk[:, 2].astype(np.float32))
+        logger.info(f"Loaded {sum(map(len, users))} ratings")
+
+    if not users:
+        return rating_matrix_from_arrays(
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float32),
+        )
+    return rating_matrix_from_arrays(
+        np.concatenate(users), np.concatenate(movies), np.concatenate(ratings)
+    )
+
+
+class GenreMatrix:
+    """
+    Binary movie x genre matrix (CSR, rows indexed by movie id). A user's genre histogram is the
+    sparse product of their rated-movie indicator row with it.
+    """
+
+    def __init__(self, matrix: sp.csr_matrix, genres: List[str]):
+        self.matrix = matrix
+        self.genres = genres
+
+    @classmethod
+    def from_pairs(cls, movie_ids: np.ndarray, genres: List[str]) -> "GenreMatrix":
+        names = sorted(set(genres))
+        columns = np.searchsorted(names, genres)
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        n_movies = int(movie_ids.max()) + 1 if len(movie_ids) else 0
+        matrix = sp.csr_matrix(
+            (np.ones(len(movie_ids), dtype=np.float32), (movie_ids, columns)),
+            shape=(n_movies, len(names)),
+        )
+        # Duplicate (movie, genre) rows count once
+        matrix.data[:] = 1.0
+        return cls(matrix, names)
+
+    @classmethod
+    def from_db(cls, session: Session) -> "GenreMatrix":
+        rows = session.execute(
+            text("""
+            SELECT movie_id, genre
+            FROM stg_genre
+            WHERE movie_id IS NOT NULL AND genre IS NOT NULL AND genre != ''
+        """)
+        ).fetchall()
+        return cls.from_pairs(
+            np.array([r.movie_id for r in rows], dtype=np.int64),
+            [r.genre for r in rows],
+        )
+
+    def save(self, path: str) -> None:
+        np.save(
+            os.path.join(path, "genre_indptr.npy"), self.matrix.indptr.astype(np.int64)
+        )
+        np.save(
+            os.path.join(path, "genre_indices.npy"),
+            self.matrix.indices.astype(np.int32),
+        )
+
+    @classmethod
+    def load(cls, path: str, genres: List[str]) -> "GenreMatrix":
+        indptr = np.load(os.path.join(path, "genre_indptr.npy"), mmap_mode="r")
+        indices = np.load(os.path.join(path, "genre_indices.npy"), mmap_mode="r")
+        data = np.ones(len(indices), dtype=np.float32)
+        return cls(
+            sp.csr_matrix(
+                (data, indices, indptr), shape=(len(indptr) - 1, len(genres))
+            ),
+            genres,
+        )
+
+    def histogram(self, movie_ids: np.ndarray) -> np.ndarray:
+        """
+        Number of the given movies in each genre.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        movie_ids = movie_ids[(movie_ids >= 0) & (movie_ids < self.matrix.shape[0])]
+        selector = sp.csr_matrix(
+            (
+                np.ones(len(movie_ids), dtype=np.float32),
+                (np.zeros(len(movie_ids), dtype=np.int64), movie_ids),
+            ),
+            shape=(1, self.matrix.shape[0]),
+        )
+        return (selector @ self.matrix).toarray().ravel()
+
+    def top_genres(self, movie_ids: np.ndarray, n: int) -> List[str]:
+        """
+        The `n` genres with the most of the given movies (ties by name), like GROUP BY genre ORDER BY COUNT(*).
+        """
+        counts = self.histogram(movie_ids)
+        order = np.lexsort((np.arange(len(counts)), -counts))
+        return [self.genres[g] for g in order[:n] if counts[g] > 0]
+
+
+def save_rating_snapshot(
+    path: str,
+    ratings: RatingMatrix,
+    genres: GenreMatrix,
+    max_key_id: int,
+    extra_meta: Optional[dict] = None,
+) -> None:
+    ratings.save(path)
+    genres.save(path)
+    with open(os.path.join(path, SNAPSHOT_META_FILE), "w") as f:
+        json.dump(
+            {
+                "max_key_id": int(max_key_id),
+                "n_ratings": len(ratings.ratings),
+                "n_users": ratings.n_users,
+                "genres": genres.genres,
+                **(extra_meta or {}),
+            },
+            f,
+            indent=2,
+        )
+
+
+class RatingStore:
+    """
+    Per-user ratings and genre histograms served from a memory-mapped stg_rating snapshot, shared by
+    all workers through the page cache, plus an in-memory delta of the rows inserted since (key_id
+    above the snapshot's watermark). A lookup is an array slice and one small sparse product instead
+    of two index scans over stg_rating.
+    key_ids are assigned at insert but become visible at commit, so a row can appear below the
+    watermark after rows above it were read: every refresh re-reads the last `lag_keys` key_ids.
+    Rows that commit later than that, and rows updated or deleted in place, are not seen until the
+    next snapshot. The delta only grows until then: past `max_delta_rows` the store logs once and
+    reports `rebuild_recommended`, since build_rating_snapshot.py is meant to run periodically.
+    """
+
+    def __init__(
+        self, link_path: str, max_delta_rows: Optional[int] = None, lag_keys: int = 0
+    ):
+        self.path = os.path.realpath(link_path)
+        with open(os.path.join(self.path, SNAPSHOT_META_FILE)) as f:
+            self.meta = json.load(f)
+        self.ratings = RatingMatrix.load(self.path)
+        self.genres = GenreMatrix.load(self.path, self.meta["genres"])
+        self.snapshot_watermark = int(self.meta["max_key_id"])
+        self.watermark = self.snapshot_watermark
+        self.lag_keys = lag_keys
+        # key_ids of the lag window already counted in the delta
+        self._window_keys: Set[int] = set()
+        # user id -> {movie id: rating}; each user's dict is replaced, never mutated, so readers need no lock
+        self._delta: Dict[int, Dict[int, float]] = {}
+        self._delta_rows = 0
+        self.max_delta_rows = max_delta_rows
+        self._refreshed_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def apply_delta(self, rows) -> None:
+        """
+        Merge (key_id, user_id, movie_id, rating) rows in key_id order; a later rating of the same
+        movie replaces the earlier one. Rows read again by a later refresh apply the same ratings
+        in the same order, so only their first reading counts towards `max_delta_rows`.
+        """
+        updated: Dict[int, Dict[int, float]] = {}
+        before = self._delta_rows
+        for key_id, user_id, movie_id, rating in rows:
+            user = updated.get(user_id)
+            if user is None:
+                user = updated[user_id] = dict(self._delta.get(user_id, {}))
+            user[int(movie_id)] = float(rating)
+            key_id = int(key_id)
+            if key_id > self.snapshot_watermark and key_id not in self._window_keys:
+                self._delta_rows += 1
+            self._window_keys.add(key_id)
+            self.watermark = max(self.watermark, key_id)
+        self._delta.update(updated)
+        self._window_keys = {
+            key_id
+            for key_id in self._window_keys
+            if key_id > self.watermark - self.lag_keys
+        }
+        if (
+            self.max_delta_rows is not None
+            and before <= self.max_delta_rows < self._delta_rows
+        ):
+            logger.warning(
+                f"{self._delta_rows} ratings were added since the snapshot {self.path}; "
+                "rerun build_rating_snapshot to fold them in"
+            )
+
+    @property
+    def rebuild_recommended(self) -> bool:
+        return (
+            self.max_delta_rows is not None and self._delta_rows > self.max_delta_rows
+        )
+
+    def refresh_delta(self, session: Session, max_age: float) -> None:
+        """
+        Fetch the rows inserted since the last refresh (a key_id range scan), at most every `max_age` seconds.
+        The scan starts `lag_keys` below the watermark; re-reading that whole window in key_id order
+        keeps the latest rating of every movie, whichever of its rows committed late.
+        """
+        if time.monotonic() - self._refreshed_at < max_age:
+            return
+        with self._lock:
+            if time.monotonic() - self._refreshed_at < max_age:
+                return
+            rows = session.execute(
+                text(
+                    "SELECT key_id, user_id, movie_id, rating FROM stg_rating WHERE key_id > :watermark ORDER BY key_id"
+                ),
+                {"watermark": self.watermark - self.lag_keys},
+            ).fetchall()
+            self.apply_delta(rows)
+            self._refreshed_at = time.monotonic()
+
+    def user_ratings(self, user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The user's (movie ids, ratings) sorted by movie id: the snapshot row with the delta applied.
+        """
+        movie_ids, ratings = self.ratings.user_ratings(user_id)
+        delta = self._delta.get(user_id)
+        if not delta:
+            return np.asarray(movie_ids, dtype=np.int64), np.asarray(
+                ratings, dtype=np.float64
+            )
+        delta_ids = np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))
+        delta_ratings = np.fromiter(delta.values(), dtype=np.float64, count=len(delta))
+        kept = ~np.isin(movie_ids, delta_ids)
+        movie_ids = np.concatenate(
+            [np.asarray(movie_ids, dtype=np.int64)[kept], delta_ids]
+        )
+        ratings = np.concatenate(
+            [np.asarray(ratings, dtype=np.float64)[kept], delta_ratings]
+        )
+        order = np.argsort(movie_ids, kind="stable")
+        return movie_ids[order], ratings[order]
+
+    def stats(self) -> dict:
+        return {
+            "snapshot": self.path,
+            "snapshot_ratings": len(self.ratings.ratings),
+            "watermark": self.watermark,
+            "delta_rows": self._delta_rows,
+            "delta_users": len(self._delta),
+            "rebuild_recommended": self.rebuild_recommended,
+        }
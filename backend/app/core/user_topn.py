@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.core.matrix_factorization import SVDFactors, rank_predictions
+
+logger = logging.getLogger(__name__)
+
+USER_ROWS_FILE = "user_rows.npy"
+MOVIE_IDS_FILE = "movie_ids.npy"
+SCORES_FILE = "scores.npy"
+META_FILE = "meta.json"
+
+
+def score_users(
+    factors: SVDFactors,
+    model_rows: np.ndarray,
+    rated_item_rows: List[np.ndarray],
+    item_ids: np.ndarray,
+    top_n: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-n unrated (movie ids, predicted ratings) for a block of users known to the model (rows of
+    `pu`) over the whole catalog, one (users x items) matrix product, ranked like the live path:
+    clipped prediction, then movie id. Rows are padded with -1 when a user has rated almost everything.
+    """
+    # At least float32, so float16 factors are not multiplied in half precision
+    dtype = np.promote_types(factors.qi.dtype, np.float32)
+    predicted = factors.pu[model_rows].astype(dtype) @ factors.qi.T.astype(
+        dtype, copy=False
+    )
+    if factors.biased:
+        predicted += (
+            factors.global_mean + factors.bu[model_rows][:, None] + factors.bi[None, :]
+        )
+
+    users = np.repeat(
+        np.arange(len(model_rows)), [len(rows) for rows in rated_item_rows]
+    )
+    if len(users):
+        predicted[users, np.concatenate(rated_item_rows)] = -np.inf
+
+    n = min(top_n, predicted.shape[1])
+    top = np.argpartition(-predicted, n - 1, axis=1)[:, :n]
+    # Predictions above the rating scale all clip to its maximum; where more than n do, the n
+    # lowest movie ids among them win
+    at_ceiling = predicted >= factors.rating_scale[1]
+    for row in np.flatnonzero(at_ceiling.sum(axis=1) > n):
+        columns = np.flatnonzero(at_ceiling[row])
+        top[row] = columns[np.argsort(item_ids[columns], kind="stable")[:n]]
+
+    raw = np.take_along_axis(predicted, top, axis=1)
+    valid = np.isfinite(raw)
+    clipped = np.where(valid, np.clip(raw, *factors.rating_scale), -np.inf)
+    order = rank_predictions(item_ids[top], clipped)
+    top, clipped, valid = (
+        np.take_along_axis(a, order, axis=1) for a in (top, clipped, valid)
+    )
+
+    movie_ids = np.full((len(model_rows), top_n), -1, dtype=np.int32)
+    scores = np.zeros((len(model_rows), top_n), dtype=np.float32)
+    movie_ids[:, :n] = np.where(valid, item_ids[top], -1)
+    scores[:, :n] = np.where(valid, clipped, 0)
+    return movie_ids, scores
+
+
+class UserTopNStore:
+    """
+    Precomputed per-user top-N collaborative recommendations, memory-mapped: a dense user id -> row
+    array and fixed-width (users x N) movie id / score matrices, so a lookup is two array reads.
+    """
+
+    def __init__(self, link_path: str):
+        self.path = os.path.realpath(link_path)
+        with open(os.path.join(self.path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.user_rows = np.load(os.path.join(self.path, USER_ROWS_FILE), mmap_mode="r")
+        self.movie_ids = np.load(os.path.join(self.path, MOVIE_IDS_FILE), mmap_mode="r")
+        self.scores = np.load(os.path.join(self.path, SCORES_FILE), mmap_mode="r")
+        self.top_n = self.movie_ids.shape[1]
+
+    def get(self, user_id: int, k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        The user's top-k (movie ids, predicted ratings), or None when the user is not in the store
+        or `k` exceeds the stored N.
+        """
+        if k > self.top_n or user_id < 0 or user_id >= len(self.user_rows):
+            return None
+        row = self.user_rows[user_id]
+        if row < 0:
+            return None
+        movie_ids = self.movie_ids[row, :k]
+        valid = movie_ids >= 0
+        return movie_ids[valid].astype(np.int64), self.scores[row, :k][valid]
@@ -0,0 +1,122 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import pickle
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app import constants
+from app.core.matrix_factorization import SVDFactors, load_mf_factors, publish_factors
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def max_prediction_error(
+    reference: SVDFactors, exported: SVDFactors, n_users: int = 200, seed: int = 0
+) -> float:
+    """
+    Largest |prediction difference| over a sample of users x every movie.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = list(reference.user_rows)
+    movie_ids = reference.item_ids()
+    sample = rng.choice(len(user_ids), min(n_users, len(user_ids)), replace=False)
+    return max(
+        (
+            float(
+                np.abs(
+                    reference.predict_many(user_ids[u], movie_ids)
+                    - exported.predict_many(user_ids[u], movie_ids)
+                ).max()
+            )
+            for u in sample
+        ),
+        default=0.0,
+    )
+
+
+def load_peak_rss(path: str) -> float:
+    """
+    Growth of this process's peak RSS (MiB) while loading the model the way the API does.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    factors = load_mf_factors(path)
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    del factors
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return growth / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def export(args: argparse.Namespace) -> str:
+    """
+    Publish the pickle's factors under `args.output` and check them against the pickle.
+    """
+    start = time.perf_counter()
+    with open(args.input, "rb") as f:
+        algo = pickle.load(f)
+    pickle_seconds = time.perf_counter() - start
+    factors = SVDFactors.from_surprise(algo)
+    del algo
+    logger.info(
+        f"Loaded {args.input} in {pickle_seconds:.2f}s: {len(factors.pu)} users x {len(factors.qi)} movies"
+    )
+
+    build_dir = publish_factors(
+        factors,
+        args.output,
+        dtype=args.dtype,
+        extra_meta={
+            "algorithm": "surprise-svd",
+            "source": os.path.abspath(args.input),
+            "n_factors": int(factors.qi.shape[1]),
+            "n_users": len(factors.pu),
+            "n_items": len(factors.qi),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        },
+    )
+
+    start = time.perf_counter()
+    exported = SVDFactors.load(build_dir)
+    load_seconds = time.perf_counter() - start
+    error = max_prediction_error(factors, exported)
+    size = sum(entry.stat().st_size for entry in os.scandir(build_dir))
+    logger.info(
+        f"Published {build_dir} as {args.output} ({size / 2**20:.1f} MiB, {args.dtype}): loads in {load_seconds:.2f}s "
+        f"vs {pickle_seconds:.2f}s unpickling, max prediction difference {error:.2e}"
+    )
+    return build_dir
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export the surprise SVD pickle to the memory-mapped factor layout"
+    )
+    parser.add_argument("--input", default=constants.MFModelConstants.PATH_MF_MODEL)
+    parser.add_argument("--output", default=constants.MFModelConstants.PATH_MF_FACTORS)
+    parser.add_argument(
+        "--dtype",
+        choices=["float64", "float32", "float16"],
+        default="float32",
+        help="Storage type of factors and biases",
+    )
+    args = parser.parse_args()
+
+    # Each load is measured in its own fresh process. They start before anything is loaded here:
+    # a child's peak RSS starts at its parent's RSS, which would hide the loads once the pickle is in memory
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as mmap_pool, context.Pool(1) as pickle_pool:
+        build_dir = export(args)
+        logger.info(
+            f"Peak RSS growth of one load: {mmap_pool.apply(load_peak_rss, (build_dir,)):.1f} MiB memory-mapped "
+            f"vs {pickle_pool.apply(load_peak_rss, (args.input,)):.1f} MiB unpickled"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,14 @@ def startup_event():
         logging.error(f"Failed to load models during startup: {e}")
         raise
 
+@app.on_event("shutdown")
+def shutdown_event():
+    try:
+        deps.save_embedding_cache()
+    except Exception as e:
+        logging.warning(f"Failed to save query embeddings: {e}")
+    deps.close_query_encoder()
+
 # Set all CORS enabled origins
 if settings.all_cors_origins:
     app.add_middleware(
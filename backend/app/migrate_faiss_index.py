@@ -0,0 +1,17 @@
+import logging
+
+from app.core.index_updates import migrate_legacy_indices
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    if migrate_legacy_indices():
+        logger.info("FAISS indices are now keyed by movie id")
+    else:
+        logger.info("FAISS indices are already keyed by movie id")
+
+
+if __name__ == "__main__":
+    main()
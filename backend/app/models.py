@@ -189,4 +189,12 @@ class MoviePublicWr(MoviePublic):
     wr: Optional[float]
 
 class MoviePublicWithRating(MoviePublic):
-    rating: Optional[float] = None
\ No newline at end of file
+    rating: Optional[float] = None
+
+
+class MovieSuggestion(BaseModel):
+    id: int
+    title: Optional[str]
+    original_title: Optional[str]
+    release_date: Optional[date]
+    vote_count: Optional[int]
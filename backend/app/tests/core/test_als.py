@@ -0,0 +1,156 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.core.als import ALSData, evaluate, rating_counts, solve_rows, train_als
+from app.core.matrix_factorization import SVDFactors, load_mf_factors, publish_factors
+from app.core.ratings import rating_matrix_from_arrays
+
+
+def low_rank_ratings(seed: int = 0, n: int = 20000):
+    rng = np.random.default_rng(seed)
+    users, items = rng.normal(0, 0.6, (300, 4)), rng.normal(0, 0.6, (200, 4))
+    u, i = rng.integers(0, 300, n), rng.integers(0, 200, n)
+    pairs = np.unique(np.stack([u, i], axis=1), axis=0)
+    u, i = pairs[:, 0], pairs[:, 1]
+    r = np.clip(
+        3.5 + np.einsum("ij,ij->i", users[u], items[i]) + rng.normal(0, 0.2, len(u)),
+        0.5,
+        5,
+    )
+    # Sparse raw ids, as in stg_rating
+    return (
+        (u * 3 + 1).astype(np.int32),
+        (i * 7 + 2).astype(np.int32),
+        r.astype(np.float32),
+    )
+
+
+def test_als_data_indexes_every_rating_from_both_sides() -> None:
+    ratings = rating_matrix_from_arrays(*low_rank_ratings(n=500))
+    data = ALSData.from_rating_matrix(ratings)
+
+    by_user = {
+        (
+            int(data.user_ids[u]),
+            int(data.item_ids[data.user_cols[k]]),
+            float(data.user_values[k]),
+        )
+        for u in range(len(data.user_ids))
+        for k in range(data.user_indptr[u], data.user_indptr[u + 1])
+    }
+    by_item = {
+        (
+            int(data.user_ids[data.item_cols[k]]),
+            int(data.item_ids[i]),
+            float(data.item_values[k]),
+        )
+        for i in range(len(data.item_ids))
+        for k in range(data.item_indptr[i], data.item_indptr[i + 1])
+    }
+    assert by_user == by_item and len(by_user) == data.n_ratings
+
+
+def test_user_half_step_matches_fold_in() -> None:
+    data = ALSData.from_rating_matrix(
+        rating_matrix_from_arrays(*low_rank_ratings(n=2000))
+    )
+    factors, _ = train_als(data, n_factors=3, n_epochs=2)
+    item_side = np.hstack([factors.qi, factors.bi[:, None]])
+
+    solved = solve_rows(
+        data.user_indptr,
+        data.user_cols,
+        data.user_values,
+        item_side,
+        factors.global_mean,
+        0.05,
+        0.05,
+        0,
+        5,
+    )
+    for row in range(5):
+        lo, hi = data.user_indptr[row], data.user_indptr[row + 1]
+        user = factors.fold_in(
+            data.item_ids[data.user_cols[lo:hi]], data.user_values[lo:hi]
+        )
+        np.testing.assert_allclose(
+            solved[row], np.append(user.pu, user.bu), rtol=1e-9, atol=1e-12
+        )
+
+
+def test_als_fits_low_rank_ratings_in_parallel() -> None:
+    user_ids, movie_ids, values = low_rank_ratings()
+    test = np.random.default_rng(1).random(len(values)) < 0.1
+    train = rating_matrix_from_arrays(user_ids[~test], movie_ids[~test], values[~test])
+    held_out = rating_matrix_from_arrays(user_ids[test], movie_ids[test], values[test])
+    data = ALSData.from_rating_matrix(train)
+
+    factors, report = train_als(
+        data, n_factors=4, n_epochs=8, reg=0.02, reg_bias=0.02, block_size=64
+    )
+    train_rmse = [epoch["train_rmse"] for epoch in report.epochs]
+    assert train_rmse == sorted(train_rmse, reverse=True)
+    # Noise is 0.2; predicting the mean gives ~0.75
+    assert evaluate(factors, held_out) < 0.3
+    assert (
+        factors.trained_count(int(train.user_ids[0]))
+        == train.indptr[1] - train.indptr[0]
+    )
+
+    parallel, _ = train_als(
+        data, n_factors=4, n_epochs=8, reg=0.02, reg_bias=0.02, block_size=64, workers=2
+    )
+    np.testing.assert_allclose(parallel.pu, factors.pu)
+    np.testing.assert_allclose(parallel.bi, factors.bi)
+
+
+def test_saved_factors_load_and_predict_like_the_originals(tmp_path: Path) -> None:
+    data = ALSData.from_rating_matrix(
+        rating_matrix_from_arrays(*low_rank_ratings(n=3000))
+    )
+    factors, _ = train_als(data, n_factors=3, n_epochs=2)
+    factors.save(str(tmp_path / "factors"), extra_meta={"algorithm": "als"})
+
+    loaded = load_mf_factors(str(tmp_path / "factors"))
+    assert isinstance(loaded, SVDFactors) and isinstance(loaded.pu, np.memmap)
+    movie_ids = np.append(data.item_ids[:20], [0, 10**6])
+    for user_id in [int(data.user_ids[0]), int(data.user_ids[-1]), 10**6]:
+        np.testing.assert_array_equal(
+            loaded.predict_many(user_id, movie_ids),
+            factors.predict_many(user_id, movie_ids),
+        )
+    assert loaded.trained_count(int(data.user_ids[0])) == factors.trained_count(
+        int(data.user_ids[0])
+    )
+    assert (loaded.reg_pu, loaded.rating_scale) == (
+        factors.reg_pu,
+        factors.rating_scale,
+    )
+
+
+def test_published_model_with_holdout_serves_unchanged_users_as_trained(
+    tmp_path: Path, monkeypatch
+) -> None:
+    from app.api import deps
+    from app.train_mf import split_ratings
+
+    ratings = rating_matrix_from_arrays(*low_rank_ratings(n=5000))
+    train, test = split_ratings(ratings, test_fraction=0.2, seed=0)
+    factors, _ = train_als(ALSData.from_rating_matrix(train), n_factors=3, n_epochs=2)
+    factors.trained_counts = rating_counts(factors, ratings)
+    build_dir = publish_factors(factors, str(tmp_path / "factors"))
+
+    monkeypatch.setattr(deps, "mf_model_path", lambda: build_dir)
+    monkeypatch.setattr(deps.settings, "MF_FOLD_IN", True)
+    model = deps.MFModel()
+    # Users with held-out ratings still match their full count in stg_rating, so they take the top-N store path
+    held_out_users = set(test.user_ids.tolist())
+    checked = 0
+    for row, user_id in enumerate(ratings.user_ids.tolist()):
+        n_ratings = int(ratings.indptr[row + 1] - ratings.indptr[row])
+        if user_id in held_out_users and factors.user_row(user_id) >= 0:
+            assert not model.needs_fold_in(user_id, n_ratings)
+            assert model.needs_fold_in(user_id, n_ratings + 1)
+            checked += 1
+    assert checked > 0
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.core.embedding_cache import EmbeddingCache
+
+
+def _embedding(value: float) -> np.ndarray:
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_lru_eviction_and_counters() -> None:
+    cache = EmbeddingCache(capacity=2, model_name="model", dim=4)
+    calls = []
+
+    def encode(query: str) -> np.ndarray:
+        calls.append(query)
+        return _embedding(len(calls))
+
+    cache.get_or_compute("Batman", encode)
+    cache.get_or_compute("  batman ", encode)
+    cache.get_or_compute("pixar", encode)
+    cache.get_or_compute("batman", encode)
+    cache.get_or_compute("alien", encode)
+
+    assert calls == ["Batman", "pixar", "alien"]
+    assert cache.get("pixar") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["size"] == 2
+
+
+def test_save_and_load_keep_most_recent_entries(tmp_path: Path) -> None:
+    path, keys_path = str(tmp_path / "cache.npy"), str(tmp_path / "cache.json")
+    cache = EmbeddingCache(capacity=10, model_name="model", dim=4)
+    for i, query in enumerate(["a", "b", "c"]):
+        cache.put(query, _embedding(i))
+
+    assert cache.save(path, keys_path, limit=2) == 2
+
+    warm = EmbeddingCache(capacity=10, model_name="model", dim=4)
+    assert warm.load(path, keys_path) == 2
+    assert warm.get("a") is None
+    np.testing.assert_array_equal(warm.get("c"), _embedding(2))
+
+    assert (
+        EmbeddingCache(capacity=10, model_name="other-model", dim=4).load(
+            path, keys_path
+        )
+        == 0
+    )
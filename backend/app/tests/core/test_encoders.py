@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+
+from app.core.encoders import BatchingEncoder
+
+
+class HashEncoder:
+    """
+    Deterministic stand-in for the SentenceTransformer: one row per text, recording batch sizes.
+    """
+
+    def __init__(self) -> None:
+        self.batches: list[int] = []
+
+    def encode(
+        self, sentences, normalize_embeddings: bool = False, **kwargs
+    ) -> np.ndarray:
+        texts = [sentences] if isinstance(sentences, str) else sentences
+        self.batches.append(len(texts))
+        rows = np.array(
+            [[len(text), sum(map(ord, text)) % 97, 1.0] for text in texts],
+            dtype=np.float32,
+        )
+        if normalize_embeddings:
+            rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+        return rows[0] if isinstance(sentences, str) else rows
+
+
+def test_concurrent_calls_are_batched_and_get_their_own_rows() -> None:
+    model = HashEncoder()
+    encoder = BatchingEncoder(model, max_batch_size=64, window_ms=50)
+    texts = [f"query {i}" for i in range(16)]
+    results: dict[str, np.ndarray] = {}
+
+    def call(text: str) -> None:
+        results[text] = encoder.encode([text], normalize_embeddings=True)[0]
+
+    threads = [threading.Thread(target=call, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    encoder.close()
+
+    for text in texts:
+        np.testing.assert_allclose(
+            results[text], HashEncoder().encode([text], normalize_embeddings=True)[0]
+        )
+    assert len(model.batches) < len(texts)
+    assert encoder.stats()["texts"] == len(texts)
+
+
+def test_encode_after_close_runs_inline() -> None:
+    encoder = BatchingEncoder(HashEncoder(), window_ms=1)
+    encoder.close()
+    encoder.close()
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(
+            encoder.encode("late query", normalize_embeddings=True)
+        )
+    )
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    np.testing.assert_allclose(
+        results[0], HashEncoder().encode("late query", normalize_embeddings=True)
+    )
@@ -0,0 +1,78 @@
+import faiss
+import numpy as np
+
+from app import constants
+from app.core.faiss_index import (
+    FusedVectors,
+    IdFilter,
+    build_index,
+    read_index_mmap,
+    search_index,
+)
+
+
+def _field_vectors(n: int = 300, dim: int = 16) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    vectors = {}
+    for field in constants.SEARCH_TYPE:
+        v = rng.standard_normal((n, dim)).astype(np.float32)
+        vectors[field] = v / np.linalg.norm(v, axis=1, keepdims=True)
+    return vectors
+
+
+def test_fused_inner_product_is_weighted_sum() -> None:
+    field_vectors = _field_vectors()
+    fused = FusedVectors(field_vectors, constants.CONTENT_BASE_WEIGHTS)
+
+    expected = sum(
+        weight * field_vectors[field][:10] @ field_vectors[field][0]
+        for field, weight in constants.CONTENT_BASE_WEIGHTS.items()
+    )
+
+    np.testing.assert_allclose(fused[np.arange(10)] @ fused[0], expected, rtol=1e-5)
+
+
+def test_rescoring_restores_exact_ranking() -> None:
+    vectors = _field_vectors()["title"]
+    flat = build_index(vectors, "flat")
+    sq8 = build_index(vectors, "sq8")
+
+    exact_distances, exact_labels = flat.search(vectors[:20], 10)
+    distances, labels = search_index(sq8, vectors[:20], 10, vectors, rescore_factor=4)
+
+    np.testing.assert_array_equal(labels, exact_labels)
+    np.testing.assert_allclose(distances, exact_distances, rtol=1e-5)
+
+
+def test_filtered_search_only_returns_allowed_ids() -> None:
+    vectors = _field_vectors()["title"]
+    allowed = np.zeros(len(vectors), dtype=bool)
+    allowed[::3] = True
+    id_filter = IdFilter(np.packbits(allowed, bitorder="little"), len(vectors))
+
+    flat = build_index(vectors, "flat")
+    expected = np.flatnonzero(allowed)[
+        np.argsort(-(vectors[allowed] @ vectors[1]), kind="stable")[:10]
+    ]
+
+    for index_type in ["flat", "hnsw", "pq"]:
+        index = build_index(vectors, index_type, pq_m=4)
+        _, labels = search_index(
+            index, vectors[1:2], 10, vectors, rescore_factor=4, id_filter=id_filter
+        )
+        assert allowed[labels[0][labels[0] >= 0]].all()
+
+    _, labels = search_index(flat, vectors[1:2], 10, id_filter=id_filter)
+    np.testing.assert_array_equal(labels[0], expected)
+
+
+def test_mmap_read_loads_every_index_type(tmp_path) -> None:
+    vectors = _field_vectors()["title"]
+    for index_type in ["flat", "ivf", "hnsw"]:
+        index = build_index(vectors, index_type, nlist=4)
+        path = str(tmp_path / f"{index_type}.index")
+        faiss.write_index(index, path)
+
+        _, expected = index.search(vectors[:5], 5)
+        _, labels = read_index_mmap(path).search(vectors[:5], 5)
+        np.testing.assert_array_equal(labels, expected)
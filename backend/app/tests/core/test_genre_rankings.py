@@ -0,0 +1,30 @@
+import numpy as np
+
+from app.core.genre_rankings import GenreRankings
+
+
+def test_top_merges_genres_without_duplicates() -> None:
+    rankings = GenreRankings.from_rows(
+        ["Drama", "Drama", "Drama", "Comedy", "Comedy", "Action"],
+        np.array([1, 2, 3, 2, 4, 5]),
+        np.array([7.0, 8.0, 6.0, 8.0, 7.0, 9.0]),
+    )
+    np.testing.assert_array_equal(rankings.rankings["Drama"][0], [2, 1, 3])
+
+    # Movie 2 is in both genres; ties on wr are broken by movie id, like ORDER BY wr_80th DESC, movie_id
+    movie_ids, scores = rankings.top(["Drama", "Comedy", "Unknown"], 3)
+    np.testing.assert_array_equal(movie_ids, [2, 1, 4])
+    np.testing.assert_array_equal(scores, [8.0, 7.0, 7.0])
+
+    # Same as sorting the union of the genres' rows
+    movie_ids, _ = rankings.top(["Action", "Drama", "Comedy"], 10)
+    np.testing.assert_array_equal(movie_ids, [5, 2, 1, 4, 3])
+    assert len(rankings.top(["Unknown"], 5)[0]) == 0
+
+    # No limit: every movie of the genres
+    movie_ids, _ = rankings.top(["Drama", "Comedy"], None, exclude=[1])
+    np.testing.assert_array_equal(movie_ids, [2, 4, 3])
+
+    # Excluded (rated) movies do not take any of the k slots
+    movie_ids, _ = rankings.top(["Drama", "Comedy"], 2, exclude=[2, 1])
+    np.testing.assert_array_equal(movie_ids, [4, 3])
@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pytest
+
+from app import constants
+from app.core.faiss_index import (
+    FIELD_INDEX_PATHS,
+    build_index,
+    load_field_vectors,
+    read_index_manifest,
+    write_field_vectors,
+    write_index_atomic,
+    write_index_manifest,
+)
+from app.core.index_updates import delete_movies, migrate_legacy_indices, upsert_movies
+
+
+def _random_vectors(n: int, seed: int, dim: int = 16) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    vectors = {}
+    for field in constants.SEARCH_TYPE:
+        v = rng.standard_normal((n, dim)).astype(np.float32)
+        vectors[field] = v / np.linalg.norm(v, axis=1, keepdims=True)
+    return vectors
+
+
+@pytest.fixture
+def artifacts(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> np.ndarray:
+    # Artifact paths are relative to the backend directory
+    (tmp_path / constants.PYTHON_PATH / "vector-embedding").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+
+    ids = np.arange(100, dtype=np.int64) * 3 + 7
+    vectors = _random_vectors(len(ids), seed=0)
+    write_field_vectors(ids, vectors)
+    for field in constants.SEARCH_TYPE:
+        write_index_atomic(
+            build_index(vectors[field], "flat", ids=ids), FIELD_INDEX_PATHS[field]
+        )
+    write_index_manifest()
+    return ids
+
+
+def test_upsert_adds_and_replaces_movies(artifacts: np.ndarray) -> None:
+    new_ids = np.array([artifacts[5], 1000], dtype=np.int64)
+    new_vectors = _random_vectors(2, seed=1)
+
+    assert upsert_movies(new_ids, new_vectors) == 1
+
+    ids, vectors = load_field_vectors(mmap_mode=None)
+    assert len(ids) == len(artifacts) + 1
+    np.testing.assert_array_equal(vectors["title"][5], new_vectors["title"][0])
+
+    index = faiss.read_index(FIELD_INDEX_PATHS["title"])
+    assert index.ntotal == len(artifacts) + 1
+    _, labels = index.search(new_vectors["title"], 1)
+    assert labels[:, 0].tolist() == new_ids.tolist()
+    assert read_index_manifest()["version"] == 2
+
+
+def test_delete_removes_movies(artifacts: np.ndarray) -> None:
+    assert delete_movies(artifacts[:3]) == 3
+    assert delete_movies(artifacts[:3]) == 0
+
+    ids, _ = load_field_vectors(mmap_mode=None)
+    assert not np.isin(artifacts[:3], ids).any()
+
+    index = faiss.read_index(FIELD_INDEX_PATHS["people"])
+    _, labels = index.search(_random_vectors(1, seed=2)["people"], len(artifacts))
+    assert not np.isin(artifacts[:3], labels).any()
+
+
+def test_migrate_keys_legacy_indices_by_movie_id(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    (tmp_path / constants.PYTHON_PATH / "vector-embedding").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    ids = np.arange(300, dtype=np.int64) * 3 + 7
+    vectors = _random_vectors(len(ids), seed=0)
+    write_field_vectors(ids, vectors)
+    # Old layout: FAISS id i is row i, no manifest
+    for field in constants.SEARCH_TYPE:
+        index_type = "ivf" if field == "title" else "flat"
+        write_index_atomic(
+            build_index(vectors[field], index_type, nlist=4), FIELD_INDEX_PATHS[field]
+        )
+
+    assert migrate_legacy_indices()
+    assert read_index_manifest()["keyed_by"] == "movie_id"
+    for field in constants.SEARCH_TYPE:
+        index = faiss.read_index(FIELD_INDEX_PATHS[field])
+        if field == "title":
+            faiss.extract_index_ivf(index).nprobe = 4
+        _, labels = index.search(vectors[field][:5], 1)
+        assert labels[:, 0].tolist() == ids[:5].tolist()
+    assert not migrate_legacy_indices()
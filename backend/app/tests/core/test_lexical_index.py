@@ -0,0 +1,87 @@
+import numpy as np
+
+from app.core.faiss_index import IdFilter
+from app.core.lexical_index import TitleLexicalIndex, TitlePrefixIndex, normalize_title
+
+
+def make_index() -> TitleLexicalIndex:
+    return TitleLexicalIndex(
+        movie_ids=np.array([10, 11, 12, 13, 14]),
+        titles=["The Dark Knight", "Batman Begins", "Amélie", "Solaris", "Solaris"],
+        original_titles=[
+            "The Dark Knight",
+            "Batman Begins",
+            "Le Fabuleux Destin d'Amélie Poulain",
+            "Solaris",
+            "Солярис",
+        ],
+        popularity=np.array([900.0, 700.0, 500.0, 50.0, 300.0]),
+    )
+
+
+def test_normalize_title_ignores_case_accents_and_punctuation() -> None:
+    assert normalize_title("  Amélie!! ") == "amelie"
+    assert normalize_title("Spider-Man: Homecoming") == "spider man homecoming"
+    assert normalize_title(None) == ""
+
+
+def test_exact_matches_cover_original_titles_and_prefer_popular_movies() -> None:
+    index = make_index()
+
+    assert index.exact_matches("solaris").tolist() == [14, 13]
+    assert index.exact_matches("le fabuleux destin d amelie poulain").tolist() == [12]
+    assert index.exact_matches("dark knight").tolist() == []
+
+
+def test_search_ranks_exact_matches_first_then_bm25() -> None:
+    index = make_index()
+
+    movie_ids, scores = index.search("the dark knight", k=3)
+    assert movie_ids.tolist() == [10]
+    assert scores.tolist() == [1.0]
+
+    movie_ids, scores = index.search("batman knight", k=5)
+    assert set(movie_ids.tolist()) == {10, 11}
+    assert scores.max() == 1.0 and np.all(scores > 0)
+
+    assert len(index.search("unknown words", k=5)[0]) == 0
+
+
+def test_search_respects_id_filter() -> None:
+    index = make_index()
+    id_filter = IdFilter(np.packbits(np.arange(16) == 13, bitorder="little"), 16)
+
+    assert index.exact_matches("solaris", id_filter).tolist() == [13]
+    assert index.search("solaris", k=5, id_filter=id_filter)[0].tolist() == [13]
+
+
+def make_prefix_index() -> TitlePrefixIndex:
+    return TitlePrefixIndex(
+        movie_ids=np.array([10, 11, 12, 13]),
+        titles=["The Matrix", "The Matrix Reloaded", "Matilda", "Amélie"],
+        original_titles=[
+            "The Matrix",
+            "The Matrix Reloaded",
+            "Matilda",
+            "Le Fabuleux Destin d'Amélie Poulain",
+        ],
+        release_dates=[None, None, None, None],
+        vote_counts=np.array([9000, 4000, 900, 3000]),
+    )
+
+
+def test_prefix_suggestions_are_distinct_and_most_voted_first() -> None:
+    index = make_prefix_index()
+
+    assert index.movie_ids[index.suggest("mat", 10)].tolist() == [10, 11, 12]
+    assert index.movie_ids[index.suggest("The Matrix R", 10)].tolist() == [11]
+    assert index.movie_ids[index.suggest("mat", 2)].tolist() == [10, 11]
+
+
+def test_prefix_suggestions_match_original_titles_and_ignore_accents() -> None:
+    index = make_prefix_index()
+
+    assert index.movie_ids[index.suggest("ame", 5)].tolist() == [13]
+    assert index.movie_ids[index.suggest("le fabuleux", 5)].tolist() == [13]
+    assert index.suggest("zzz", 5) == []
+    assert index.suggest("  !", 5) == []
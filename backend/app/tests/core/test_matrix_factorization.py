@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import SVD, Dataset, Reader
+
+from app.core.matrix_factorization import (
+    ItemFactorIndex,
+    SVDFactors,
+    UserFactorCache,
+    UserFactors,
+    publish_factors,
+)
+
+
+def train_svd(biased: bool) -> SVD:
+    rng = np.random.default_rng(0)
+    ratings = pd.DataFrame(
+        {
+            "user_id": rng.integers(1, 60, 3000),
+            "movie_id": rng.integers(1, 400, 3000) * 7,
+            "rating": rng.integers(1, 11, 3000) / 2,
+        }
+    ).drop_duplicates(["user_id", "movie_id"])
+    data = Dataset.load_from_df(ratings, Reader(rating_scale=(0.5, 5)))
+    algo = SVD(n_factors=8, n_epochs=5, biased=biased, random_state=0)
+    algo.fit(data.build_full_trainset())
+    return algo
+
+
+@pytest.mark.parametrize("biased", [True, False])
+def test_predict_many_matches_surprise_predict(biased: bool) -> None:
+    algo = train_svd(biased)
+    factors = SVDFactors.from_surprise(algo)
+    # Known, unknown and out-of-range movies for known and unknown users
+    movie_ids = [7, 14, 700, 2793, 3, 10**6, 0]
+
+    for user_id in [1, 30, 59, 10**5]:
+        expected = [algo.predict(user_id, movie_id).est for movie_id in movie_ids]
+        np.testing.assert_allclose(
+            factors.predict_many(user_id, movie_ids), expected, rtol=1e-12
+        )
+
+
+@pytest.mark.parametrize("biased", [True, False])
+def test_item_index_returns_top_predictions_without_excluded(biased: bool) -> None:
+    algo = train_svd(biased)
+    factors = SVDFactors.from_surprise(algo)
+    index = ItemFactorIndex(factors)
+    all_movies = np.array(list(factors.item_rows))
+
+    for user_id in [1, 30]:
+        rated = all_movies[:25]
+        movie_ids, est = index.top_items(
+            factors.trained_user(user_id), 10, exclude=rated
+        )
+
+        candidates = np.setdiff1d(all_movies, rated)
+        expected = np.sort(factors.predict_many(user_id, candidates))[::-1][:10]
+        assert not np.isin(movie_ids, rated).any()
+        np.testing.assert_allclose(est, expected, rtol=1e-5)
+        np.testing.assert_allclose(est, factors.predict_many(user_id, movie_ids))
+
+    assert index.top_items(factors.trained_user(10**5), 10) is None
+
+
+def test_fold_in_recovers_a_training_user_and_handles_new_users() -> None:
+    algo = train_svd(biased=True)
+    factors = SVDFactors.from_surprise(algo)
+    trainset = algo.trainset
+    u = factors.user_row(30)
+    movie_ids = np.array([trainset.to_raw_iid(i) for i, _ in trainset.ur[u]])
+    ratings = np.array([r for _, r in trainset.ur[u]])
+
+    folded = factors.fold_in(movie_ids, ratings)
+
+    # With the item factors fixed, the fold-in minimizes the training objective for this user,
+    # so it does at least as well as the SGD solution and any perturbation of it
+    def objective(user: UserFactors) -> float:
+        errors = ratings - factors.predict_for(user, movie_ids, clip=False)
+        return float(
+            errors @ errors
+            + len(ratings) * factors.reg_pu * (user.pu @ user.pu + user.bu**2)
+        )
+
+    assert objective(folded) <= objective(factors.trained_user(30)) + 1e-9
+    nudged = UserFactors(folded.pu + 1e-3, folded.bu - 1e-3)
+    assert objective(folded) < objective(nudged)
+    assert factors.fold_in([10**6], [4.0]) is None
+
+    # A brand-new user who loves a movie gets it predicted above the unpersonalized baseline
+    fan = factors.fold_in(movie_ids[:5], np.full(5, 5.0))
+    assert np.all(
+        factors.predict_for(fan, movie_ids[:5])
+        > factors.predict_for(None, movie_ids[:5])
+    )
+
+
+def test_user_factor_cache_misses_when_ratings_change() -> None:
+    cache = UserFactorCache(capacity=1)
+    user = UserFactors(np.zeros(3), 0.1)
+    before = UserFactorCache.fingerprint(np.array([1, 2]), np.array([4.0, 3.0]))
+    after = UserFactorCache.fingerprint(np.array([1, 2]), np.array([4.0, 5.0]))
+
+    cache.put(7, before, user)
+    assert cache.get(7, before) is user
+    assert cache.get(7, after) is None
+    cache.put(8, before, user)
+    assert cache.get(7, before) is None
+
+
+@pytest.mark.parametrize(
+    "dtype, tolerance", [(None, 1e-12), ("float32", 1e-5), ("float16", 1e-2)]
+)
+def test_exported_factors_predict_like_the_surprise_model(
+    tmp_path, dtype, tolerance: float
+) -> None:
+    algo = train_svd(biased=True)
+    SVDFactors.from_surprise(algo).save(str(tmp_path / "factors"), dtype=dtype)
+    loaded = SVDFactors.load(str(tmp_path / "factors"))
+    movie_ids = [7, 14, 700, 2793, 3, 10**6]
+
+    for user_id in [1, 30, 10**5]:
+        expected = [algo.predict(user_id, movie_id).est for movie_id in movie_ids]
+        np.testing.assert_allclose(
+            loaded.predict_many(user_id, movie_ids), expected, atol=tolerance
+        )
+    user = loaded.fold_in([7, 14, 21], [5.0, 4.0, 1.0])
+    assert user.pu.dtype == np.float64
+    assert ItemFactorIndex(loaded).top_items(loaded.trained_user(1), 5) is not None
+
+
+def test_loading_factors_of_another_format_version_fails(tmp_path) -> None:
+    path = str(tmp_path / "factors")
+    SVDFactors.from_surprise(train_svd(biased=True)).save(
+        path, extra_meta={"format_version": 0}
+    )
+    with pytest.raises(ValueError):
+        SVDFactors.load(path)
+
+
+def test_publish_factors_swaps_versioned_builds(tmp_path) -> None:
+    factors = SVDFactors.from_surprise(train_svd(biased=True))
+    link = str(tmp_path / "factors")
+    # An unversioned directory from before builds were versioned
+    factors.save(link)
+
+    first = publish_factors(factors, link)
+    second = publish_factors(factors, link, dtype="float16")
+    assert os.path.realpath(link) == os.path.realpath(second)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["factors", os.path.basename(first), os.path.basename(second)]
+    )
+    assert SVDFactors.load(link).qi.dtype == np.float16
@@ -0,0 +1,163 @@
+import faiss
+import numpy as np
+import pytest
+
+from app import constants
+from app.core import ml_compute
+from app.core.config import settings
+from app.core.faiss_index import build_index
+
+MOVIE_IDS = np.arange(500, dtype=np.int64) + 1000
+
+
+@pytest.fixture(scope="module")
+def field_indices() -> dict[str, faiss.Index]:
+    rng = np.random.default_rng(0)
+    indices = {}
+    for field in constants.SEARCH_TYPE:
+        vectors = rng.standard_normal((500, 16)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        indices[field] = build_index(vectors, "flat", ids=MOVIE_IDS)
+    return indices
+
+
+def test_parallel_search_matches_sequential(
+    field_indices: dict[str, faiss.Index], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    query = np.random.default_rng(1).standard_normal(16).astype(np.float32)
+
+    monkeypatch.setattr(settings, "FAISS_PARALLEL_SEARCH", False)
+    sequential = ml_compute.multi_search_faiss_index(query, field_indices, k=10)
+    monkeypatch.setattr(settings, "FAISS_PARALLEL_SEARCH", True)
+    parallel = ml_compute.multi_search_faiss_index(query, field_indices, k=10)
+
+    np.testing.assert_array_equal(parallel[0], sequential[0])
+    np.testing.assert_array_equal(parallel[1], sequential[1])
+
+
+def test_weighted_fusion_matches_per_hit_sum(
+    field_indices: dict[str, faiss.Index],
+) -> None:
+    rng = np.random.default_rng(2)
+    vectors = {
+        f"{field}_vector": rng.standard_normal(16).astype(np.float32)
+        for field in constants.SEARCH_TYPE
+    }
+    k = 20
+
+    movie_scores: dict[int, float] = {}
+    for field, index in field_indices.items():
+        distances, labels = index.search(vectors[f"{field}_vector"].reshape(1, -1), k)
+        for dist, movie_id in zip(distances[0], labels[0].tolist(), strict=True):
+            movie_scores[movie_id] = (
+                movie_scores.get(movie_id, 0)
+                + dist * constants.CONTENT_BASE_WEIGHTS[field]
+            )
+    expected = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    movie_ids, scores = ml_compute.search_by_faiss_index(vectors, field_indices, k)
+
+    assert movie_ids.tolist() == [movie_id for movie_id, _ in expected]
+    np.testing.assert_allclose(scores, [score for _, score in expected], rtol=1e-6)
+
+
+def test_widened_field_search_matches_truncated_wide_fusion(
+    field_indices: dict[str, faiss.Index],
+) -> None:
+    rng = np.random.default_rng(4)
+    vectors = {
+        f"{field}_vector": rng.standard_normal(16).astype(np.float32)
+        for field in constants.SEARCH_TYPE
+    }
+
+    # The neighbour table stores the top-50 of a 50-per-field fusion; a live top-5 must be its head
+    wide_ids, wide_scores = ml_compute.search_by_faiss_index(vectors, field_indices, 50)
+    movie_ids, scores = ml_compute.search_by_faiss_index(
+        vectors, field_indices, 5, field_k=50
+    )
+
+    np.testing.assert_array_equal(movie_ids, wide_ids[:5])
+    np.testing.assert_allclose(scores, wide_scores[:5], rtol=1e-6)
+
+
+def test_max_fusion_keeps_best_field_score() -> None:
+    distances = np.array([[0.9, 0.5, 0.1], [0.7, 0.6, -0.2]])
+    labels = np.array([[13, 11, 12], [11, 10, -1]])
+
+    movie_ids, scores = ml_compute.fuse_search_results(distances, labels, k=3)
+
+    assert movie_ids.tolist() == [13, 11, 10]
+    np.testing.assert_allclose(scores, [0.9, 0.7, 0.6])
+
+
+def test_batch_search_matches_single_queries(
+    field_indices: dict[str, faiss.Index],
+) -> None:
+    queries = np.random.default_rng(3).standard_normal((5, 16)).astype(np.float32)
+
+    batched = ml_compute.batch_multi_search_faiss_index(queries, field_indices, k=10)
+
+    assert len(batched) == len(queries)
+    for query, (movie_ids, scores) in zip(queries, batched, strict=True):
+        expected_ids, expected_scores = ml_compute.multi_search_faiss_index(
+            query, field_indices, k=10
+        )
+        np.testing.assert_array_equal(movie_ids, expected_ids)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+
+def test_query_embeddings_encode_cache_misses_once() -> None:
+    from app.core.embedding_cache import EmbeddingCache
+    from app.tests.core.test_encoders import HashEncoder
+
+    model = HashEncoder()
+    cache = EmbeddingCache(capacity=10, model_name="hash", dim=3)
+    cache.put(
+        "space opera", model.encode(["space opera"], normalize_embeddings=True)[0]
+    )
+
+    queries = ["space opera", "Pixar", "pixar  ", "heist movie"]
+    embeddings = ml_compute.get_query_embeddings(queries, model, cache, dim=3)
+
+    # One encode for the cache entry, one for the two distinct misses
+    assert model.batches == [1, 2]
+    np.testing.assert_array_equal(embeddings[1], embeddings[2])
+    for query, embedding in zip(queries, embeddings, strict=True):
+        np.testing.assert_allclose(embedding, cache.get(query))
+
+
+def test_reciprocal_rank_fusion_rewards_agreement() -> None:
+    semantic = np.array([1, 2, 3])
+    lexical = np.array([3])
+
+    movie_ids, scores = ml_compute.reciprocal_rank_fusion(
+        [semantic, lexical], k=3, rrf_k=60
+    )
+
+    assert movie_ids.tolist() == [3, 1, 2]
+    np.testing.assert_allclose(scores, [1 / 63 + 1 / 61, 1 / 61, 1 / 62])
+
+
+def test_merge_candidates_keeps_first_occurrence_order_without_excluded() -> None:
+    sources = [np.array([5, 3, 9]), np.array([3, 7, -1, 5]), np.array([11, 2])]
+
+    merged = ml_compute.merge_candidates(sources, exclude=np.array([9, 2]))
+
+    assert merged.tolist() == [5, 3, 7, 11]
+    assert ml_compute.merge_candidates([]).tolist() == []
+
+
+def test_reserve_slots_keeps_reserved_head_and_backfills() -> None:
+    first = np.array([10, 11, 12, 13])
+    second = np.array([11, 20, 21, 22, 23])
+
+    first_pos, second_pos = ml_compute.reserve_slots(first, second, n=4, reserved=2)
+    assert first[first_pos].tolist() == [10, 11]
+    assert second[second_pos].tolist() == [20, 21]
+
+    # `second` runs short: `first` fills the remaining slots without repeating picked ids
+    first_pos, second_pos = ml_compute.reserve_slots(
+        first, np.array([12, 30]), n=4, reserved=1
+    )
+    assert first[first_pos].tolist() == [10, 11]
+    assert second_pos.tolist() == [0, 1]
@@ -0,0 +1,119 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.core.artifacts import new_build_dir, publish_build
+from app.core.ratings import (
+    GenreMatrix,
+    RatingStore,
+    rating_matrix_from_arrays,
+    save_rating_snapshot,
+)
+
+
+def build_snapshot(tmp_path: Path) -> str:
+    ratings = rating_matrix_from_arrays(
+        np.array([7, 3, 7, 3, 7]),
+        np.array([10, 20, 30, 10, 20]),
+        np.array([4.0, 3.5, 5.0, 2.0, 1.0]),
+    )
+    genres = GenreMatrix.from_pairs(
+        np.array([10, 10, 20, 30, 30, 30]),
+        ["Drama", "Comedy", "Drama", "Action", "Drama", "Drama"],
+    )
+    link_path = str(tmp_path / "rating-snapshot")
+    build_dir = new_build_dir(link_path)
+    save_rating_snapshot(build_dir, ratings, genres, max_key_id=5)
+    publish_build(build_dir, link_path)
+    return link_path
+
+
+def test_snapshot_ratings_and_genre_histogram(tmp_path: Path) -> None:
+    store = RatingStore(build_snapshot(tmp_path))
+    assert isinstance(store.ratings.movie_ids, np.memmap)
+
+    movie_ids, ratings = store.user_ratings(7)
+    np.testing.assert_array_equal(movie_ids, [10, 20, 30])
+    np.testing.assert_array_equal(ratings, [4.0, 1.0, 5.0])
+    assert len(store.user_ratings(99)[0]) == 0
+
+    assert store.genres.genres == ["Action", "Comedy", "Drama"]
+    # The duplicate (30, Drama) row counts once; unknown movie ids are ignored
+    np.testing.assert_array_equal(
+        store.genres.histogram(np.array([10, 20, 30, 999])), [1, 1, 3]
+    )
+    assert store.genres.top_genres(np.array([10, 30]), 2) == ["Drama", "Action"]
+    assert store.genres.top_genres(np.array([999]), 2) == []
+
+
+def test_delta_overrides_snapshot_ratings(tmp_path: Path) -> None:
+    store = RatingStore(build_snapshot(tmp_path))
+    before = store.user_ratings(3)
+
+    # key_id order: user 3 re-rates movie 10 twice, rates movie 40; user 5 is new
+    store.apply_delta(
+        [(6, 3, 10, 3.0), (7, 3, 40, 4.5), (8, 5, 10, 5.0), (9, 3, 10, 4.0)]
+    )
+    movie_ids, ratings = store.user_ratings(3)
+    np.testing.assert_array_equal(movie_ids, [10, 20, 40])
+    np.testing.assert_array_equal(ratings, [4.0, 3.5, 4.5])
+    np.testing.assert_array_equal(store.user_ratings(5)[0], [10])
+    assert store.watermark == 9
+    assert store.stats()["delta_users"] == 2
+
+    # Arrays handed out earlier are not changed by the delta
+    np.testing.assert_array_equal(before[0], [10, 20])
+
+
+def test_large_delta_recommends_a_new_snapshot(tmp_path: Path, caplog) -> None:
+    store = RatingStore(build_snapshot(tmp_path), max_delta_rows=2)
+    store.apply_delta([(6, 3, 10, 3.0), (7, 3, 40, 4.5)])
+    assert not store.rebuild_recommended
+    store.apply_delta([(8, 5, 10, 5.0)])
+    store.apply_delta([(9, 5, 20, 5.0)])
+    assert store.stats()["rebuild_recommended"]
+    assert (
+        sum("build_rating_snapshot" in record.message for record in caplog.records) == 1
+    )
+
+
+class FakeSession:
+    """
+    stg_rating rows that become visible (commit) over time, in any key_id order.
+    """
+
+    def __init__(self) -> None:
+        self.rows: list[tuple] = []
+
+    def execute(self, _query, params: dict) -> "FakeSession":
+        self.result = sorted(row for row in self.rows if row[0] > params["watermark"])
+        return self
+
+    def fetchall(self) -> list[tuple]:
+        return self.result
+
+
+def test_refresh_rereads_the_lag_window_for_late_commits(tmp_path: Path) -> None:
+    store = RatingStore(build_snapshot(tmp_path), lag_keys=3)
+    session = FakeSession()
+
+    # key 7 is inserted before key 8 but commits after it; user 3 re-rates movie 10 at key 9
+    session.rows = [(6, 3, 40, 4.5), (8, 5, 10, 5.0), (9, 3, 10, 1.0)]
+    store.refresh_delta(session, max_age=0)
+    session.rows.append((7, 3, 10, 3.0))
+    store.refresh_delta(session, max_age=0)
+
+    np.testing.assert_array_equal(store.user_ratings(5)[0], [10])
+    # The late row is read, but the later key_id 9 still decides movie 10's rating
+    movie_ids, ratings = store.user_ratings(3)
+    np.testing.assert_array_equal(movie_ids, [10, 20, 40])
+    np.testing.assert_array_equal(ratings, [1.0, 3.5, 4.5])
+    assert store.stats()["delta_rows"] == 4
+
+    # Without a lag window the late row is skipped
+    store = RatingStore(build_snapshot(tmp_path / "no-lag"))
+    session.rows = [(6, 3, 40, 4.5), (8, 5, 10, 5.0)]
+    store.refresh_delta(session, max_age=0)
+    session.rows.append((7, 5, 30, 2.0))
+    store.refresh_delta(session, max_age=0)
+    np.testing.assert_array_equal(store.user_ratings(5)[0], [10])
@@ -0,0 +1,116 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from app.core.artifacts import build_version, publish_build
+from app.core.matrix_factorization import ItemFactorIndex, SVDFactors
+from app.core.ratings import rating_matrix_from_arrays
+from app.core.user_topn import (
+    META_FILE,
+    MOVIE_IDS_FILE,
+    SCORES_FILE,
+    USER_ROWS_FILE,
+    UserTopNStore,
+    score_users,
+)
+from app.tests.core.test_matrix_factorization import train_svd
+
+
+def test_rating_matrix_groups_ratings_by_user() -> None:
+    ratings = rating_matrix_from_arrays(
+        np.array([5, 2, 5, 2, 9]),
+        np.array([30, 10, 20, 40, 10]),
+        np.array([1.0, 2.0, 3.0, 4.0, 5.0]),
+    )
+
+    assert ratings.user_ids.tolist() == [2, 5, 9]
+    movie_ids, values = ratings.user_ratings(5)
+    assert movie_ids.tolist() == [20, 30] and values.tolist() == [3.0, 1.0]
+    assert len(ratings.user_ratings(7)[0]) == 0
+
+
+def test_block_scores_match_item_index_retrieval() -> None:
+    factors = SVDFactors.from_surprise(train_svd(biased=True))
+    index = ItemFactorIndex(factors)
+    item_ids = factors.item_ids()
+    users = [1, 30, 59]
+    rated = [item_ids[i * 10 : i * 10 + 15] for i in range(len(users))]
+
+    movie_ids, scores = score_users(
+        factors,
+        np.array([factors.user_row(u) for u in users]),
+        [factors.item_rows_of(r) for r in rated],
+        item_ids,
+        top_n=10,
+    )
+
+    for row, user_id in enumerate(users):
+        expected_ids, expected_scores = index.top_items(
+            factors.trained_user(user_id), 10, exclude=rated[row]
+        )
+        np.testing.assert_allclose(scores[row], expected_scores, rtol=1e-5)
+        assert not np.isin(movie_ids[row], rated[row]).any()
+
+
+def test_store_and_live_retrieval_rank_ceiling_ties_alike() -> None:
+    factors = SVDFactors.from_surprise(train_svd(biased=True))
+    # Most predictions now exceed the rating scale and clip to its maximum
+    factors.global_mean += 3.0
+    index = ItemFactorIndex(factors)
+    item_ids = factors.item_ids()
+    rated = item_ids[:5]
+
+    movie_ids, scores = score_users(
+        factors,
+        np.array([factors.user_row(1)]),
+        [factors.item_rows_of(rated)],
+        item_ids,
+        top_n=10,
+    )
+    expected_ids, expected_scores = index.top_items(
+        factors.trained_user(1), 10, exclude=rated
+    )
+    np.testing.assert_array_equal(movie_ids[0], expected_ids)
+    np.testing.assert_allclose(scores[0], expected_scores, rtol=1e-6)
+    # All tied at the ceiling: the lowest unrated movie ids
+    assert (scores[0] == factors.rating_scale[1]).all()
+    np.testing.assert_array_equal(
+        movie_ids[0], np.sort(item_ids[~np.isin(item_ids, rated)])[:10]
+    )
+
+
+def write_build(path: Path, user_rows: np.ndarray, movie_ids: np.ndarray) -> str:
+    path.mkdir()
+    np.save(path / USER_ROWS_FILE, user_rows)
+    np.save(path / MOVIE_IDS_FILE, movie_ids.astype(np.int32))
+    np.save(path / SCORES_FILE, np.full(movie_ids.shape, 4.5, dtype=np.float32))
+    (path / META_FILE).write_text(json.dumps({"top_n": movie_ids.shape[1]}))
+    return str(path)
+
+
+def test_store_lookup_and_atomic_publish(tmp_path: Path) -> None:
+    link = str(tmp_path / "user-topn")
+    assert build_version(link) is None
+
+    first = write_build(
+        tmp_path / "user-topn.1",
+        np.array([-1, 0, -1, 1]),
+        np.array([[7, 8, -1], [9, 7, 8]]),
+    )
+    publish_build(first, link)
+    store = UserTopNStore(link)
+    assert store.get(1, 3)[0].tolist() == [7, 8]
+    assert store.get(3, 2)[0].tolist() == [9, 7]
+    assert (
+        store.get(2, 3) is None and store.get(10, 3) is None and store.get(1, 4) is None
+    )
+
+    second = write_build(tmp_path / "user-topn.2", np.array([0]), np.array([[5, 6, 7]]))
+    third = write_build(tmp_path / "user-topn.3", np.array([0]), np.array([[1, 2, 3]]))
+    publish_build(second, link)
+    publish_build(third, link, keep=2)
+    assert build_version(link) == os.path.realpath(third)
+    assert UserTopNStore(link).get(0, 3)[0].tolist() == [1, 2, 3]
+    assert sorted(os.listdir(tmp_path)) == ["user-topn", "user-topn.2", "user-topn.3"]
@@ -0,0 +1,47 @@
+import argparse
+import logging
+
+from sentence_transformers import SentenceTransformer
+from sqlmodel import Session
+
+from app import constants
+from app.core.db import engine
+from app.core.index_updates import delete_movies, encode_movies, upsert_movies
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Add, replace or remove individual movies in the FAISS indices"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    upsert_parser = subparsers.add_parser(
+        "upsert", help="Encode movies from the database and upsert them"
+    )
+    upsert_parser.add_argument("movie_ids", type=int, nargs="+")
+    delete_parser = subparsers.add_parser(
+        "delete", help="Remove movies from the indices"
+    )
+    delete_parser.add_argument("movie_ids", type=int, nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "upsert":
+        model = SentenceTransformer(
+            constants.EmbeddingModelConstants.MODEL_SENTENCE_TRANSFORMER
+        )
+        with Session(engine) as session:
+            ids, vectors = encode_movies(session, model, args.movie_ids)
+        missing = sorted(set(args.movie_ids) - set(ids.tolist()))
+        if missing:
+            logger.warning(f"Not in stg_movie_metadata, skipped: {missing}")
+        added = upsert_movies(ids, vectors)
+        logger.info(f"{added} movies added, {len(ids) - added} updated")
+    else:
+        removed = delete_movies(args.movie_ids)
+        logger.info(f"{removed} movies removed")
+
+
+if __name__ == "__main__":
+    main()